@@ -0,0 +1,137 @@
+"""
+Fast JSON serialization and compression of API responses
+orjson (when installed) behind Flask's JSON provider, negotiated gzip/brotli
+for large responses, and per-endpoint metrics in flexibee_telemetry
+"""
+
+import gzip
+import time
+
+from flask import request, has_request_context, g
+from flask.json.provider import DefaultJSONProvider
+
+import flexibee_telemetry as telemetry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller responses fit in a packet or two - compressing them isn't worth it
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/csv')
+
+
+def _endpoint():
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    return 'other'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Same output as the default provider, produced by orjson where it can be.
+    Falls back to the json module for unusual arguments or types orjson rejects.
+    """
+
+    def _orjson_dumps(self, obj, kwargs):
+        indent = kwargs.pop('indent', None)
+        separators = kwargs.pop('separators', None)
+        if kwargs or indent not in (None, 2) or separators not in (None, (',', ':')):
+            return None
+
+        # Flask formats datetimes and dataclasses its own way - keep that
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            return None
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            text = self._orjson_dumps(obj, dict(kwargs)) if orjson is not None else None
+            if text is None:
+                text = super().dumps(obj, **kwargs)
+            return text
+        finally:
+            telemetry.observe('api_serialize', _endpoint(), time.perf_counter() - start)
+
+
+def accepted_encoding():
+    """Best encoding the client accepts ('br', 'gzip' or None)"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    """Compress bytes with 'br' or 'gzip' (None = unchanged)"""
+    start = time.perf_counter()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    else:
+        return data
+    telemetry.observe('api_compress', _endpoint(), time.perf_counter() - start)
+    return data
+
+
+def etag_variants(etag):
+    """ETags a representation of etag may carry after compression"""
+    return (etag, f"{etag}-gzip", f"{etag}-br")
+
+
+def record_response(response, raw_size):
+    """Record response size metrics (before / after compression)"""
+    endpoint = _endpoint()
+    telemetry.observe('api_response_bytes', endpoint, raw_size)
+    telemetry.observe('api_sent_bytes', endpoint, response.content_length or 0)
+
+
+def init_api_responses(app):
+    """
+    Install the orjson provider and the compression hook
+
+    Responses already encoded by the view (e.g. cached_json) are only measured;
+    such views put the uncompressed size into g.uncompressed_length.
+    """
+    app.json = FastJSONProvider(app)
+
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+                or request.method == 'HEAD' or request.endpoint == 'static'):
+            return response
+        if 'Content-Encoding' in response.headers:
+            record_response(response, g.get('uncompressed_length', 0))
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        data = response.get_data()
+        encoding = accepted_encoding() if len(data) >= COMPRESS_MIN_SIZE else None
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.set_data(compress(data, encoding))
+            response.headers['Content-Encoding'] = encoding
+            etag, weak = response.get_etag()
+            if etag:
+                response.set_etag(f"{etag}-{encoding}", weak)
+        record_response(response, len(data))
+        return response
@@ -1,9 +1,12 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, Response, g
 import pandas as pd
+import numpy as np
 import os
 import json
 from datetime import datetime
 import uuid
+import hashlib
+import bisect
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 import schedule
@@ -14,15 +17,26 @@ import threading
 from db_wrapper import (
     load_transactions, save_transactions, 
     get_initial_balance, set_initial_balance,
+    amount_to_minor, minor_to_amount, get_data_version, get_changes_since,
     load_users, save_users,
     log_audit, get_audit_log
 )
 
+from ledger_snapshot import get_ledger_snapshot
+from result_cache import result_cache
+from change_feed import change_notifier
+from static_assets import init_static_assets
+from api_responses import init_api_responses, accepted_encoding, compress, etag_variants, COMPRESS_MIN_SIZE
+
 # Optional: Import webhook handler for real-time FlexiBee sync
 # Uncomment the following line to enable webhooks:
 # from flexibee_webhooks import init_webhooks
 
 app = Flask(__name__)
+# ?v=<content hash> on url_for('static', ...) links, served with immutable caching
+init_static_assets(app)
+# orjson serialization + gzip/brotli for large API responses
+init_api_responses(app)
 app.secret_key = 'your-secret-key-change-this-in-production'  # Change this!
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -528,7 +542,7 @@ def upload_csv():
                      duplicates_summary.append(f"Vydané: Přeskočeno {len(duplicates)} duplicit (VS: {', '.join(duplicates[:3])}...)")
         
         # Save updated transactions to DATABASE
-        save_transactions(transactions)
+        save_transactions(transactions, 'upload_file', session.get('username'), {"files": uploaded_files})
         
         final_message = f"Soubory nahrány: {', '.join(uploaded_files)}. Importováno {imported_count} transakcí."
         if duplicates_summary:
@@ -594,7 +608,7 @@ def restore_backup_endpoint():
          pass 
     
     try:
-        from database import restore_backup, BACKUP_DIR
+        from database import restore_backup, backup_exists, BACKUP_DIR
         
         if 'file' in request.files:
             # Upload and restore from uploaded file
@@ -603,10 +617,16 @@ def restore_backup_endpoint():
                 return jsonify({"status": "error", "message": "Nebyl vybrán žádný soubor"}), 400
             
             if file.filename.endswith('.db'):
-                temp_path = os.path.join(BACKUP_DIR, f'uploaded_{file.filename}')
+                # .tmp - the backup store would otherwise pick it up as a legacy backup
+                temp_path = os.path.join(BACKUP_DIR, f'uploaded_{uuid.uuid4().hex}.tmp')
                 file.save(temp_path)
                 
-                if restore_backup(temp_path):
+                try:
+                    restored = restore_backup(temp_path)
+                finally:
+                    os.remove(temp_path)
+
+                if restored:
                     log_audit("restore_backup", {"by": session.get('username'), "source": "upload"})
                     return jsonify({"status": "success", "message": "Záloha byla úspěšně obnovena ze souboru."})
                 else:
@@ -617,12 +637,11 @@ def restore_backup_endpoint():
         elif 'filename' in request.json:
             # Restore from existing backup
             filename = request.json['filename']
-            backup_path = os.path.join(BACKUP_DIR, filename)
             
-            if not os.path.exists(backup_path):
+            if not backup_exists(filename):
                 return jsonify({"status": "error", "message": "Soubor zálohy neexistuje"}), 404
 
-            if restore_backup(backup_path):
+            if restore_backup(filename):
                 log_audit("restore_backup", {"by": session.get('username'), "source": filename})
                 return jsonify({"status": "success", "message": "Záloha byla úspěšně obnovena."})
             else:
@@ -655,74 +674,209 @@ def backup_config():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+def cached_json(key, compute):
+    """
+    JSON response served from result_cache while the ledger data version is unchanged
+
+    The strong ETag is derived from the data version and the key alone, so a
+    matching If-None-Match is answered with 304 before anything is computed.
+
+    Args:
+        key: Query key (endpoint name + parameters the result depends on)
+        compute: Callable returning the JSON-serializable result
+    """
+    version = get_data_version()
+    etag = f"{version}-{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]}"
+
+    # Compressed representations carry their own ETag variant
+    matched = next((e for e in etag_variants(etag) if request.if_none_match.contains(e)), None)
+    if matched:
+        response = Response(status=304)
+        response.set_etag(matched)
+    else:
+        payload = result_cache.get_or_compute(
+            key, version, lambda: app.json.dumps(compute()).encode('utf-8'))
+        g.uncompressed_length = len(payload)
+        encoding = accepted_encoding() if len(payload) >= COMPRESS_MIN_SIZE else None
+        if encoding:
+            # The compressed variant is cached too
+            raw = payload
+            payload = result_cache.get_or_compute((key, encoding), version, lambda: compress(raw, encoding))
+            etag = f"{etag}-{encoding}"
+        response = Response(payload, mimetype='application/json')
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # The browser may keep the payload but has to revalidate it on every use
+    response.headers["Cache-Control"] = "private, no-cache"
+    g.keep_cache_control = True
+    return response
+
 @app.route('/api/calendar_data', methods=['GET'])
 @login_required
 def calendar_data():
-    transactions = load_transactions()
+    company = request.args.get('company', '')
+    today = datetime.now().strftime('%Y-%m-%d')
+    # "Current balance" depends on today's date as well
+    return cached_json(('calendar', company, today), lambda: _calendar_result(company, today))
+
+def _daily_balances(snapshot, company, today_str):
+    """
+    Day totals and running balances of one company view
+
+    Returns:
+        dict: idx, starts (see LedgerSnapshot.daily_totals), dates (one per day),
+              income, expense, balances (int64 haléře per day),
+              initial_balance, current_total_balance (haléře)
+    """
     initial_balance = get_initial_balance()
     
-    # Sort transactions by date
-    transactions.sort(key=lambda x: x['date'])
+    # Rows grouped by day; income (by due date) and expenses (paid or unpaid) in haléře,
+    # archived transactions are listed but not counted
+    idx, starts, income, expense = snapshot.daily_totals(snapshot.company_mask(company))
     
-    # Create a map of all dates with transactions
-    all_dates = sorted(list(set(t['date'] for t in transactions)))
-    date_map = {d: {'income': 0, 'expense': 0, 'transactions': []} for d in all_dates}
+    # Running balance chronologically (integer haléře - no float drift)
+    initial_minor = amount_to_minor(initial_balance)
+    balances = initial_minor + np.cumsum(income - expense)
     
-    # Process transactions
-    
-    for i, t in enumerate(transactions):
-        d = t['date']
-        if d not in date_map:
-             continue
-        date_map[d]['transactions'].append(t)
-
-        status = str(t.get('payment_status', '')).lower().strip()
-        if status == 'archiv':
-            continue
-            
-        if t['amount'] > 0:
-            # Income: Always count (based on due date)
-            date_map[d]['income'] += t['amount']
-        else:
-            # Expense: Always count (paid or unpaid)
-            date_map[d]['expense'] += abs(t['amount'])
-            
-    # Calculate running balance chronologically
-    running_balance = initial_balance
-    response_days = {}
-    
-    # Determine "Current Balance" (balance as of Today)
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    current_total_balance = initial_balance
-    
-    # Sort dates to be sure
-    sorted_dates_list = sorted(date_map.keys())
-    
-    for date in sorted_dates_list:
-        day_data = date_map[date]
-        net_change = day_data['income'] - day_data['expense']
-        running_balance += net_change
-        
-        # Update current_total_balance if date is today or earlier
-        if date <= today_str:
-            current_total_balance = running_balance
-        
-        response_days[date] = {
-            "balance": running_balance,
-            "income": day_data['income'],
-            "expense": day_data['expense'],
-            "transactions": day_data['transactions']
-        }
-
+    # Determine "Current Balance" (balance as of the last day up to today)
+    today = np.datetime64(today_str, 'D').astype(np.int32)
+    past_days = int(np.searchsorted(snapshot.day[idx[starts]], today, side='right')) if len(idx) else 0
+    current_total_balance = int(balances[past_days - 1]) if past_days else initial_minor
     # If there are no transactions today or later, current balance is the final running balance
-    if not sorted_dates_list or sorted_dates_list[-1] <= today_str:
-        current_total_balance = running_balance
-
-    return jsonify({
+    if len(balances) and past_days == len(balances):
+        current_total_balance = int(balances[-1])
+
+    return {
+        "idx": idx,
+        "starts": starts,
+        "dates": [snapshot.date[i] for i in idx[starts]],
+        "income": income,
+        "expense": expense,
+        "balances": balances,
         "initial_balance": initial_balance,
-        "current_total_balance": current_total_balance, 
-        "daily_status": response_days
+        "current_total_balance": current_total_balance
+    }
+
+def _day_entry(snapshot, daily, day):
+    """daily_status entry of the day-th day of a _daily_balances() result"""
+    idx, starts = daily["idx"], daily["starts"]
+    end = starts[day + 1] if day + 1 < len(starts) else len(idx)
+    return {
+        "balance": minor_to_amount(int(daily["balances"][day])),
+        "income": minor_to_amount(int(daily["income"][day])),
+        "expense": minor_to_amount(int(daily["expense"][day])),
+        "transactions": snapshot.transactions(idx[starts[day]:end])
+    }
+
+def _calendar_result(company, today_str):
+    snapshot = get_ledger_snapshot()
+    daily = _daily_balances(snapshot, company, today_str)
+    response_days = {date: _day_entry(snapshot, daily, day) for day, date in enumerate(daily["dates"])}
+
+    return {
+        "initial_balance": daily["initial_balance"],
+        "current_total_balance": minor_to_amount(daily["current_total_balance"]), 
+        "daily_status": response_days,
+        "data_version": snapshot.version
+    }
+
+def _changes_result(company, since, today_str):
+    """
+    Delta bringing a calendar_data result at data version since up to date
+
+    Only the days touched by the journaled changes are sent in full; later
+    days just get their new running balance.
+
+    Returns:
+        dict: since, version, reset (True = reload /api/calendar_data instead),
+              changed (transaction ids), days ({date: daily_status entry or None
+              when the day has no transactions left}), balances ({date: balance}
+              of the other days after the first changed one), initial_balance,
+              current_total_balance
+    """
+    snapshot = get_ledger_snapshot()
+    result = {"since": since, "version": snapshot.version, "reset": False}
+    changes = get_changes_since(since, snapshot.version)
+    if changes is None:
+        result["reset"] = True
+        return result
+
+    daily = _daily_balances(snapshot, company, today_str)
+    positions = {date: day for day, date in enumerate(daily["dates"])}
+    touched = sorted(changes["dates"])
+    days = {date: (_day_entry(snapshot, daily, positions[date]) if date in positions else None)
+            for date in touched}
+    balances = {}
+    if touched:
+        first = bisect.bisect_left(daily["dates"], touched[0])
+        for day in range(first, len(daily["dates"])):
+            date = daily["dates"][day]
+            if date not in days:
+                balances[date] = minor_to_amount(int(daily["balances"][day]))
+
+    result.update({
+        "changed": changes["row_ids"],
+        "days": days,
+        "balances": balances,
+        "initial_balance": daily["initial_balance"],
+        "current_total_balance": minor_to_amount(daily["current_total_balance"])
     })
+    return result
+
+# Server-sent events: keep-alive comment interval and stream lifetime
+# (EventSource reconnects with Last-Event-ID). Each open stream holds a server
+# thread - change_feed.CHANGES_MAX_STREAMS caps them, the rest poll.
+CHANGES_HEARTBEAT_INTERVAL = 15.0
+CHANGES_STREAM_MAX_SECONDS = 300
+
+def _changes_stream(company, since):
+    """text/event-stream generator: one 'delta' event per data version change"""
+    yield "retry: 3000\n\n"
+    started = time.monotonic()
+    while time.monotonic() - started < CHANGES_STREAM_MAX_SECONDS:
+        # Woken by the shared notifier - no per-stream database polling
+        version = change_notifier.wait_for_change(since, CHANGES_HEARTBEAT_INTERVAL)
+        if version == since:
+            yield ": keep-alive\n\n"
+            continue
+        today = datetime.now().strftime('%Y-%m-%d')
+        delta = _changes_result(company, since, today)
+        yield f"id: {delta['version']}\nevent: delta\ndata: {app.json.dumps(delta)}\n\n"
+        if delta["reset"]:
+            return
+        since = delta["version"]
+
+@app.route('/api/changes', methods=['GET'])
+@login_required
+def ledger_changes():
+    """
+    Calendar deltas since a data version (calendar_data returns data_version)
+
+    Accept: text/event-stream opens a live stream of 'delta' events,
+    otherwise one JSON delta is returned (polling fallback, also used
+    when all stream slots are taken - answered with 503).
+    """
+    company = request.args.get('company', '')
+    since = request.headers.get('Last-Event-ID') or request.args.get('since', '')
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Neplatná verze dat (since)"}), 400
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        if not change_notifier.subscribe():
+            return jsonify({"status": "error", "message": "Příliš mnoho otevřených spojení"}), 503
+        response = Response(_changes_stream(company, since), mimetype='text/event-stream')
+        response.call_on_close(change_notifier.unsubscribe)
+        response.headers["Cache-Control"] = "no-cache"
+        # Don't let a reverse proxy buffer the stream
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    return cached_json(('changes', since, company, today), lambda: _changes_result(company, since, today))
 
 @app.route('/api/search', methods=['GET'])
 @login_required
@@ -731,19 +885,15 @@ def search_transactions():
     if not query:
         return jsonify([])
     
-    transactions = load_transactions()
-    results = []
-    
-    for t in transactions:
-        vs = str(t.get('var_symbol', '')).lower()
-        party = str(t.get('supplier', '') or t.get('customer', '')).lower()
-        desc = str(t.get('description', '')).lower()
-        
-        if query in vs or query in party or query in desc:
-            results.append(t)
-            
-    results.sort(key=lambda x: x['date'], reverse=True)
-    return jsonify(results)
+    company = request.args.get('company', '')
+
+    def compute():
+        snapshot = get_ledger_snapshot()
+        # Matches in variable symbol, counterparty or description, newest first
+        hits = snapshot.search(query, snapshot.company_mask(company))
+        return snapshot.transactions(hits)
+
+    return cached_json(('search', query, company), compute)
 
 @app.route('/api/update_transaction', methods=['POST'])
 @login_required
@@ -785,7 +935,7 @@ def update_transaction():
                 break
         
         if updated:
-            save_transactions(transactions)
+            save_transactions(transactions, 'update_transaction', session.get('username'), {"id": t_id})
             log_audit("update_transaction", {"id": t_id, "changes": data})
             return jsonify({"status": "success"})
         else:
@@ -810,7 +960,7 @@ def delete_transaction():
         new_transactions = [t for t in transactions if t['id'] != t_id]
         
         if len(new_transactions) < len(transactions):
-            save_transactions(new_transactions)
+            save_transactions(new_transactions, 'delete_transaction', session.get('username'), {"id": t_id})
             log_audit("delete_transaction", {"id": t_id, "by": session.get('username')})
             return jsonify({"status": "success"})
         else:
@@ -857,20 +1007,19 @@ def reset_db():
         
     try:
         # Clear transactions
-        save_transactions([])
+        save_transactions([], 'reset_db', session.get('username'))
         # Reset balance
         set_initial_balance(0)
         
-        # Reset FlexiBee last_sync so next sync reimports everything
+        # Reset FlexiBee sync cursors so next sync reimports everything
         try:
             from flexibee_sync import FlexiBeeConnector
             connector = FlexiBeeConnector()
             if connector.config:
-                connector.config['last_sync'] = ''
-                connector.save_config(connector.config)
-                print("FlexiBee last_sync reset after DB clear")
+                connector.reset_sync_state(all_companies=True)
+                print("FlexiBee sync cursors reset after DB clear")
         except Exception as fe:
-            print(f"Could not reset FlexiBee last_sync: {fe}")
+            print(f"Could not reset FlexiBee sync cursors: {fe}")
         
         log_audit("reset_db", {"by": session.get('username')})
         return jsonify({"status": "success"})
@@ -928,11 +1077,38 @@ def delete_file():
 def get_audit_log_endpoint():
     # Removed admin check
     try:
-        logs = get_audit_log(100)
-        return jsonify(logs)
+        from db_wrapper import query_audit_log
+        limit = min(int(request.args.get('limit', 100)), 500)
+        logs, next_cursor = query_audit_log(
+            limit,
+            cursor=request.args.get('cursor') or None,
+            username=request.args.get('user') or None,
+            action=request.args.get('action') or None,
+            date_from=request.args.get('from') or None,
+            date_to=request.args.get('to') or None
+        )
+        return jsonify({"status": "success", "logs": logs, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Neplatný parametr: {e}"}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/audit_log/archives', methods=['GET'])
+@login_required
+def list_audit_archives():
+    """Monthly archives of audit entries past the retention period"""
+    from db_wrapper import get_audit_archives
+    return jsonify({"status": "success", "archives": get_audit_archives()})
+
+@app.route('/api/audit_log/archives/<filename>', methods=['GET'])
+@login_required
+def download_audit_archive(filename):
+    from database import AUDIT_ARCHIVE_DIR
+    from db_wrapper import get_audit_archives
+    if filename not in {a['filename'] for a in get_audit_archives()}:
+        return jsonify({"status": "error", "message": "Archiv neexistuje"}), 404
+    return send_file(os.path.join(AUDIT_ARCHIVE_DIR, filename), as_attachment=True)
+
 def get_local_ip():
     """Get local IP address"""
     import socket
@@ -947,9 +1123,10 @@ def get_local_ip():
 
 def scheduled_backup():
     try:
-        from database import create_backup
+        from database import create_backup, cleanup_old_backups, load_backup_config
         print("Running scheduled backup...")
         create_backup()
+        cleanup_old_backups(load_backup_config().get('max_backups', 30))
         # log_audit might fail if outside context? No, it uses get_db logic.
         from db_wrapper import log_audit
         log_audit("scheduled_backup", {"status": "success"})
@@ -960,6 +1137,20 @@ def scheduled_backup():
             log_audit("scheduled_backup", {"status": "failed", "error": str(e)})
         except: pass
 
+def scheduled_audit_archive():
+    try:
+        from db_wrapper import archive_audit_log
+        archive_audit_log()
+    except Exception as e:
+        print(f"Audit log archiving failed: {e}")
+
+def scheduled_journal_prune():
+    try:
+        from db_wrapper import prune_change_journal
+        prune_change_journal()
+    except Exception as e:
+        print(f"Change journal pruning failed: {e}")
+
 def run_schedule():
     while True:
         schedule.run_pending()
@@ -978,13 +1169,16 @@ def api_create_backup():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# Disable Caching
+# Disable Caching (unless the view opted into its own policy via g.keep_cache_control,
+# i.e. ETag-validated JSON and fingerprinted static files)
 @app.after_request
 def add_header(response):
     """
-    Add headers to both force latest IE rendering engine or Chrome Frame,
-    and also to cache the rendered page for 10 minutes.
+    Responses are never stored by the browser - send_file downloads too,
+    which Flask only marks no-cache - unless the view set g.keep_cache_control.
     """
+    if g.get('keep_cache_control'):
+        return response
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
@@ -995,16 +1189,17 @@ def add_header(response):
 def api_list_backups():
     # Removed admin check
     try:
-        backup_dir = os.path.join(DATA_DIR, 'backups')
-        if not os.path.exists(backup_dir): os.makedirs(backup_dir)
+        from database import get_backups
         backups = []
-        for f in os.listdir(backup_dir):
-            if f.endswith('.db'):
-                path = os.path.join(backup_dir, f)
-                size = os.path.getsize(path) / 1024 # KB
-                created = datetime.fromtimestamp(os.path.getctime(path)).strftime('%Y-%m-%d %H:%M:%S')
-                backups.append({"filename": f, "size": f"{size:.1f} KB", "created": created})
-        backups.sort(key=lambda x: x['created'], reverse=True)
+        # Manifest of the backup store - no per-file stat
+        for b in get_backups():
+            created = datetime.fromisoformat(b['created']).strftime('%Y-%m-%d %H:%M:%S')
+            backups.append({
+                "filename": b['filename'],
+                "size": f"{b['size'] / 1024:.1f} KB",
+                "stored": f"{b['stored'] / 1024:.1f} KB",
+                "created": created
+            })
         return jsonify({"status": "success", "backups": backups})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1014,11 +1209,75 @@ def api_list_backups():
 def api_download_backup(filename):
     # Removed admin check
     try:
-        backup_dir = os.path.join(DATA_DIR, 'backups')
-        return send_file(os.path.join(backup_dir, filename), as_attachment=True)
+        from database import backup_exists, iter_backup
+        if not backup_exists(filename):
+            return jsonify({"status": "error", "message": "Soubor zálohy neexistuje"}), 404
+        # Reassembled from the chunk store while streaming
+        return Response(iter_backup(filename), mimetype='application/octet-stream',
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 404
 
+# --- Change journal (undo / point-in-time recovery) ---
+@app.route('/api/journal/batches', methods=['GET'])
+@login_required
+def api_journal_batches():
+    """Recent change batches (imports, syncs, edits) that can be undone"""
+    try:
+        from db_wrapper import get_change_batches
+        limit = min(int(request.args.get('limit', 50)), 500)
+        return jsonify({"status": "success", "batches": get_change_batches(limit)})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/journal/undo', methods=['POST'])
+@login_required
+def api_journal_undo():
+    """Undo one change batch - {"batch_id": 12, "force": false}"""
+    try:
+        from db_wrapper import undo_change_batch
+        data = request.json or {}
+        if not data.get('batch_id'):
+            return jsonify({"status": "error", "message": "Chybí batch_id"}), 400
+
+        result = undo_change_batch(int(data['batch_id']), session.get('username'), bool(data.get('force')))
+        if result['status'] == 'error':
+            return jsonify(result), 404
+        if result['status'] == 'conflict':
+            result['message'] = f"{len(result['conflicts'])} záznamů bylo od té doby změněno - použijte force pro přepsání"
+            return jsonify(result), 409
+
+        log_audit("undo_change_batch", {"batch_id": data['batch_id'], "reverted": result['reverted'],
+                                        "by": session.get('username')})
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/journal/restore', methods=['POST'])
+@login_required
+def api_journal_restore():
+    """Point-in-time recovery - {"timestamp": "2025-03-01T12:00:00", "dry_run": false}"""
+    try:
+        from db_wrapper import restore_point_in_time
+        data = request.json or {}
+        timestamp = data.get('timestamp')
+        try:
+            timestamp = datetime.fromisoformat(timestamp).isoformat()
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "Neplatný čas (očekáváno ISO, např. 2025-03-01T12:00:00)"}), 400
+
+        try:
+            result = restore_point_in_time(timestamp, session.get('username'), bool(data.get('dry_run')))
+        except ValueError as e:
+            # Older than the journal retention
+            return jsonify({"status": "error", "message": str(e)}), 400
+        if not data.get('dry_run'):
+            log_audit("point_in_time_restore", {"timestamp": timestamp, "reverted": result['reverted'],
+                                                "by": session.get('username')})
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/add_transaction', methods=['POST'])
 @login_required
 def add_transaction():
@@ -1051,7 +1310,7 @@ def add_transaction():
         }
         
         transactions.append(new_t)
-        save_transactions(transactions)
+        save_transactions(transactions, 'add_transaction', session.get('username'), {"id": new_t['id']})
         log_audit("add_transaction", {"id": new_t['id'], "amount": new_t['amount']})
         
         return jsonify({"status": "success"})
@@ -1105,24 +1364,28 @@ def flexibee_config():
             if 'password_encrypted' in config:
                 config = config.copy()
                 config.pop('password_encrypted', None)
+            # Further companies are managed via /api/flexibee/companies (never return their passwords)
+            if config.get('companies'):
+                config['companies'] = [{k: v for k, v in c.items() if k != 'password'} for c in config['companies']]
             return jsonify(config)
         else:
             data = request.json
-            # If import_from_date changed, reset last_sync so next sync uses the new date
+            data.pop('companies', None)
+            # If import_from_date changed, reset sync cursors so next sync uses the new date
             old_config = connector.load_config()
             old_date = old_config.get('import_from_date', '')
             new_date = data.get('import_from_date', '')
-            if new_date and new_date != old_date:
-                data['last_sync'] = ''
-                print(f"import_from_date changed ({old_date} -> {new_date}), resetting last_sync")
             connector.save_config(data)
+            if new_date and new_date != old_date:
+                connector.reset_sync_state(all_companies=True)
+                print(f"import_from_date changed ({old_date} -> {new_date}), sync cursors reset")
             log_audit("update_flexibee_config", {"by": session.get('username')})
             
             # Update scheduler
             global flexibee_job
             if data.get('enabled'):
                 if not flexibee_job:
-                     flexibee_job = schedule.every(1).hours.do(run_flexibee_sync_job)
+                     flexibee_job = schedule.every(FLEXIBEE_SCHEDULER_TICK_MINUTES).minutes.do(run_flexibee_sync_job)
                      print("FlexiBee sync scheduled.")
             else:
                 if flexibee_job:
@@ -1163,62 +1426,191 @@ def flexibee_test():
 @login_required
 def flexibee_sync_endpoint():
     try:
-        from flexibee_sync import FlexiBeeConnector
+        from flexibee_sync import FlexiBeeConnector, sync_companies
         connector = FlexiBeeConnector()
         
         data = request.get_json(silent=True) or {}
         
-        # Support force=true to reset last_sync before syncing
+        # Support force=true to reset sync cursors before syncing
         if data.get('force') or request.args.get('force') == 'true':
-            connector.config['last_sync'] = ''
-            connector.save_config(connector.config)
-            print("Force sync: last_sync reset")
+            connector.reset_sync_state(all_companies=True)
+            print("Force sync: sync cursors reset")
         
         # Read import_from_date from request body (sent directly from UI field)
         import_from_date_override = data.get('import_from_date', '').strip() or None
         if import_from_date_override:
             print(f"Sync with import_from_date override from UI: {import_from_date_override}")
         
-        result = connector.sync_invoices(import_from_date_override=import_from_date_override)
-        log_audit("flexibee_sync_manual", result)
+        # All configured companies are synced in parallel (or only those listed in the request)
+        result = sync_companies(data.get('companies') or None, import_from_date_override=import_from_date_override)
+        # Summary only - per-company details are in the response and the sync cursors
+        log_audit("flexibee_sync_manual", {
+            "by": session.get('username'),
+            "status": result.get('status'),
+            "total_synced": result.get('total_synced', 0),
+            "errors": {code: r.get('error') for code, r in result.get('companies', {}).items() if r.get('error')}
+        })
         return jsonify({"status": "success", "details": result})
     except Exception as e:
         print(e)
         import traceback; traceback.print_exc()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/flexibee/bootstrap', methods=['POST'])
+@login_required
+def flexibee_bootstrap_endpoint():
+    """Initial load of invoices from an offline FlexiBee export (winstrom JSON/XML)"""
+    try:
+        from flexibee_sync import FlexiBeeConnector
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            return jsonify({"status": "error", "message": "Nebyl vybrán žádný soubor"}), 400
+        if not file.filename.lower().endswith(('.json', '.xml')):
+            return jsonify({"status": "error", "message": "Neplatný formát souboru (očekáváno .json nebo .xml)"}), 400
+
+        connector = FlexiBeeConnector(request.form.get('company', '').strip() or None)
+        import_from_date_override = request.form.get('import_from_date', '').strip() or None
+        result = connector.bootstrap_from_export(file.stream, import_from_date_override=import_from_date_override)
+        log_audit("flexibee_bootstrap", {"by": session.get('username'), "filename": file.filename, **result})
+        return jsonify({"status": "success", "details": result})
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/flexibee/debug', methods=['GET'])
 @login_required
 def flexibee_debug():
     """Debug endpoint - shows what the server currently has"""
     try:
         from flexibee_sync import FlexiBeeConnector
-        from db_wrapper import load_transactions
         connector = FlexiBeeConnector()
         config = connector.config.copy()
         config.pop('password', None)
-        transactions = load_transactions()
-        flexibee_count = sum(1 for t in transactions if t.get('source_file','').startswith('flexibee:'))
-        dates = sorted([t['date'] for t in transactions if t.get('source_file','').startswith('flexibee:') and t.get('date')])
+        config.pop('companies', None)
+        snapshot = get_ledger_snapshot()
+        # Snapshot rows are sorted by date
+        flexibee_rows = np.flatnonzero(snapshot.flexibee)
+        dates = [snapshot.date[i] for i in flexibee_rows[[0, -1]]] if len(flexibee_rows) else []
         return jsonify({
             "config": config,
-            "total_transactions": len(transactions),
-            "flexibee_transactions": flexibee_count,
+            "sync_cursors": {c['company']: FlexiBeeConnector(c['company']).get_sync_cursors()
+                             for c in connector.company_configs()},
+            "total_transactions": snapshot.count,
+            "flexibee_transactions": len(flexibee_rows),
             "earliest_flexibee_date": dates[0] if dates else None,
             "latest_flexibee_date": dates[-1] if dates else None,
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/flexibee/resources', methods=['GET', 'POST'])
+@login_required
+def flexibee_resources():
+    """List synchronized resources with their schedule and cursor, or update their settings"""
+    try:
+        from flexibee_sync import FlexiBeeConnector, RESOURCES
+        connector = FlexiBeeConnector()
+
+        if request.method == 'POST':
+            data = request.json or {}
+            resources = dict(connector.config.get('resources') or {})
+            for name, settings in data.items():
+                if name not in RESOURCES:
+                    return jsonify({"status": "error", "message": f"Neznámý zdroj: {name}"}), 400
+                resources[name] = {
+                    "enabled": bool(settings.get('enabled')),
+                    "interval_minutes": max(5, int(settings.get('interval_minutes', 60)))
+                }
+            connector.config['resources'] = resources
+            connector.save_config(connector.config)
+            log_audit("update_flexibee_resources", {"by": session.get('username'), "resources": resources})
+
+        cursors = connector.get_sync_cursors()
+        return jsonify({"status": "success", "resources": [
+            {"name": name, "label": resource.label, **connector.resource_settings(name), **cursors.get(name, {})}
+            for name, resource in RESOURCES.items()
+        ]})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/flexibee/companies', methods=['GET', 'POST'])
+@login_required
+def flexibee_companies():
+    """
+    List configured FlexiBee companies (main company + config['companies']) or replace the extra ones
+    
+    POST body: [{"company": "firma2", "label": "...", "host": "...", "user": "...", "password": "..."}]
+    host/user/password are optional (inherited from the main company), an omitted password keeps the stored one
+    """
+    try:
+        from flexibee_sync import FlexiBeeConnector
+        connector = FlexiBeeConnector()
+        
+        if request.method == 'POST':
+            old = {c.get('company'): c for c in connector.config.get('companies') or []}
+            companies = []
+            for entry in request.json or []:
+                code = str(entry.get('company', '')).strip()
+                if not code:
+                    return jsonify({"status": "error", "message": "Chybí kód firmy"}), 400
+                company = {k: str(entry[k]).strip() for k in ('label', 'host', 'user') if entry.get(k)}
+                company['company'] = code
+                if entry.get('enabled') is False:
+                    company['enabled'] = False
+                password = entry.get('password') or old.get(code, {}).get('password')
+                if password:
+                    company['password'] = password
+                companies.append(company)
+            connector.config['companies'] = companies
+            connector.save_config(connector.config)
+            log_audit("update_flexibee_companies", {"by": session.get('username'), "companies": [c['company'] for c in companies]})
+        
+        return jsonify({"status": "success", "companies": [
+            {k: v for k, v in c.items() if k not in ('password', 'user')} for c in connector.company_configs()
+        ]})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/flexibee/stats', methods=['GET'])
+@login_required
+def flexibee_stats():
+    """
+    FlexiBee client telemetry: rolling histograms per resource (latency, bytes, retries)
+    and per server (time waiting on rate/concurrency limiters, concurrency limit, Retry-After
+    deferrals), plus current limiter state.
+    """
+    try:
+        import flexibee_telemetry
+        from flexibee_rate_limiter import get_host_stats
+        from db_wrapper import get_webhook_queue_stats
+        stats = flexibee_telemetry.snapshot()
+        stats["limiters"] = get_host_stats()
+        stats["webhook_queue"] = get_webhook_queue_stats()
+        return jsonify({"status": "success", **stats})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def api_stats():
+    """API response metrics per endpoint (serialization time, sizes) and result cache state"""
+    import flexibee_telemetry
+    histograms = flexibee_telemetry.snapshot()["histograms"]
+    return jsonify({
+        "status": "success",
+        "histograms": {name: values for name, values in histograms.items() if name.startswith('api_')},
+        "result_cache": result_cache.get_stats(),
+        "change_streams": change_notifier.get_stats()
+    })
+
 @app.route('/api/flexibee/reset_sync', methods=['POST'])
 @login_required
 def flexibee_reset_sync():
-    """Reset last_sync timestamp so next sync reimports all invoices"""
+    """Reset sync cursors so next sync reimports all records"""
     try:
         from flexibee_sync import FlexiBeeConnector
         connector = FlexiBeeConnector()
-        connector.config['last_sync'] = ''
-        connector.save_config(connector.config)
+        connector.reset_sync_state(all_companies=True)
         log_audit("flexibee_reset_sync", {"by": session.get('username')})
         return jsonify({"status": "success", "message": "Sync reset. Další synchronizace stáhne vše od nastaveného data."})
     except Exception as e:
@@ -1228,26 +1620,29 @@ def flexibee_reset_sync():
 def run_flexibee_sync_job():
     try:
         print("Running scheduled FlexiBee sync...")
-        from flexibee_sync import FlexiBeeConnector
-        connector = FlexiBeeConnector()
-        res = connector.sync_invoices()
+        from flexibee_sync import sync_companies
+        res = sync_companies(due_only=True)
         print(f"FlexiBee sync finished: {res}")
     except Exception as e:
         print(f"Scheduled FlexiBee sync failed: {e}")
 
 # Global job reference
 flexibee_job = None
+# The job runs often, each resource is synced only when its own interval elapsed
+FLEXIBEE_SCHEDULER_TICK_MINUTES = 5
 
 if __name__ == '__main__':
     # Schedule backup daily at 03:00
     schedule.every().day.at("03:00").do(scheduled_backup)
+    schedule.every().day.at("03:30").do(scheduled_audit_archive)
+    schedule.every().day.at("03:45").do(scheduled_journal_prune)
     
     # Initialize FlexiBee scheduler
     try:
         from flexibee_sync import FlexiBeeConnector
         c = FlexiBeeConnector().load_config()
         if c.get('enabled'):
-             flexibee_job = schedule.every(1).hours.do(run_flexibee_sync_job)
+             flexibee_job = schedule.every(FLEXIBEE_SCHEDULER_TICK_MINUTES).minutes.do(run_flexibee_sync_job)
              print("FlexiBee auto-sync initialized.")
     except Exception as e: 
         print(f"FlexiBee init error: {e}")
@@ -0,0 +1,338 @@
+"""
+Content-addressed backup store
+Database snapshots are split into page-aligned chunks stored once under their
+SHA-256 (compressed) - a new snapshot only writes the chunks that changed
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 64 KiB is a multiple of every SQLite page size, so chunks never split a page
+# and a page changed in place only invalidates its own chunk
+CHUNK_SIZE = 64 * 1024
+MANIFEST_VERSION = 1
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _compress(data):
+    """Returns: tuple (file extension, compressed bytes)"""
+    if zstandard is not None:
+        return '.zst', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return '.gz', gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _decompress(ext, data):
+    if ext == '.zst':
+        if zstandard is None:
+            raise RuntimeError("Chunk is zstd compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class _FileLock:
+    """Exclusive inter-process lock on a file (flock, msvcrt.locking on Windows)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            # LK_LOCK gives up after 10 attempts - keep trying
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+
+class BackupStore:
+    """
+    Snapshots + deduplicated chunk files
+
+    Layout:
+        <root>/manifest.json         - list of snapshots (name, created, size, chunk hashes)
+        <root>/chunks/ab/abcd....gz  - chunk content (.zst when zstandard is installed)
+        <root>/.lock                 - inter-process lock
+
+    Several processes (WSGI workers, CLI) may share one store: every operation
+    runs under the file lock and re-reads the manifest from disk, so a process
+    never saves or garbage-collects against a stale copy.
+    """
+
+    def __init__(self, root, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            root: Backup directory
+            chunk_size: Chunk size in bytes for new snapshots
+        """
+        self.root = root
+        self.chunk_size = chunk_size
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.manifest_file = os.path.join(root, 'manifest.json')
+        self.lock = threading.RLock()
+        self._file_lock = _FileLock(os.path.join(root, '.lock'))
+        self._lock_depth = 0
+        self._manifest = None
+
+    @contextmanager
+    def _locked(self):
+        """Thread + process lock; the outermost acquisition reloads the manifest"""
+        with self.lock:
+            if self._lock_depth == 0:
+                os.makedirs(self.root, exist_ok=True)
+                self._file_lock.acquire()
+                self._manifest = None
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._manifest = None
+                    self._file_lock.release()
+
+    # --- Manifest ---
+
+    def _load(self):
+        """
+        Manifest dict (read once per _locked() block); the first load imports
+        legacy *.db backups
+        """
+        if self._manifest is not None:
+            return self._manifest
+
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {'version': MANIFEST_VERSION, 'snapshots': []}
+            self._import_legacy()
+        return self._manifest
+
+    def _save(self):
+        temp_file = self.manifest_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, indent=2, ensure_ascii=False)
+        os.replace(temp_file, self.manifest_file)
+
+    def _import_legacy(self):
+        """
+        Add full-copy backups (backup_*.db, before_restore_*.db) to the store
+
+        The original files are kept - delete them by hand once the imported
+        snapshots have been checked.
+        """
+        legacy = [f for f in os.listdir(self.root) if f.endswith('.db')] if os.path.isdir(self.root) else []
+        for filename in sorted(legacy):
+            path = os.path.join(self.root, filename)
+            try:
+                created = datetime.fromtimestamp(os.stat(path).st_mtime).isoformat()
+                self._add(filename, path, created)
+                print(f"Backup store: imported {filename} (original file kept)")
+            except Exception as e:
+                print(f"Backup store: failed to import {filename}: {e}")
+        self._save()
+
+    def _find(self, name):
+        for snapshot in self._load()['snapshots']:
+            if snapshot['name'] == name:
+                return snapshot
+        return None
+
+    # --- Chunks ---
+
+    def _chunk_path(self, digest, ext):
+        return os.path.join(self.chunks_dir, digest[:2], digest + ext)
+
+    def _existing_chunk(self, digest):
+        for ext in ('.zst', '.gz'):
+            path = self._chunk_path(digest, ext)
+            if os.path.exists(path):
+                return ext, path
+        return None, None
+
+    def _write_chunk(self, digest, data):
+        """
+        Returns:
+            int: Bytes written to disk (0 when the chunk is already stored)
+        """
+        if self._existing_chunk(digest)[1]:
+            return 0
+        ext, compressed = _compress(data)
+        path = self._chunk_path(digest, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = path + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(compressed)
+        os.replace(temp_file, path)
+        return len(compressed)
+
+    def _read_chunk(self, digest):
+        ext, path = self._existing_chunk(digest)
+        if path is None:
+            raise FileNotFoundError(f"Missing backup chunk {digest}")
+        with open(path, 'rb') as f:
+            data = _decompress(ext, f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Corrupted backup chunk {digest}")
+        return data
+
+    # --- Snapshots ---
+
+    def _add(self, name, db_file, created):
+        chunks = []
+        size = 0
+        written = 0
+        with open(db_file, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                written += self._write_chunk(digest, data)
+                chunks.append(digest)
+                size += len(data)
+
+        snapshots = [s for s in self._load()['snapshots'] if s['name'] != name]
+        snapshot = {
+            'name': name,
+            'created': created,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'written': written,
+            'chunks': chunks
+        }
+        snapshots.append(snapshot)
+        self._manifest['snapshots'] = snapshots
+        return snapshot
+
+    def add_snapshot(self, name, db_file, created=None):
+        """
+        Store a database file as a snapshot (same name replaces the old one)
+
+        Args:
+            name: Snapshot name shown to the user (e.g. backup_20250101_030000.db)
+            db_file: Consistent database copy to store
+            created: ISO timestamp (default now)
+
+        Returns:
+            dict: Snapshot entry (size = DB size, written = new compressed bytes)
+        """
+        with self._locked():
+            snapshot = self._add(name, db_file, created or datetime.now().isoformat())
+            self._save()
+            return snapshot
+
+    def list_snapshots(self):
+        """
+        Returns:
+            list: Snapshots without chunk lists, newest first
+        """
+        with self._locked():
+            snapshots = [{k: v for k, v in s.items() if k != 'chunks'} for s in self._load()['snapshots']]
+        return sorted(snapshots, key=lambda s: s['created'], reverse=True)
+
+    def has_snapshot(self, name):
+        with self._locked():
+            return self._find(name) is not None
+
+    def iter_snapshot(self, name):
+        """
+        Yield the snapshot content chunk by chunk (e.g. for a download)
+
+        Raises:
+            KeyError: Unknown snapshot
+        """
+        with self._locked():
+            snapshot = self._find(name)
+            if snapshot is None:
+                raise KeyError(name)
+            chunks = list(snapshot['chunks'])
+        for digest in chunks:
+            yield self._read_chunk(digest)
+
+    def export_snapshot(self, name, dest_file):
+        """Write the snapshot to dest_file as a plain SQLite database"""
+        temp_file = dest_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            for data in self.iter_snapshot(name):
+                f.write(data)
+        os.replace(temp_file, dest_file)
+
+    def remove_snapshots(self, names):
+        """Drop snapshots from the manifest and delete chunks nobody references"""
+        names = set(names)
+        if not names:
+            return
+        with self._locked():
+            manifest = self._load()
+            manifest['snapshots'] = [s for s in manifest['snapshots'] if s['name'] not in names]
+            self._save()
+            self._collect_garbage()
+
+    def _collect_garbage(self):
+        """Delete unreferenced chunks (caller holds _locked(), manifest freshly read)"""
+        referenced = set()
+        for snapshot in self._manifest['snapshots']:
+            referenced.update(snapshot['chunks'])
+
+        if not os.path.isdir(self.chunks_dir):
+            return
+        for prefix in os.listdir(self.chunks_dir):
+            folder = os.path.join(self.chunks_dir, prefix)
+            for filename in os.listdir(folder):
+                digest = filename.split('.', 1)[0]
+                if digest not in referenced:
+                    try:
+                        os.remove(os.path.join(folder, filename))
+                    except OSError:
+                        pass
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: snapshots, logical_bytes (sum of DB sizes), stored_bytes (chunk files on disk)
+        """
+        with self._locked():
+            snapshots = self._load()['snapshots']
+            logical = sum(s['size'] for s in snapshots)
+            count = len(snapshots)
+        stored = 0
+        if os.path.isdir(self.chunks_dir):
+            for folder, _, files in os.walk(self.chunks_dir):
+                stored += sum(os.path.getsize(os.path.join(folder, f)) for f in files)
+        return {'snapshots': count, 'logical_bytes': logical, 'stored_bytes': stored}
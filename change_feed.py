@@ -0,0 +1,95 @@
+"""
+Shared wait for ledger data version changes
+One background thread polls settings.data_version while /api/changes streams
+are open and wakes them all, instead of every stream polling the database.
+"""
+
+import threading
+import time
+
+CHANGES_POLL_INTERVAL = 1.0
+# Every open stream holds one server thread (threaded dev server / WSGI worker
+# thread) for its whole lifetime - beyond this clients fall back to polling
+CHANGES_MAX_STREAMS = 20
+
+
+class DataVersionNotifier:
+    """Data version watched by one thread, waited on by any number of streams"""
+
+    def __init__(self, poll_interval=CHANGES_POLL_INTERVAL, max_listeners=CHANGES_MAX_STREAMS):
+        """
+        Args:
+            poll_interval: Seconds between data version reads
+            max_listeners: Max. concurrently subscribed streams
+        """
+        self.poll_interval = poll_interval
+        self.max_listeners = max_listeners
+        self.cond = threading.Condition()
+        self.version = None
+        self.listeners = 0
+        self.thread = None
+
+    def subscribe(self):
+        """
+        Register a stream (starts the watcher thread if needed)
+
+        Returns:
+            bool: False when max_listeners streams are already open
+        """
+        with self.cond:
+            if self.listeners >= self.max_listeners:
+                return False
+            self.listeners += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='data-version-notifier', daemon=True)
+                self.thread.start()
+            return True
+
+    def unsubscribe(self):
+        with self.cond:
+            self.listeners = max(0, self.listeners - 1)
+
+    def wait_for_change(self, known, timeout):
+        """
+        Block until the data version differs from known (or timeout)
+
+        Returns:
+            int: Current data version (known on timeout)
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.version is None or self.version == known:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return known
+                self.cond.wait(remaining)
+            return self.version
+
+    def _run(self):
+        from db_wrapper import get_data_version
+
+        while True:
+            with self.cond:
+                # Last stream gone - stop until the next subscribe()
+                if self.listeners == 0:
+                    self.thread = None
+                    self.version = None
+                    return
+            try:
+                version = get_data_version()
+            except Exception as e:
+                print(f"Data version notifier: {e}")
+                version = None
+            if version is not None:
+                with self.cond:
+                    if version != self.version:
+                        self.version = version
+                        self.cond.notify_all()
+            time.sleep(self.poll_interval)
+
+    def get_stats(self):
+        with self.cond:
+            return {"streams": self.listeners, "max_streams": self.max_listeners, "data_version": self.version}
+
+
+change_notifier = DataVersionNotifier()
@@ -1,37 +1,109 @@
 import sqlite3
+import gc
 import json
 import os
 import shutil
+import threading
+import time
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 from pathlib import Path
 
+from backup_store import BackupStore
+
 DB_DIR = os.path.join(os.path.dirname(__file__), 'data')
 DB_FILE = os.path.join(DB_DIR, 'cashflow.db')
 BACKUP_DIR = os.path.join(DB_DIR, 'backups')
 CONFIG_FILE = os.path.join(DB_DIR, 'backup_config.json')
+AUDIT_ARCHIVE_DIR = os.path.join(DB_DIR, 'audit_archive')
 
 # Create directories
 os.makedirs(DB_DIR, exist_ok=True)
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
+# Online backup: pages copied per step and pause between steps (lets writers in)
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+# Max. seconds a restore waits for open connections to close
+RESTORE_DRAIN_TIMEOUT = 30
+
+# Deduplicated snapshot store - replaces full *.db copies in BACKUP_DIR
+backup_store = BackupStore(BACKUP_DIR)
+
+# Open connection tracking - restore drains them and holds off new ones
+_connections_cond = threading.Condition()
+_open_connections = 0
+_restoring = False
+
+
+class _TrackedConnection(sqlite3.Connection):
+    """
+    Connection that reports its close() so a restore can wait for it
+    A connection dropped without close() (exception before conn.close())
+    is reported when it is garbage collected.
+    """
+
+    _tracked = False
+
+    def _untrack(self):
+        global _open_connections
+        if self._tracked:
+            self._tracked = False
+            with _connections_cond:
+                _open_connections -= 1
+                _connections_cond.notify_all()
+
+    def close(self):
+        super().close()
+        self._untrack()
+
+    def __del__(self):
+        # Only the counter - sqlite3 closes the handle itself on dealloc
+        # (close() from the collecting thread could raise ProgrammingError)
+        self._untrack()
+
+
 def get_db():
     """Get database connection"""
-    conn = sqlite3.connect(DB_FILE)
+    global _open_connections
+    with _connections_cond:
+        # A restore is swapping the database - wait until it's done
+        while _restoring:
+            _connections_cond.wait()
+        _open_connections += 1
+    try:
+        # Generous busy timeout - parallel FlexiBee company syncs write concurrently
+        conn = sqlite3.connect(DB_FILE, timeout=30, factory=_TrackedConnection)
+    except Exception:
+        with _connections_cond:
+            _open_connections -= 1
+            _connections_cond.notify_all()
+        raise
+    conn._tracked = True
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    """Initialize database schema"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Transactions table
-    cursor.execute('''
+def amount_to_minor(amount):
+    """
+    Amount in koruny (number or numeric string) -> integer haléře
+    Goes through the decimal text, so 0.285 becomes 29, not 28
+    """
+    if amount is None or amount == '':
+        return None
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def minor_to_amount(minor):
+    """Integer haléře -> koruny for the API (int when whole)"""
+    if minor is None:
+        return None
+    return minor // 100 if minor % 100 == 0 else minor / 100
+
+TRANSACTIONS_TABLE_SQL = '''
         CREATE TABLE IF NOT EXISTS transactions (
             id TEXT PRIMARY KEY,
             date TEXT NOT NULL,
             type TEXT NOT NULL,
-            amount REAL NOT NULL,
+            amount_minor INTEGER NOT NULL,
             text TEXT,
             supplier TEXT,
             customer TEXT,
@@ -42,9 +114,55 @@ def init_db():
             created_at TEXT,
             modified_at TEXT,
             original_due_date TEXT,
-            source_file TEXT
+            source_file TEXT,
+            company TEXT
         )
-    ''')
+'''
+
+def _run_in_transaction(conn, steps):
+    """
+    Run schema steps atomically in one explicit transaction
+    (sqlite3's implicit transactions don't cover DDL, so the statements would
+    otherwise autocommit one by one)
+    
+    Args:
+        conn: Database connection
+        steps: SQL strings or callables taking a cursor
+    """
+    conn.commit()
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        for step in steps:
+            if callable(step):
+                step(cursor)
+            else:
+                cursor.execute(step)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = ''
+
+def init_db():
+    """Initialize database schema"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Recovery: an amount_minor migration interrupted before its DROP left the
+    # original rows in transactions_old - restore them and migrate again below
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'transactions_old'")
+    if cursor.fetchone():
+        _run_in_transaction(conn, [
+            "DROP TABLE IF EXISTS transactions",
+            "ALTER TABLE transactions_old RENAME TO transactions",
+        ])
+        print("Recovered DB: restored transactions from interrupted amount_minor migration")
+    
+    # Transactions table (amounts in haléře, see amount_to_minor)
+    cursor.execute(TRANSACTIONS_TABLE_SQL)
     
     # Migration: Add original_due_date if missing
     try:
@@ -60,6 +178,39 @@ def init_db():
         cursor.execute("ALTER TABLE transactions ADD COLUMN source_file TEXT")
         print("Migrated DB: Added source_file column")
     
+    # Migration: Add company (FlexiBee company code) if missing
+    try:
+        cursor.execute("SELECT company FROM transactions LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN company TEXT")
+        print("Migrated DB: Added company column")
+    
+    # Migration: REAL amount (koruny) -> INTEGER amount_minor (haléře) for exact sums
+    cursor.execute("PRAGMA table_info(transactions)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'amount_minor' not in columns:
+        keep = [col for col in columns if col != 'amount']
+
+        def copy_rows(cursor):
+            cursor.execute(f"SELECT {', '.join(keep)}, amount FROM transactions_old")
+            cursor.executemany(
+                f"INSERT INTO transactions ({', '.join(keep)}, amount_minor) VALUES ({', '.join('?' for _ in keep)}, ?)",
+                (tuple(row[:-1]) + (amount_to_minor(row[-1]) or 0,) for row in cursor.fetchall())
+            )
+
+        # One transaction - a crash must not leave the rows split across two tables
+        _run_in_transaction(conn, [
+            "ALTER TABLE transactions RENAME TO transactions_old",
+            TRANSACTIONS_TABLE_SQL,
+            copy_rows,
+            "DROP TABLE transactions_old",
+        ])
+        print("Migrated DB: amount stored as integer haléře (amount_minor)")
+    
+    # Index for FlexiBee upserts (lookup by remote id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_source_file ON transactions(source_file)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_company ON transactions(company)")
+    
     # Settings table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS settings (
@@ -88,6 +239,96 @@ def init_db():
             details TEXT
         )
     ''')
+    # Keyset pagination of the audit log (newest first)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp ON audit_log(timestamp, id)")
+    
+    # FlexiBee sync state - one incremental cursor per company and resource
+    cursor.execute("PRAGMA table_info(sync_cursors)")
+    cursor_columns = [row[1] for row in cursor.fetchall()]
+    if cursor_columns and 'company' not in cursor_columns:
+        # Migration: cursors were per resource only; '' is claimed by the main company on first sync
+        cursor.execute("ALTER TABLE sync_cursors RENAME TO sync_cursors_old")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_cursors (
+            company TEXT NOT NULL DEFAULT '',
+            resource TEXT NOT NULL,
+            cursor_value TEXT,
+            last_run TEXT,
+            last_status TEXT,
+            last_error TEXT,
+            PRIMARY KEY (company, resource)
+        )
+    ''')
+    if cursor_columns and 'company' not in cursor_columns:
+        cursor.execute('''
+            INSERT INTO sync_cursors (company, resource, cursor_value, last_run, last_status, last_error)
+            SELECT '', resource, cursor_value, last_run, last_status, last_error FROM sync_cursors_old
+        ''')
+        cursor.execute("DROP TABLE sync_cursors_old")
+        print("Migrated DB: sync_cursors keyed by company")
+    
+    # FlexiBee webhook events waiting for the background consumer
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            received_at TEXT NOT NULL,
+            event TEXT NOT NULL,
+            resource TEXT NOT NULL,
+            action TEXT NOT NULL,
+            code TEXT,
+            company TEXT,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_at TEXT,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhook_queue_status ON webhook_queue(status, id)")
+    
+    # Keys of accepted webhook deliveries - FlexiBee retries are acknowledged without reprocessing
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_dedupe (
+            key TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhook_dedupe_expires ON webhook_dedupe(expires_at)")
+    
+    # Change journal - before/after image of every transaction row written through db_wrapper,
+    # grouped into batches (one import, one sync run, one edit) for undo and point-in-time recovery
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            username TEXT,
+            action TEXT NOT NULL,
+            details TEXT,
+            undo_of INTEGER,
+            undone_by INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            row_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            before TEXT,
+            after TEXT,
+            data_version INTEGER
+        )
+    ''')
+    # Migration: data_version the entry was committed with (delta feed for /api/changes)
+    try:
+        cursor.execute("SELECT data_version FROM change_journal LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE change_journal ADD COLUMN data_version INTEGER")
+        print("Migrated DB: Added change_journal.data_version column")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_journal_batch ON change_journal(batch_id, seq)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_journal_ts ON change_journal(ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_journal_version ON change_journal(data_version)")
     
     # Check if admin exists
     cursor.execute("SELECT * FROM users WHERE username = 'admin'")
@@ -104,52 +345,217 @@ def init_db():
     cursor.execute("SELECT * FROM settings WHERE key = 'initial_balance'")
     if not cursor.fetchone():
         cursor.execute("INSERT INTO settings (key, value) VALUES ('initial_balance', '0')")
+    # Bumped by every write of ledger data - read caches compare against it
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('data_version', '0')")
     
     conn.commit()
     conn.close()
 
-def create_backup():
-    """Create database backup"""
+def _online_copy(src_file, dst_file, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """
+    Copy a (possibly live) SQLite database with the backup API
+
+    Args:
+        src_file: Source database path
+        dst_file: Destination path (overwritten)
+        pages: Pages copied per step (-1 = all at once)
+        sleep: Seconds to sleep between steps so writers aren't stalled
+    """
+    src = sqlite3.connect(src_file, timeout=30)
+    try:
+        dst = sqlite3.connect(dst_file)
+        try:
+            src.backup(dst, pages=pages, sleep=sleep)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _read_data_version(db_file):
+    """settings.data_version of a database file (0 when missing)"""
+    conn = sqlite3.connect(db_file, timeout=30)
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = 'data_version'").fetchone()
+        return int(row[0]) if row else 0
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+def check_integrity(db_file):
+    """
+    Run PRAGMA integrity_check on a database file
+
+    Returns:
+        tuple: (ok, message) - message is 'ok' or the first reported problems
+    """
+    try:
+        conn = sqlite3.connect(f'file:{Path(db_file).as_posix()}?mode=ro', uri=True)
+        try:
+            rows = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return False, str(e)
+    if rows == ['ok']:
+        return True, 'ok'
+    return False, '; '.join(rows[:10])
+
+
+def create_backup(prefix='backup'):
+    """
+    Create database backup
+
+    Uses the SQLite online backup API in page batches, so the copy is
+    consistent even while the app keeps writing. The copy is verified
+    with PRAGMA integrity_check and stored as a snapshot in backup_store,
+    which only writes chunks that changed since earlier snapshots.
+
+    Returns:
+        str: Snapshot name (e.g. backup_20250101_030000.db), None on error
+    """
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_file = os.path.join(BACKUP_DIR, f'backup_{timestamp}.db')
-    
+    name = f'{prefix}_{timestamp}.db'
+    # Not *.db, so a leftover temp file is never imported as a legacy backup
+    temp_file = os.path.join(BACKUP_DIR, name + '.tmp')
+
     try:
-        shutil.copy2(DB_FILE, backup_file)
-        return backup_file
+        _online_copy(DB_FILE, temp_file)
+        ok, message = check_integrity(temp_file)
+        if not ok:
+            raise sqlite3.DatabaseError(f"integrity_check failed: {message}")
+        snapshot = backup_store.add_snapshot(name, temp_file)
+        print(f"Backup {name}: {snapshot['size']} B database, {snapshot['written']} B new chunks")
+        return name
     except Exception as e:
         print(f"Backup error: {e}")
         return None
+    finally:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+
+
+def backup_exists(name):
+    """True if name is a snapshot in the backup store"""
+    return backup_store.has_snapshot(name)
+
+
+def iter_backup(name):
+    """Yield the content of a stored backup as a plain SQLite file (for downloads)"""
+    return backup_store.iter_snapshot(name)
+
+
+def _drain_connections(timeout):
+    """
+    Block new get_db() connections and wait for the open ones to close
+
+    Returns:
+        bool: True if all connections closed within timeout
+    """
+    global _restoring
+    deadline = time.monotonic() + timeout
+    # Finalize leaked connections kept alive only by reference cycles (e.g. tracebacks)
+    gc.collect()
+    with _connections_cond:
+        while _restoring:
+            _connections_cond.wait()
+        _restoring = True
+        while _open_connections > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _connections_cond.wait(remaining)
+    return True
+
+
+def _release_connections():
+    global _restoring
+    with _connections_cond:
+        _restoring = False
+        _connections_cond.notify_all()
+
 
-def restore_backup(backup_file):
-    """Restore database from backup"""
+def restore_backup(backup_file, drain_timeout=RESTORE_DRAIN_TIMEOUT):
+    """
+    Restore database from backup
+
+    The backup is verified with PRAGMA integrity_check first. Then new
+    connections are held off, open ones are drained and the live database
+    is replaced in a single backup-API step - one write transaction, so
+    readers see either the old or the restored data, never a mix.
+
+    Args:
+        backup_file: Snapshot name from get_backups() or path to a .db file (upload)
+
+    Returns:
+        bool: True on success
+    """
+    temp_file = None
     try:
-        if os.path.exists(backup_file):
-            # Create safety backup before restore
-            safety_backup = os.path.join(BACKUP_DIR, f'before_restore_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db')
-            shutil.copy2(DB_FILE, safety_backup)
-            
+        if not os.path.exists(backup_file):
+            if not backup_exists(backup_file):
+                return False
+            temp_file = os.path.join(BACKUP_DIR, f'restore_{os.getpid()}.tmp')
+            backup_store.export_snapshot(backup_file, temp_file)
+            backup_file = temp_file
+
+        ok, message = check_integrity(backup_file)
+        if not ok:
+            print(f"Restore error: backup failed integrity_check: {message}")
+            return False
+
+        # Create safety backup before restore
+        if not create_backup(prefix='before_restore'):
+            print("Restore error: safety backup failed")
+            return False
+
+        live_version = _read_data_version(DB_FILE)
+        if not _drain_connections(drain_timeout):
+            # Still safe - SQLite locking serializes the swap with remaining connections
+            print(f"Restore: {_open_connections} connection(s) still open after {drain_timeout}s, continuing")
+        try:
             # Restore
-            shutil.copy2(backup_file, DB_FILE)
-            return True
-        return False
+            _online_copy(backup_file, DB_FILE, pages=-1, sleep=0)
+        finally:
+            _release_connections()
+
+        # Backups from older versions may lack newer columns/tables
+        init_db()
+        # The restored counter may repeat a version caches have already seen
+        conn = get_db()
+        conn.execute("UPDATE settings SET value = ? WHERE key = 'data_version'",
+                     (str(max(live_version, _read_data_version(DB_FILE)) + 1),))
+        conn.commit()
+        conn.close()
+        return True
     except Exception as e:
         print(f"Restore error: {e}")
         return False
+    finally:
+        if temp_file:
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
 
 def get_backups():
-    """Get list of available backups"""
-    backups = []
-    if os.path.exists(BACKUP_DIR):
-        for file in os.listdir(BACKUP_DIR):
-            if file.endswith('.db'):
-                filepath = os.path.join(BACKUP_DIR, file)
-                stat = os.stat(filepath)
-                backups.append({
-                    'filename': file,
-                    'size': stat.st_size,
-                    'created': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                })
-    return sorted(backups, key=lambda x: x['created'], reverse=True)
+    """
+    Get list of available backups (from the backup store manifest)
+
+    Returns:
+        list: {'filename', 'size', 'stored', 'created'} dicts, newest first -
+              size is the database size, stored the compressed bytes this
+              snapshot added to the store
+    """
+    return [{
+        'filename': snapshot['name'],
+        'size': snapshot['size'],
+        'stored': snapshot['written'],
+        'created': snapshot['created']
+    } for snapshot in backup_store.list_snapshots()]
 
 def load_backup_config():
     """Load backup configuration"""
@@ -168,14 +574,13 @@ def save_backup_config(config):
         json.dump(config, f, indent=2, ensure_ascii=False)
 
 def cleanup_old_backups(max_backups=30):
-    """Remove old backups, keep only max_backups newest"""
+    """Remove old backups, keep only max_backups newest (unreferenced chunks are deleted)"""
     backups = get_backups()
     if len(backups) > max_backups:
-        for backup in backups[max_backups:]:
-            try:
-                os.remove(os.path.join(BACKUP_DIR, backup['filename']))
-            except:
-                pass
+        try:
+            backup_store.remove_snapshots(b['filename'] for b in backups[max_backups:])
+        except Exception as e:
+            print(f"Backup cleanup error: {e}")
 
 # Initialize database on import
 init_db()
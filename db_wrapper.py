@@ -2,8 +2,12 @@
 Database wrapper - provides same interface as JSON functions but uses SQLite
 Import this instead of using JSON files directly
 """
-from database import get_db
+from database import get_db, amount_to_minor, minor_to_amount
+import atexit
 import json
+import queue
+import threading
+import time
 
 def load_transactions():
     """Load transactions from database"""
@@ -18,7 +22,7 @@ def load_transactions():
             "id": t.get("id"),
             "date": t.get("date"),
             "type": t.get("type"),
-            "amount": t.get("amount"),
+            "amount": minor_to_amount(t.get("amount_minor")),
             "text": t.get("text") or "",
             "supplier": t.get("supplier") or "",
             "customer": t.get("customer") or "",
@@ -29,46 +33,796 @@ def load_transactions():
             "created_at": t.get("created_at"),
             "modified_at": t.get("modified_at"),
             "original_due_date": t.get("original_due_date") or t.get("date"),
-            "source_file": t.get("source_file") or ""
+            "source_file": t.get("source_file") or "",
+            "company": t.get("company") or ""
         })
     conn.close()
     return transactions
 
-def save_transactions(transactions):
-    """Save transactions to database"""
+TRANSACTION_COLUMNS = (
+    'id', 'date', 'type', 'amount_minor', 'text', 'supplier', 'customer', 'var_symbol',
+    'description', 'payment_status', 'created_by', 'created_at', 'modified_at',
+    'original_due_date', 'source_file', 'company'
+)
+
+def _transaction_row(t):
+    """Build parameter tuple for INSERT in TRANSACTION_COLUMNS order"""
+    row = [t.get(col) for col in TRANSACTION_COLUMNS]
+    # API dicts carry koruny, the table stores haléře
+    row[TRANSACTION_COLUMNS.index('amount_minor')] = amount_to_minor(t.get('amount'))
+    # source_file defaults to empty string, company to NULL (row not tied to a FlexiBee company)
+    row[TRANSACTION_COLUMNS.index('source_file')] = t.get('source_file', '')
+    row[TRANSACTION_COLUMNS.index('company')] = t.get('company') or None
+    return tuple(row)
+
+def _insert_sql(verb='INSERT'):
+    return f"""
+        {verb} INTO transactions
+        ({', '.join(TRANSACTION_COLUMNS)})
+        VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)})
+    """
+
+class ChangeBatch:
+    """
+    One logical change (XLSX import, sync run, manual edit) in the change journal
+    Pass the same instance to several upsert/delete calls to undo them together.
+    The change_batches row is created with the first real change, so no-op
+    syncs don't fill the journal with empty batches.
+    """
+
+    def __init__(self, action, details=None, username='system', undo_of=None):
+        self.action = action
+        self.details = details or {}
+        self.username = username or 'system'
+        self.undo_of = undo_of
+        self.id = None
+
+    def _ensure(self, cursor):
+        if self.id is None:
+            from datetime import datetime
+            cursor.execute('''
+                INSERT INTO change_batches (created_at, username, action, details, undo_of)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (datetime.now().isoformat(), self.username, self.action,
+                  json.dumps(self.details, ensure_ascii=False), self.undo_of))
+            self.id = cursor.lastrowid
+        return self.id
+
+JOURNAL_FETCH_CHUNK = 500
+# Journal entries older than this are pruned (limit of undo / point-in-time restore)
+JOURNAL_RETENTION_DAYS = 90
+# Batch actions written by the FlexiBee sync - undoing them resets the sync cursors
+SYNC_BATCH_ACTIONS = ('flexibee_sync', 'flexibee_webhook', 'flexibee_bootstrap')
+
+def _begin_write(conn):
+    """
+    Start a write transaction before reading the rows to compare
+
+    Before images read in a deferred transaction could be overwritten by a
+    parallel sync worker before our write, and the journal would record an
+    image that never was the overwritten row.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+
+def _row_image(row):
+    """Row as a plain dict of TRANSACTION_COLUMNS (journal image)"""
+    return {col: row[col] for col in TRANSACTION_COLUMNS}
+
+def _same_row(a, b):
+    """
+    Compare images the way load_transactions() presents them
+    (NULL and '' are equal, original_due_date falls back to date), so saving
+    back an unchanged loaded list doesn't rewrite every row
+    """
+    if a is None or b is None:
+        return a is b
+    for col in TRANSACTION_COLUMNS:
+        x, y = a[col], b[col]
+        if col == 'original_due_date':
+            x, y = x or a['date'], y or b['date']
+        if x != y and (x or '') != (y or ''):
+            return False
+    return True
+
+def _fetch_images(cursor, ids):
+    """Current images of the given transaction ids -> {id: image}"""
+    ids = list(dict.fromkeys(ids))
+    images = {}
+    for i in range(0, len(ids), JOURNAL_FETCH_CHUNK):
+        chunk = ids[i:i + JOURNAL_FETCH_CHUNK]
+        cursor.execute(
+            f"SELECT * FROM transactions WHERE id IN ({', '.join('?' for _ in chunk)})", chunk)
+        for row in cursor.fetchall():
+            images[row['id']] = _row_image(row)
+    return images
+
+def _apply_changes(conn, batch, changes):
+    """
+    Write changed rows and their journal entries in one DB transaction
+
+    Args:
+        conn: Open connection in a _begin_write() transaction (committed here)
+        batch: ChangeBatch the entries belong to
+        changes: List of (row id, before image or None, after image or None)
+    """
+    if not changes:
+        return
+    from datetime import datetime
+    cursor = conn.cursor()
+    created = batch.id is None
+    try:
+        batch_id = batch._ensure(cursor)
+        deletes = [(row_id,) for row_id, _, after in changes if after is None]
+        writes = [tuple(after[col] for col in TRANSACTION_COLUMNS) for _, _, after in changes if after is not None]
+        if deletes:
+            cursor.executemany("DELETE FROM transactions WHERE id = ?", deletes)
+        if writes:
+            cursor.executemany(_insert_sql('INSERT OR REPLACE'), writes)
+        version = _bump_data_version(cursor)
+
+        now = datetime.now().isoformat()
+        cursor.executemany('''
+            INSERT INTO change_journal (batch_id, ts, row_id, op, before, after, data_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ((
+            batch_id, now, row_id,
+            'insert' if before is None else ('delete' if after is None else 'update'),
+            json.dumps(before, ensure_ascii=False) if before is not None else None,
+            json.dumps(after, ensure_ascii=False) if after is not None else None,
+            version
+        ) for row_id, before, after in changes))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if created:
+            # The batch row was rolled back too
+            batch.id = None
+        raise
+
+def save_transactions(transactions, action='save_transactions', username='system', details=None):
+    """
+    Save transactions to database (replaces the whole table content)
+
+    Only rows that actually differ are written, each with a journal entry,
+    so an edit of one transaction costs one row write, not a table rewrite.
+
+    Args:
+        transactions: Complete list of transaction dicts
+        action: Change batch label (e.g. 'upload_file', 'update_transaction')
+        username: Who made the change
+        details: Extra batch info (JSON serializable)
+
+    Returns:
+        int: Change batch id (None when nothing changed)
+    """
+    target = {}
+    for t in transactions:
+        row = _transaction_row(t)
+        target[row[0]] = dict(zip(TRANSACTION_COLUMNS, row))
+
+    batch = ChangeBatch(action, details, username)
+    conn = get_db()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM transactions")
+        current = {row['id']: _row_image(row) for row in cursor.fetchall()}
+
+        changes = [(row_id, before, None) for row_id, before in current.items() if row_id not in target]
+        for row_id, after in target.items():
+            before = current.get(row_id)
+            if not _same_row(before, after):
+                changes.append((row_id, before, after))
+        _apply_changes(conn, batch, changes)
+    finally:
+        conn.close()
+    return batch.id
+
+def upsert_transactions(transactions, update_columns=None, batch=None):
+    """
+    Insert new / update existing transactions (matched by id) in one transaction.
+    Other rows are left untouched - used for bulk loads and incremental syncs.
+    Rows whose stored values wouldn't change are skipped (no write, no journal entry).
+
+    Args:
+        transactions: Iterable of transaction dicts
+        update_columns: Columns overwritten when the row already exists
+                        (default: all except id) - lets syncs keep local-only fields
+        batch: ChangeBatch to journal into (default: a new 'upsert' batch)
+    """
+    if update_columns is None:
+        update_columns = [col for col in TRANSACTION_COLUMNS if col != 'id']
+    rows = [dict(zip(TRANSACTION_COLUMNS, _transaction_row(t))) for t in transactions]
+    if batch is None:
+        batch = ChangeBatch('upsert')
+
+    conn = get_db()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        state = _fetch_images(cursor, [row['id'] for row in rows])
+        original = dict(state)
+        for row in rows:
+            before = state.get(row['id'])
+            if before is None:
+                after = row
+            else:
+                after = dict(before)
+                after.update((col, row[col]) for col in update_columns)
+            state[row['id']] = after
+
+        changes = [(row_id, original.get(row_id), after)
+                   for row_id, after in state.items() if not _same_row(original.get(row_id), after)]
+        _apply_changes(conn, batch, changes)
+    finally:
+        conn.close()
+
+def delete_transactions(ids, batch=None):
+    """
+    Delete transactions by id in one transaction
+
+    Args:
+        ids: Transaction ids
+        batch: ChangeBatch to journal into (default: a new 'delete' batch)
+    """
+    if batch is None:
+        batch = ChangeBatch('delete')
+    conn = get_db()
+    try:
+        _begin_write(conn)
+        before = _fetch_images(conn.cursor(), ids)
+        _apply_changes(conn, batch, [(row_id, image, None) for row_id, image in before.items()])
+    finally:
+        conn.close()
+
+def get_change_batches(limit=50):
+    """
+    Recent change batches, newest first
+
+    Returns:
+        list: {id, created_at, username, action, details, undo_of, undone_by, changes}
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT b.id, b.created_at, b.username, b.action, b.details, b.undo_of, b.undone_by,
+               (SELECT COUNT(*) FROM change_journal j WHERE j.batch_id = b.id) AS changes
+        FROM change_batches b
+        ORDER BY b.id DESC
+        LIMIT ?
+    ''', (limit,))
+    batches = []
+    for row in cursor.fetchall():
+        batch = dict(row)
+        batch['details'] = json.loads(batch['details']) if batch['details'] else {}
+        batches.append(batch)
+    conn.close()
+    return batches
+
+def _load_image(value):
+    if value is None:
+        return None
+    image = json.loads(value)
+    if 'amount' in image:
+        # Entry journaled before amounts were stored in haléře
+        image['amount_minor'] = amount_to_minor(image.pop('amount'))
+    return image
+
+def _revert(conn, targets, batch, force):
+    """
+    Bring rows back to target images, refusing rows changed since (unless force)
+
+    Args:
+        targets: {row id: (image expected now, image to restore)}
+
+    Returns:
+        dict: status, reverted and conflicts (row ids changed after the reverted change)
+    """
+    current = _fetch_images(conn.cursor(), targets)
+    conflicts = [row_id for row_id, (expected, _) in targets.items() if current.get(row_id) != expected]
+    if conflicts and not force:
+        return {"status": "conflict", "reverted": 0, "conflicts": conflicts}
+
+    changes = [(row_id, current.get(row_id), restore)
+               for row_id, (_, restore) in targets.items() if current.get(row_id) != restore]
+    _apply_changes(conn, batch, changes)
+    return {"status": "success", "reverted": len(changes), "conflicts": conflicts, "batch_id": batch.id}
+
+def undo_change_batch(batch_id, username='system', force=False):
+    """
+    Undo one change batch (e.g. the last XLSX import)
+
+    Reads only the journal entries of that batch, so the cost is proportional
+    to the size of the change. The undo is journaled as a new batch itself.
+
+    Args:
+        batch_id: change_batches.id
+        username: Who undoes
+        force: Also revert rows modified after the batch (their later changes are lost)
+
+    Returns:
+        dict: status ('success', 'conflict', 'error'), reverted, conflicts
+    """
+    conn = get_db()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT action, details, undone_by FROM change_batches WHERE id = ?", (batch_id,))
+        row = cursor.fetchone()
+        if not row:
+            return {"status": "error", "message": "Dávka změn neexistuje"}
+        if row['undone_by']:
+            return {"status": "error", "message": f"Dávka už byla vrácena (dávkou {row['undone_by']})"}
+
+        cursor.execute("SELECT row_id, before, after FROM change_journal WHERE batch_id = ? ORDER BY seq", (batch_id,))
+        targets = {}
+        for entry in cursor.fetchall():
+            first_before = targets[entry['row_id']][1] if entry['row_id'] in targets else _load_image(entry['before'])
+            targets[entry['row_id']] = (_load_image(entry['after']), first_before)
+
+        batch = ChangeBatch('undo', {'batch_id': batch_id, 'action': row['action']}, username, undo_of=batch_id)
+        # Committed together with the revert (rolled back on conflict)
+        _reset_sync_cursors_of(cursor, [row])
+        result = _revert(conn, targets, batch, force)
+        if result['status'] == 'success' and batch.id:
+            cursor.execute("UPDATE change_batches SET undone_by = ? WHERE id = ?", (batch.id, batch_id))
+            conn.commit()
+        return result
+    finally:
+        conn.close()
+
+def _reset_sync_cursors_of(cursor, batches):
+    """
+    Clear the sync cursors of the resources the given FlexiBee batches wrote,
+    so the next incremental sync fetches the reverted documents again
+
+    Args:
+        batches: change_batches rows (action, details)
+    """
+    for batch in batches:
+        if batch['action'] not in SYNC_BATCH_ACTIONS:
+            continue
+        details = json.loads(batch['details']) if batch['details'] else {}
+        company = details.get('company') or ''
+        resource = details.get('resource')
+        if resource and batch['action'] != 'flexibee_bootstrap':
+            cursor.execute("UPDATE sync_cursors SET cursor_value = '' WHERE company = ? AND resource = ?",
+                           (company, resource))
+        else:
+            cursor.execute("UPDATE sync_cursors SET cursor_value = '' WHERE company = ?", (company,))
+
+def _check_journal_covers(cursor, timestamp):
+    """Raise ValueError when timestamp is older than the pruned journal reaches"""
+    row = cursor.execute("SELECT value FROM settings WHERE key = 'journal_pruned_before'").fetchone()
+    if row and timestamp < row[0]:
+        raise ValueError(f"Žurnál změn je k dispozici až od {row[0]}")
+
+def _images_at(cursor, timestamp):
+    """
+    {row id: (image now, image at timestamp)} for rows changed after timestamp
+    Walks only the journal entries newer than timestamp.
+    """
+    cursor.execute("SELECT row_id, before, after FROM change_journal WHERE ts > ? ORDER BY seq", (timestamp,))
+    targets = {}
+    for entry in cursor.fetchall():
+        at_time = targets[entry['row_id']][1] if entry['row_id'] in targets else _load_image(entry['before'])
+        targets[entry['row_id']] = (_load_image(entry['after']), at_time)
+    return targets
+
+def load_transactions_at(timestamp):
+    """
+    Reconstruct the transactions table as it was at timestamp (read only)
+
+    Args:
+        timestamp: ISO timestamp (e.g. '2025-03-01T12:00:00')
+
+    Returns:
+        list: Transaction rows (same columns as the table)
+    """
+    conn = get_db()
+    try:
+        conn.execute("BEGIN")
+        cursor = conn.cursor()
+        _check_journal_covers(cursor, timestamp)
+        targets = _images_at(cursor, timestamp)
+        cursor.execute("SELECT * FROM transactions")
+        rows = {row['id']: _row_image(row) for row in cursor.fetchall()}
+    finally:
+        conn.close()
+    for row_id, (_, at_time) in targets.items():
+        if at_time is None:
+            rows.pop(row_id, None)
+        else:
+            rows[row_id] = at_time
+    return sorted(rows.values(), key=lambda t: t['date'] or '')
+
+def restore_point_in_time(timestamp, username='system', dry_run=False):
+    """
+    Return the transactions table to its state at timestamp
+
+    Only rows changed after timestamp are touched. The restore is journaled
+    as a new batch, so it can itself be undone. Sync cursors of resources
+    synced since then are cleared, so the next sync fetches them again.
+
+    Args:
+        timestamp: ISO timestamp
+        username: Who restores
+        dry_run: Only count the rows that would change
+
+    Returns:
+        dict: status, reverted (rows changed), batch_id
+
+    Raises:
+        ValueError: timestamp is older than the journal retention
+    """
+    conn = get_db()
+    try:
+        _begin_write(conn)
+        cursor = conn.cursor()
+        _check_journal_covers(cursor, timestamp)
+        targets = _images_at(cursor, timestamp)
+        if dry_run:
+            current = _fetch_images(conn.cursor(), targets)
+            changed = sum(1 for row_id, (_, at_time) in targets.items() if current.get(row_id) != at_time)
+            return {"status": "success", "reverted": changed, "dry_run": True}
+        batch = ChangeBatch('point_in_time_restore', {'timestamp': timestamp}, username)
+        cursor.execute("SELECT action, details FROM change_batches WHERE created_at > ?", (timestamp,))
+        _reset_sync_cursors_of(cursor, cursor.fetchall())
+        return _revert(conn, targets, batch, force=True)
+    finally:
+        conn.close()
+
+def prune_change_journal(retention_days=JOURNAL_RETENTION_DAYS):
+    """
+    Delete journal entries (and emptied batches) older than retention_days
+
+    Undo and point-in-time restore can't go back further than that afterwards;
+    the cut-off is remembered in settings.journal_pruned_before.
+
+    Returns:
+        int: Number of deleted journal entries
+    """
+    from datetime import datetime, timedelta
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    conn = get_db()
+    try:
+        _begin_write(conn)
+        deleted = conn.execute("DELETE FROM change_journal WHERE ts < ?", (cutoff,)).rowcount
+        conn.execute('''
+            DELETE FROM change_batches WHERE created_at < ?
+            AND NOT EXISTS (SELECT 1 FROM change_journal j WHERE j.batch_id = change_batches.id)
+        ''', (cutoff,))
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('journal_pruned_before', ?)", (cutoff,))
+        conn.commit()
+    finally:
+        conn.close()
+    if deleted:
+        print(f"Change journal: pruned {deleted} entries older than {retention_days} days")
+    return deleted
+
+def get_source_index(prefix='flexibee:', company=None):
+    """
+    Map source_file -> {id, created_at, type} for rows whose source_file starts with prefix.
+    Cheap lookup for upserts without loading full transactions.
+    company limits the index to one FlexiBee company (remote ids are unique per company only).
+    """
     conn = get_db()
     cursor = conn.cursor()
+    sql = "SELECT id, created_at, source_file, type FROM transactions WHERE source_file LIKE ?"
+    params = (prefix + '%',)
+    if company is not None:
+        sql += " AND company = ?"
+        params += (company,)
+    cursor.execute(sql, params)
+    index = {row[2]: {"id": row[0], "created_at": row[1], "type": row[3]} for row in cursor.fetchall()}
+    conn.close()
+    return index
+
+def claim_legacy_company(company, prefix='flexibee:'):
+    """
+    Assign FlexiBee rows and cursors stored before multi-company support to company
     
-    # Clear existing
-    cursor.execute("DELETE FROM transactions")
+    The rows are rewritten through the change journal, which also bumps the
+    data version (snapshot, result cache and ETags see the new company).
+    Runs once - settings.legacy_company_claimed marks it done, later calls
+    return without taking the write lock.
+
+    Returns:
+        int: Number of transactions claimed
+    """
+    if not company:
+        return 0
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        claimed = "SELECT value FROM settings WHERE key = 'legacy_company_claimed'"
+        if cursor.execute(claimed).fetchone():
+            return 0
+        _begin_write(conn)
+        # Another process may have claimed the rows while we waited for the lock
+        if cursor.execute(claimed).fetchone():
+            conn.rollback()
+            return 0
+        cursor.execute("SELECT * FROM transactions WHERE company IS NULL AND source_file LIKE ?", (prefix + '%',))
+        changes = []
+        for row in cursor.fetchall():
+            before = _row_image(row)
+            changes.append((row['id'], before, dict(before, company=company)))
+        cursor.execute("UPDATE OR IGNORE sync_cursors SET company = ? WHERE company = ''", (company,))
+        cursor.execute("DELETE FROM sync_cursors WHERE company = ''")
+        cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('legacy_company_claimed', ?)", (company,))
+        _apply_changes(conn, ChangeBatch('claim_legacy_company', {'company': company}), changes)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(changes)
+
+def get_sync_cursors(company=''):
+    """Get FlexiBee sync state per resource of one company"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT resource, cursor_value, last_run, last_status, last_error FROM sync_cursors "
+                   "WHERE company = ?", (company,))
+    cursors = {row[0]: {
+        "cursor": row[1] or "",
+        "last_run": row[2],
+        "last_status": row[3],
+        "last_error": row[4]
+    } for row in cursor.fetchall()}
+    conn.close()
+    return cursors
+
+def save_sync_cursor(resource, cursor_value=None, status=None, error=None, company=''):
+    """
+    Record a sync run of resource.
+    cursor_value=None keeps the stored cursor (failed run / no changes).
+    """
+    from datetime import datetime
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO sync_cursors (company, resource, cursor_value, last_run, last_status, last_error)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(company, resource) DO UPDATE SET
+            cursor_value = COALESCE(excluded.cursor_value, sync_cursors.cursor_value),
+            last_run = excluded.last_run,
+            last_status = excluded.last_status,
+            last_error = excluded.last_error
+    ''', (company, resource, cursor_value, datetime.now().isoformat(), status, error))
+    conn.commit()
+    conn.close()
+
+def reset_sync_cursors(resources=None, company=None):
+    """Clear cursors (all or given resources, of one or all companies) so the next sync is a full one"""
+    conn = get_db()
+    cursor = conn.cursor()
+    sql = "UPDATE sync_cursors SET cursor_value = ''"
+    where = []
+    params = ()
+    if company is not None:
+        where.append("company = ?")
+        params += (company,)
+    if resources is None:
+        cursor.execute(sql + (" WHERE " + where[0] if where else ""), params)
+    else:
+        where.append("resource = ?")
+        cursor.executemany(sql + " WHERE " + " AND ".join(where), (params + (r,) for r in resources))
+    conn.commit()
+    conn.close()
+
+def enqueue_webhook_event(event, resource, action, code, company, payload, dedupe_key=None, expires_at=None):
+    """
+    Append a FlexiBee webhook event to the durable queue
+    With dedupe_key, the key is recorded in the same transaction - a delivery whose key
+    is already known (and not expired) is not queued again.
     
-    # Insert all
-    for t in transactions:
+    Args:
+        dedupe_key: Event id / payload hash of the delivery
+        expires_at: Unix time until which the key is remembered
+    
+    Returns:
+        int: Queue id of the event, None for a duplicate delivery
+    """
+    from datetime import datetime
+    import time
+    conn = get_db()
+    cursor = conn.cursor()
+    if dedupe_key is not None:
+        # Insert the key, or take over an expired one; rowcount 0 = live duplicate
         cursor.execute('''
-            INSERT INTO transactions 
-            (id, date, type, amount, text, supplier, customer, var_symbol, 
-             description, payment_status, created_by, created_at, modified_at, original_due_date, source_file)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            t.get('id'),
-            t.get('date'),
-            t.get('type'),
-            t.get('amount'),
-            t.get('text'),
-            t.get('supplier'),
-            t.get('customer'),
-            t.get('var_symbol'),
-            t.get('description'),
-            t.get('payment_status'),
-            t.get('created_by'),
-            t.get('created_at'),
-            t.get('modified_at'),
-            t.get('original_due_date'),
-            t.get('source_file', '')
-        ))
+            INSERT INTO webhook_dedupe (key, expires_at) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at
+            WHERE webhook_dedupe.expires_at < ?
+        ''', (dedupe_key, expires_at, time.time()))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            conn.close()
+            return None
+    cursor.execute('''
+        INSERT INTO webhook_queue (received_at, event, resource, action, code, company, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (datetime.now().isoformat(), event, resource, action, code, company,
+          json.dumps(payload, ensure_ascii=False)))
+    event_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return event_id
+
+def claim_webhook_events(limit=500):
+    """
+    Atomically take up to limit pending events (oldest first) for processing
+    Safe with several consumers (processes) - each event is claimed only once
     
+    Returns:
+        list: Event dicts (payload decoded) in arrival order
+    """
+    from datetime import datetime
+    conn = get_db()
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT * FROM webhook_queue WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,))
+        events = [dict(row) for row in cursor.fetchall()]
+        cursor.executemany("UPDATE webhook_queue SET status = 'processing', claimed_at = ? WHERE id = ?",
+                           ((datetime.now().isoformat(), e['id']) for e in events))
+        cursor.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    for event in events:
+        try:
+            event['payload'] = json.loads(event['payload'] or '{}')
+        except ValueError:
+            event['payload'] = {}
+    return events
+
+def purge_webhook_dedupe():
+    """Delete expired dedupe keys"""
+    import time
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM webhook_dedupe WHERE expires_at < ?", (time.time(),))
+    purged = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return purged
+
+def complete_webhook_events(ids):
+    """Remove processed events from the queue"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM webhook_queue WHERE id = ?", ((i,) for i in ids))
+    conn.commit()
+    conn.close()
+
+def fail_webhook_events(ids, error, max_attempts=5):
+    """Return events to the queue after a failed attempt ('failed' once max_attempts is reached)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        UPDATE webhook_queue SET
+            attempts = attempts + 1,
+            last_error = ?,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+        WHERE id = ?
+    ''', ((str(error), max_attempts, i) for i in ids))
+    conn.commit()
+    conn.close()
+
+def requeue_stale_webhook_events(older_than_seconds=300):
+    """Release events claimed by a consumer that died before finishing them"""
+    from datetime import datetime, timedelta
+    cutoff = (datetime.now() - timedelta(seconds=older_than_seconds)).isoformat()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE webhook_queue SET status = 'pending' WHERE status = 'processing' AND claimed_at < ?",
+                   (cutoff,))
+    requeued = cursor.rowcount
     conn.commit()
     conn.close()
+    return requeued
+
+def get_webhook_queue_stats():
+    """Number of queued events per status and age of the oldest pending one"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM webhook_queue GROUP BY status")
+    stats = {row[0]: row[1] for row in cursor.fetchall()}
+    cursor.execute("SELECT MIN(received_at) FROM webhook_queue WHERE status = 'pending'")
+    stats['oldest_pending'] = cursor.fetchone()[0]
+    conn.close()
+    return stats
+
+def _bump_data_version(cursor):
+    """
+    Mark ledger data as changed (part of the writing transaction)
+
+    Returns:
+        int: The new data version
+    """
+    cursor.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'data_version'")
+    row = cursor.execute("SELECT value FROM settings WHERE key = 'data_version'").fetchone()
+    return int(row[0]) if row else 0
+
+def get_data_version():
+    """Counter increased by every ledger write - cheap staleness check for read caches"""
+    conn = get_db()
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = 'data_version'").fetchone()
+        return int(row[0]) if row else 0
+    finally:
+        conn.close()
+
+def load_ledger_rows():
+    """
+    All transaction rows plus the data version they belong to (one read transaction)
+
+    Returns:
+        tuple: (data version, list of rows in TRANSACTION_COLUMNS order, sorted by date, id)
+    """
+    conn = get_db()
+    try:
+        conn.execute("BEGIN")
+        row = conn.execute("SELECT value FROM settings WHERE key = 'data_version'").fetchone()
+        rows = conn.execute(
+            f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions ORDER BY date, id").fetchall()
+        conn.rollback()
+        return (int(row[0]) if row else 0), [tuple(r) for r in rows]
+    finally:
+        conn.close()
+
+# Larger gaps are answered with a reset (client reloads the calendar instead)
+CHANGES_MAX_ROWS = 2000
+
+def get_changes_since(since, until):
+    """
+    Transactions changed between two data versions, from the change journal
+
+    The delta is only complete when every version in (since, until] was a
+    journaled row change - versions bumped otherwise (initial balance,
+    backup restore) or journal entries older than the migration mean the
+    client has to reload.
+
+    Args:
+        since: Data version the client has
+        until: Data version to bring it to
+
+    Returns:
+        dict: row_ids (changed transaction ids), dates (days touched before
+              or after the change) - or None when no complete delta exists
+    """
+    if until <= since:
+        return {"row_ids": [], "dates": set()} if until == since else None
+    conn = get_db()
+    try:
+        conn.execute("BEGIN")
+        versions, count = conn.execute('''
+            SELECT COUNT(DISTINCT data_version), COUNT(*) FROM change_journal
+            WHERE data_version > ? AND data_version <= ?
+        ''', (since, until)).fetchone()
+        if versions != until - since or count > CHANGES_MAX_ROWS:
+            return None
+
+        row_ids = {}
+        dates = set()
+        cursor = conn.execute('''
+            SELECT row_id, before, after FROM change_journal
+            WHERE data_version > ? AND data_version <= ?
+            ORDER BY seq
+        ''', (since, until))
+        for row in cursor.fetchall():
+            row_ids[row['row_id']] = True
+            for image in (_load_image(row['before']), _load_image(row['after'])):
+                if image and image.get('date'):
+                    dates.add(image['date'])
+        return {"row_ids": list(row_ids), "dates": dates}
+    finally:
+        conn.rollback()
+        conn.close()
 
 def get_initial_balance():
     """Get initial balance from database"""
@@ -87,6 +841,7 @@ def set_initial_balance(balance):
         INSERT OR REPLACE INTO settings (key, value)
         VALUES ('initial_balance', ?)
     ''', (str(balance),))
+    _bump_data_version(cursor)
     conn.commit()
     conn.close()
 
@@ -117,30 +872,292 @@ def save_users(users):
     conn.commit()
     conn.close()
 
+# Audit entries are written by a background thread in batches:
+# one transaction per AUDIT_FLUSH_SIZE entries or AUDIT_FLUSH_INTERVAL seconds,
+# whichever comes first (a crash loses at most the last interval)
+AUDIT_FLUSH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0
+
+_AUDIT_FLUSH = object()
+_AUDIT_STOP = object()
+
+class AuditWriter:
+    """Queue + background writer for audit_log rows"""
+
+    def __init__(self, flush_size=AUDIT_FLUSH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.cond = threading.Condition()
+        self.submitted = 0
+        self.done = 0
+        self.thread = None
+        self.stopped = False
+
+    def _start(self):
+        with self.cond:
+            if self.thread is None and not self.stopped:
+                self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self.thread.start()
+                atexit.register(self.stop)
+
+    def submit(self, entry):
+        """
+        Queue one entry
+
+        Args:
+            entry: (timestamp, username, action, details JSON) tuple
+        """
+        if self.thread is None:
+            self._start()
+        with self.cond:
+            stopped = self.stopped
+            if not stopped:
+                self.submitted += 1
+        if stopped:
+            # After shutdown: write synchronously
+            self._write([entry])
+            return
+        self.queue.put(entry)
+
+    def flush(self, timeout=5.0):
+        """
+        Write everything queued so far (e.g. before reading the audit log)
+
+        Returns:
+            bool: True if all entries were written within timeout
+        """
+        with self.cond:
+            target = self.submitted
+            if self.done >= target or self.thread is None:
+                return True
+        self.queue.put(_AUDIT_FLUSH)
+        with self.cond:
+            return self.cond.wait_for(lambda: self.done >= target, timeout)
+
+    def stop(self, timeout=5.0):
+        """Drain the queue and stop the writer (registered with atexit)"""
+        with self.cond:
+            if self.stopped:
+                return
+            self.stopped = True
+            thread = self.thread
+        if thread is not None:
+            self.queue.put(_AUDIT_STOP)
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _AUDIT_STOP:
+                break
+            if item is _AUDIT_FLUSH:
+                continue
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _AUDIT_FLUSH:
+                    break
+                if item is _AUDIT_STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+            if stop:
+                break
+
+        # Entries queued concurrently with shutdown
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _AUDIT_FLUSH and item is not _AUDIT_STOP:
+                leftover.append(item)
+        if leftover:
+            self._write(leftover)
+
+    def _write(self, batch):
+        try:
+            conn = get_db()
+            try:
+                conn.executemany('''
+                    INSERT INTO audit_log (timestamp, username, action, details)
+                    VALUES (?, ?, ?, ?)
+                ''', batch)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Audit log write failed ({len(batch)} entries dropped): {e}")
+        finally:
+            with self.cond:
+                self.done += len(batch)
+                self.cond.notify_all()
+
+audit_writer = AuditWriter()
+
 def log_audit(action, details, username='system'):
-    """Log audit entry to database"""
+    """Log audit entry (queued, written by the background audit writer)"""
     from datetime import datetime
+    audit_writer.submit((datetime.now().isoformat(), username, action, json.dumps(details)))
+
+def flush_audit_log(timeout=5.0):
+    """Write all queued audit entries now"""
+    return audit_writer.flush(timeout)
+
+# Audit entries older than this are moved to monthly archive files
+AUDIT_RETENTION_DAYS = 90
+AUDIT_ARCHIVE_CHUNK = 5000
+
+def _audit_entry(row):
+    return {
+        "id": row['id'],
+        "timestamp": row['timestamp'],
+        "username": row['username'],
+        "action": row['action'],
+        "details": json.loads(row['details']) if row['details'] else {}
+    }
+
+def query_audit_log(limit=100, cursor=None, username=None, action=None, date_from=None, date_to=None):
+    """
+    Page through the audit log, newest first (keyset pagination on timestamp, id)
+
+    Args:
+        limit: Page size
+        cursor: next_cursor of the previous page (None = first page)
+        username: Only entries of this user
+        action: Only this action
+        date_from: Only entries from this date/timestamp (ISO, inclusive)
+        date_to: Only entries up to this date (ISO date = whole day, inclusive)
+
+    Returns:
+        tuple: (list of entries, next_cursor or None when there are no more)
+
+    Raises:
+        ValueError: date_to is not a valid ISO date
+    """
+    # Include entries still waiting in the writer queue
+    flush_audit_log()
+
+    where = []
+    params = []
+    if cursor:
+        ts, _, last_id = cursor.rpartition('|')
+        where.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+        params += [ts, ts, int(last_id)]
+    if username:
+        where.append("username = ?")
+        params.append(username)
+    if action:
+        where.append("action = ?")
+        params.append(action)
+    if date_from:
+        where.append("timestamp >= ?")
+        params.append(date_from)
+    if date_to:
+        if len(date_to) == 10:
+            # Date only: the whole day, i.e. before the start of the next one
+            from datetime import date, timedelta
+            where.append("timestamp < ?")
+            params.append((date.fromisoformat(date_to) + timedelta(days=1)).isoformat())
+        else:
+            where.append("timestamp <= ?")
+            params.append(date_to)
+
+    sql = "SELECT id, timestamp, username, action, details FROM audit_log"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO audit_log (timestamp, username, action, details)
-        VALUES (?, ?, ?, ?)
-    ''', (datetime.now().isoformat(), username, action, json.dumps(details)))
-    conn.commit()
-    conn.close()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    logs = [_audit_entry(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = logs[-1]
+        next_cursor = f"{last['timestamp']}|{last['id']}"
+    return logs, next_cursor
 
 def get_audit_log(limit=50):
     """Retrieve audit logs from database"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT timestamp, username, action, details FROM audit_log ORDER BY timestamp DESC LIMIT ?", (limit,))
-    logs = []
-    for row in cursor.fetchall():
-        logs.append({
-            "timestamp": row[0],
-            "username": row[1],
-            "action": row[2],
-            "details": json.loads(row[3]) if row[3] else {}
-        })
-    conn.close()
-    return logs
+    return query_audit_log(limit)[0]
+
+def archive_audit_log(retention_days=AUDIT_RETENTION_DAYS):
+    """
+    Move audit entries older than retention_days into monthly archives
+    (data/audit_archive/audit_YYYY-MM.jsonl.gz, one JSON entry per line)
+
+    Rows are deleted only after their archive file was written, so a crash
+    can at worst leave an entry both archived and in the table.
+
+    Returns:
+        int: Number of archived entries
+    """
+    import gzip
+    import os
+    from datetime import datetime, timedelta
+    from database import AUDIT_ARCHIVE_DIR
+
+    flush_audit_log()
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+
+    archived = 0
+    while True:
+        conn = get_db()
+        try:
+            rows = conn.execute('''
+                SELECT id, timestamp, username, action, details FROM audit_log
+                WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?
+            ''', (cutoff, AUDIT_ARCHIVE_CHUNK)).fetchall()
+            if not rows:
+                break
+
+            months = {}
+            for row in rows:
+                months.setdefault(row['timestamp'][:7], []).append(row)
+            for month, entries in months.items():
+                # Appending adds a gzip member - gzip.open() reads them as one stream
+                path = os.path.join(AUDIT_ARCHIVE_DIR, f'audit_{month}.jsonl.gz')
+                with gzip.open(path, 'at', encoding='utf-8') as f:
+                    for row in entries:
+                        f.write(json.dumps(_audit_entry(row), ensure_ascii=False) + '\n')
+
+            conn.executemany("DELETE FROM audit_log WHERE id = ?", ((row['id'],) for row in rows))
+            conn.commit()
+            archived += len(rows)
+        finally:
+            conn.close()
+
+    if archived:
+        print(f"Audit log: archived {archived} entries older than {retention_days} days")
+    return archived
+
+def get_audit_archives():
+    """
+    Returns:
+        list: {'filename', 'size'} of monthly audit archives, newest first
+    """
+    import os
+    from database import AUDIT_ARCHIVE_DIR
+    if not os.path.isdir(AUDIT_ARCHIVE_DIR):
+        return []
+    return [{'filename': f, 'size': os.path.getsize(os.path.join(AUDIT_ARCHIVE_DIR, f))}
+            for f in sorted(os.listdir(AUDIT_ARCHIVE_DIR), reverse=True) if f.endswith('.jsonl.gz')]
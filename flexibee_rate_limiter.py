@@ -3,78 +3,210 @@ Rate Limiter for FlexiBee API
 Prevents overwhelming the FlexiBee server with too many requests
 """
 
+import asyncio
+import math
+import os
+import sqlite3
 import time
-from threading import Lock
-from collections import deque
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Condition, Lock
+from urllib.parse import urlsplit
+import flexibee_telemetry as telemetry
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+RATE_LIMIT_DB = os.path.join(DATA_DIR, 'rate_limits.db')
+
+# Share the per-server budget between all processes on this host (WSGI workers, CLI syncs)
+SHARED_RATE_LIMITS = True
 
 class RateLimiter:
     """
     Token bucket rate limiter
     Ensures we don't exceed FlexiBee API rate limits
+    
+    Tokens refill continuously (max_requests per time_window) on the monotonic clock,
+    up to burst. A caller reserves its slot under the lock and sleeps outside it, so
+    waiting threads don't block each other or get_stats(); reservations are handed out
+    in call order (FIFO) because every waiter pushes the bucket further into debt.
     """
     
-    def __init__(self, max_requests=50, time_window=60):
+    def __init__(self, max_requests=50, time_window=60, burst=None, name='default'):
         """
         Initialize rate limiter
         
         Args:
             max_requests: Maximum number of requests allowed
             time_window: Time window in seconds (default: 60s = 1 minute)
+            burst: Max. requests sent back to back after idle time (default: max_requests)
+            name: Label for telemetry (server host)
         """
+        self.name = name
         self.max_requests = max_requests
         self.time_window = time_window
-        self.requests = deque()
+        self.burst = burst or max_requests
+        self.rate = max_requests / float(time_window)  # tokens per second
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
         self.lock = Lock()
     
-    def acquire(self):
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def _reserve(self, timeout=None):
+        """
+        Reserve one token
+        
+        Returns:
+            float: Seconds to wait before the request may be sent,
+                   None if the wait would exceed timeout (nothing reserved)
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return None
+            self.tokens -= 1
+            return wait
+    
+    def acquire(self, timeout=None):
         """
         Acquire permission to make a request
         Blocks if rate limit is exceeded
+        
+        Args:
+            timeout: Max. seconds to wait (None = wait as long as needed)
+        
+        Returns:
+            bool: True if acquired, False if it would take longer than timeout
         """
-        with self.lock:
-            now = datetime.now()
-            
-            # Remove old requests outside the time window
-            cutoff = now - timedelta(seconds=self.time_window)
-            while self.requests and self.requests[0] < cutoff:
-                self.requests.popleft()
-            
-            # Check if we're at the limit
-            if len(self.requests) >= self.max_requests:
-                # Calculate how long to wait
-                oldest_request = self.requests[0]
-                wait_until = oldest_request + timedelta(seconds=self.time_window)
-                wait_seconds = (wait_until - now).total_seconds()
-                
-                if wait_seconds > 0:
-                    print(f"⏳ Rate limit reached. Waiting {wait_seconds:.1f}s...")
-                    time.sleep(wait_seconds)
-                    # Recursively try again
-                    return self.acquire()
-            
-            # Record this request
-            self.requests.append(now)
-            return True
+        wait = self._reserve(timeout)
+        if wait is None:
+            return False
+        telemetry.observe('rate_limit_wait', self.name, wait)
+        if wait > 0:
+            if wait >= 1:
+                print(f"⏳ Rate limit reached. Waiting {wait:.1f}s...")
+            time.sleep(wait)
+        return True
+    
+    def try_acquire(self):
+        """Acquire only if a request may be sent right now (never blocks)"""
+        return self.acquire(timeout=0)
+    
+    async def acquire_async(self, timeout=None):
+        """asyncio variant of acquire() - waits without blocking the event loop"""
+        wait = self._reserve(timeout)
+        if wait is None:
+            return False
+        telemetry.observe('rate_limit_wait', self.name, wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
     
     def get_stats(self):
         """Get current rate limiter statistics"""
         with self.lock:
-            now = datetime.now()
-            cutoff = now - timedelta(seconds=self.time_window)
-            
-            # Clean old requests
-            while self.requests and self.requests[0] < cutoff:
-                self.requests.popleft()
-            
+            self._refill(time.monotonic())
+            available = max(0, int(self.tokens))
             return {
-                "requests_in_window": len(self.requests),
+                "requests_in_window": self.max_requests - min(available, self.max_requests),
                 "max_requests": self.max_requests,
                 "time_window": self.time_window,
-                "available_slots": self.max_requests - len(self.requests)
+                "available_slots": available,
+                "burst": self.burst,
+                "waiting": max(0, math.ceil(-self.tokens))
             }
 
 
+class SQLiteRateLimiter(RateLimiter):
+    """
+    Token bucket whose state lives in a SQLite table, so all processes on the host
+    draw from one budget. Same API as RateLimiter.
+    
+    Each reservation is one short BEGIN IMMEDIATE transaction (SQLite serializes
+    writers across processes); the wait itself happens outside of it.
+    time.monotonic() is system-wide (time since boot), so processes share the clock;
+    a timestamp from a previous boot is treated as an idle, full bucket.
+    """
+    
+    def __init__(self, key, max_requests=50, time_window=60, burst=None, db_file=None):
+        """
+        Args:
+            key: Bucket name (e.g. server host) - limiters with the same key share tokens
+            db_file: SQLite file (default: data/rate_limits.db)
+        """
+        super().__init__(max_requests, time_window, burst, name=key)
+        self.key = key
+        self.db_file = db_file or RATE_LIMIT_DB
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            ''')
+        finally:
+            conn.close()
+    
+    def _connect(self):
+        # Autocommit mode - transactions are started explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+    
+    def _update(self, reserve, timeout=None):
+        """
+        Refill the shared bucket and optionally reserve a token in one transaction
+        
+        Returns:
+            tuple: (tokens left, wait in seconds or None if nothing was reserved)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.monotonic()
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (self.key,)).fetchone()
+            if row is None or row[1] > now:
+                tokens = float(self.burst)
+            else:
+                tokens = min(self.burst, row[0] + (now - row[1]) * self.rate)
+            
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if not reserve or (timeout is not None and wait > timeout):
+                wait = None
+            else:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (self.key, tokens, now))
+            conn.execute("COMMIT")
+            return tokens, wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def _reserve(self, timeout=None):
+        return self._update(True, timeout)[1]
+    
+    def get_stats(self):
+        """Get current rate limiter statistics (shared by all processes)"""
+        tokens = self._update(False)[0]
+        available = max(0, int(tokens))
+        return {
+            "requests_in_window": self.max_requests - min(available, self.max_requests),
+            "max_requests": self.max_requests,
+            "time_window": self.time_window,
+            "available_slots": available,
+            "burst": self.burst,
+            "waiting": max(0, math.ceil(-tokens)),
+            "shared": True
+        }
+
+
 class AdaptiveDelay:
     """
     Adaptive delay between requests
@@ -99,9 +231,10 @@ class AdaptiveDelay:
         self.lock = Lock()
     
     def wait(self):
-        """Wait for the current delay period"""
+        """Wait for the current delay period (outside the lock, so threads wait concurrently)"""
         with self.lock:
-            time.sleep(self.current_delay)
+            delay = self.current_delay
+        time.sleep(delay)
     
     def on_success(self):
         """Decrease delay after successful request"""
@@ -125,9 +258,207 @@ class AdaptiveDelay:
             return self.current_delay
 
 
+class ConcurrencyLimiter:
+    """
+    Adaptive limit of in-flight requests to one server (AIMD)
+    
+    - additive increase: +1 per "round" of fast successful responses
+    - multiplicative decrease: halved on overload (HTTP 429/503, timeout),
+      slightly reduced when latency climbs well above the observed baseline
+    - defer(): nobody starts a request until Retry-After elapsed
+    """
+    
+    def __init__(self, initial=2, min_limit=1, max_limit=8, decrease_factor=0.5, latency_tolerance=2.0,
+                 name='default'):
+        """
+        Args:
+            initial: Starting number of concurrent requests
+            min_limit: Never go below this many concurrent requests
+            max_limit: Never go above this many concurrent requests
+            decrease_factor: Multiply limit by this on overload
+            latency_tolerance: Latency above baseline * tolerance counts as congestion
+            name: Label for telemetry (server host)
+        """
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.baseline = None  # lowest recent latency (s)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.condition = Condition()
+    
+    def acquire(self, timeout=None):
+        """
+        Wait for a free request slot
+        
+        Returns:
+            bool: True if acquired, False on timeout
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now >= self.blocked_until and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    telemetry.observe('concurrency_wait', self.name, now - started)
+                    return True
+                wait = self.blocked_until - now if now < self.blocked_until else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait, deadline - now) if wait is not None else deadline - now
+                self.condition.wait(wait)
+    
+    def release(self, latency=None, outcome='success'):
+        """
+        Free the slot and adapt the limit
+        
+        Args:
+            latency: Server response time in seconds (time to response headers)
+            outcome: 'success', 'overload' (429/503/timeout) or 'error' (no signal)
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if outcome == 'overload':
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            elif outcome == 'success' and latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # Let the baseline drift up slowly so it follows a permanently slower server
+                    self.baseline += (latency - self.baseline) * 0.01
+                if latency > self.baseline * self.latency_tolerance:
+                    self.limit = max(self.min_limit, self.limit * 0.9)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            limit = self.limit
+            self.condition.notify_all()
+        telemetry.observe('concurrency_limit', self.name, limit)
+    
+    def defer(self, seconds):
+        """Hold back all new requests for seconds (server sent Retry-After)"""
+        telemetry.observe('concurrency_deferral', self.name, seconds)
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+    
+    def get_stats(self):
+        with self.condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "baseline_latency": self.baseline,
+                "deferred_for": max(0.0, round(self.blocked_until - time.monotonic(), 1))
+            }
+
+
+def parse_retry_after(value):
+    """
+    Parse HTTP Retry-After header (delta-seconds or HTTP-date)
+    
+    Returns:
+        float: Seconds to wait, None if missing or invalid
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
 # Global rate limiter instance
 # Default: 50 requests per minute (safe for most FlexiBee servers)
 flexibee_rate_limiter = RateLimiter(max_requests=50, time_window=60)
 
 # Global adaptive delay
 flexibee_adaptive_delay = AdaptiveDelay(min_delay=0.1, max_delay=2.0)
+
+
+def _create_limiter(key):
+    """Per-server limiter with the global limits; shared across processes if possible"""
+    limits = dict(max_requests=flexibee_rate_limiter.max_requests,
+                  time_window=flexibee_rate_limiter.time_window,
+                  burst=flexibee_rate_limiter.burst)
+    if SHARED_RATE_LIMITS:
+        try:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            return SQLiteRateLimiter(key, **limits)
+        except sqlite3.Error as e:
+            print(f"Shared rate limiter unavailable ({e}), using per-process limiter for {key}")
+    return RateLimiter(name=key, **limits)
+
+
+# Per-server budgets: all companies on one FlexiBee server share its limits
+_host_limiters = {}
+_host_concurrency = {}
+_host_limiters_lock = Lock()
+
+
+def _host_key(host):
+    host = host or ''
+    return (urlsplit(host if '//' in host else '//' + host).netloc or host).lower()
+
+
+def get_host_concurrency(host):
+    """Get the adaptive in-flight request limiter shared by all connectors talking to host"""
+    key = _host_key(host)
+    with _host_limiters_lock:
+        if key not in _host_concurrency:
+            _host_concurrency[key] = ConcurrencyLimiter(name=key)
+        return _host_concurrency[key]
+
+
+def get_host_limiter(host):
+    """
+    Get rate limiter and adaptive delay shared by all connectors talking to host
+
+    Args:
+        host: Server URL or host[:port] (scheme and path are ignored)
+
+    Returns:
+        tuple: (RateLimiter, AdaptiveDelay)
+    """
+    key = _host_key(host)
+    with _host_limiters_lock:
+        if key not in _host_limiters:
+            _host_limiters[key] = (
+                _create_limiter(key),
+                AdaptiveDelay(min_delay=flexibee_adaptive_delay.min_delay,
+                              max_delay=flexibee_adaptive_delay.max_delay)
+            )
+        return _host_limiters[key]
+
+
+def get_host_stats():
+    """
+    Current state of all per-server limiters
+    
+    Returns:
+        dict: {host: {"rate_limiter": ..., "adaptive_delay": ..., "concurrency": ...}}
+    """
+    with _host_limiters_lock:
+        limiters = dict(_host_limiters)
+        concurrency = dict(_host_concurrency)
+    stats = {}
+    for key in sorted(set(limiters) | set(concurrency)):
+        entry = stats[key] = {}
+        if key in limiters:
+            entry["rate_limiter"] = limiters[key][0].get_stats()
+            entry["adaptive_delay"] = limiters[key][1].get_current_delay()
+        if key in concurrency:
+            entry["concurrency"] = concurrency[key].get_stats()
+    return stats
@@ -0,0 +1,178 @@
+"""
+Streaming parsers for FlexiBee (winstrom) documents
+Yields records one by one so large exports never have to fit in memory
+"""
+
+import io
+import json
+import xml.etree.ElementTree as ET
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\r\n'
+
+
+class CountingReader(io.RawIOBase):
+    """Raw stream wrapper counting bytes read (e.g. HTTP response size for page tuning)"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self.bytes_read += n
+        return n
+
+
+def iter_winstrom_records(stream, resources=None):
+    """
+    Iterate over records of a winstrom document (JSON or XML)
+
+    Args:
+        stream: Binary file-like object (open file, HTTP response body, ...)
+        resources: Iterable of resource names to yield (None = all)
+
+    Yields:
+        tuple: (resource, record dict)
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream, CHUNK_SIZE)
+
+    head = stream.peek(64)[:64].lstrip(b'\xef\xbb\xbf \t\r\n')
+    wanted = set(resources) if resources else None
+
+    if head.startswith(b'<'):
+        yield from _iter_xml_records(stream, wanted)
+    else:
+        yield from _iter_json_records(stream, wanted)
+
+
+class _JsonScanner:
+    """Minimal incremental scanner over a text stream (uses json's C decoder per value)"""
+
+    def __init__(self, stream):
+        self.text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Read next chunk; drop already consumed part of the buffer"""
+        if self.eof:
+            return False
+        chunk = self.text.read(size or CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return next non-whitespace character without consuming it ('' on EOF)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"Invalid winstrom JSON: expected {chars!r}, got {ch!r}")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        """Decode next complete JSON value, reading more input as needed"""
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A scalar ending exactly at the buffer end may be truncated (e.g. a number)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow reads geometrically so a huge value isn't re-decoded once per chunk
+            self._fill(size)
+            size *= 2
+
+
+def _iter_json_records(stream, wanted):
+    scanner = _JsonScanner(stream)
+
+    scanner.expect('{')
+    while scanner.peek() != '}':
+        key = scanner.value()
+        scanner.expect(':')
+        if key == 'winstrom' and scanner.peek() == '{':
+            scanner.expect('{')
+            while scanner.peek() != '}':
+                resource = scanner.value()
+                scanner.expect(':')
+                if scanner.peek() == '[' and (wanted is None or resource in wanted):
+                    scanner.expect('[')
+                    while scanner.peek() != ']':
+                        record = scanner.value()
+                        if isinstance(record, dict):
+                            yield resource, record
+                        if scanner.expect(',]') == ']':
+                            break
+                    else:
+                        scanner.expect(']')
+                else:
+                    scanner.value()
+                if scanner.expect(',}') == '}':
+                    break
+            else:
+                scanner.expect('}')
+        else:
+            scanner.value()
+        if scanner.expect(',}') == '}':
+            break
+
+
+def _xml_record(elem):
+    """Convert a winstrom XML record element to the same dict shape as the JSON API"""
+    record = {}
+    for child in elem:
+        tag = child.tag
+        if len(child):
+            # Nested collections (polozky, ...) are not needed for cash flow
+            continue
+        record[tag] = (child.text or '').strip()
+        show_as = child.get('showAs')
+        if show_as is not None:
+            record[f'{tag}@showAs'] = show_as
+    return record
+
+
+def _iter_xml_records(stream, wanted):
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = elem
+            continue
+
+        depth -= 1
+        if depth == 1:
+            if wanted is None or elem.tag in wanted:
+                yield elem.tag, _xml_record(elem)
+            # Free memory for already processed records
+            elem.clear()
+            root.remove(elem)
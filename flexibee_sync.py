@@ -4,11 +4,16 @@ import os
 import uuid
 from datetime import datetime, timedelta
 import urllib3
+import http.client
 import time
 from cryptography.fernet import Fernet
 import base64
 import hashlib
-from flexibee_rate_limiter import flexibee_rate_limiter, flexibee_adaptive_delay
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flexibee_rate_limiter import get_host_limiter, get_host_concurrency, parse_retry_after
+import flexibee_telemetry as telemetry
 
 # Suppress insecure request warnings if user uses self-signed certs
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -17,6 +22,261 @@ DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 CONFIG_FILE = os.path.join(DATA_DIR, 'flexibee_config.json')
 KEY_FILE = os.path.join(DATA_DIR, '.flexibee_key')
 
+INVOICE_RESOURCES = ('faktura-vydana', 'faktura-prijata')
+
+# Columns owned by FlexiBee - other columns (text, original_due_date, ...) stay local on update
+MAPPED_COLUMNS = ('date', 'type', 'amount_minor', 'customer', 'supplier', 'var_symbol',
+                  'description', 'payment_status', 'source_file', 'company')
+
+# Config file is shared by parallel company workers (tuned page sizes, legacy migration)
+_config_lock = threading.RLock()
+
+# Max. number of mapped transactions buffered before they are written to the DB
+UPSERT_BATCH_SIZE = 500
+
+# Max. document codes in one (kod in (...)) filter of a targeted sync (keeps URLs short)
+CODES_PER_REQUEST = 50
+
+# Resources of one company synced in parallel (in-flight requests are limited per server
+# by the adaptive ConcurrencyLimiter)
+RESOURCE_WORKERS = 4
+
+# Companies synced in parallel (each with up to RESOURCE_WORKERS threads)
+COMPANY_WORKERS = 4
+
+
+def parse_flexibee_date(date_str):
+    """
+    Ultra-robust date parsing for FlexiBee.
+    Handles: '2024-05-11+02:00', '11+02:00.05.2024', '2024-11-08T00:00:00'
+    """
+    if not date_str:
+        return ''
+    import re
+    try:
+        # 1. Remove timezone offset like +02:00 or +01:00 wherever it is
+        cleaned = re.sub(r'\+\d{2}:\d{2}', '', str(date_str))
+
+        # 2. Handle T separator (ISO)
+        if 'T' in cleaned:
+            cleaned = cleaned.split('T')[0]
+
+        # 3. Handle DD.MM.YYYY (after timezone removal it might look like 11.05.2024)
+        if '.' in cleaned and '-' not in cleaned:
+            parts = [p for p in cleaned.split('.') if p.strip().isdigit()]
+            if len(parts) >= 3:
+                # Extract day, month, year (taking only digits to be safe)
+                d = parts[0].strip()[-2:]
+                m = parts[1].strip()[-2:]
+                y = parts[2].strip()[:4]
+                return f"{y}-{m.zfill(2)}-{d.zfill(2)}"
+
+        # 4. Final attempt: Extract YYYY-MM-DD using regex
+        match = re.search(r'(\d{4}-\d{2}-\d{2})', cleaned)
+        if match:
+            return match.group(1)
+
+        return cleaned.strip()[:10]
+    except:
+        return str(date_str)[:10] if date_str else ''
+
+
+def parse_flexibee_timestamp(value):
+    """
+    Normalize FlexiBee lastUpdate ('2024-05-11T10:20:30.123+02:00') to the
+    'YYYY-MM-DDTHH:MM:SS' format used for last_sync filters
+    """
+    if not value:
+        return ''
+    return str(value).replace(' ', 'T')[:19]
+
+
+def clean_company_name(company_str):
+    """
+    Remove 'code:' prefix from FlexiBee company name.
+    FlexiBee returns: 'code:Company Name' -> we want: 'Company Name'
+    """
+    if not company_str:
+        return ''
+    company_str = str(company_str).strip()
+    # Remove 'code:' prefix if present
+    if company_str.startswith('code:'):
+        return company_str[5:].strip()
+    return company_str
+
+
+def _is_paid(inv):
+    """Payment flag from API detail ('uhrazeno') or export data ('stavUhrK')"""
+    paid = inv.get('uhrazeno', 0)
+    if isinstance(paid, str):
+        paid = paid.strip().lower() in ('true', '1')
+    if not paid and str(inv.get('stavUhrK', '')).startswith('stavUhr.uhrazeno'):
+        paid = True
+    return bool(paid)
+
+
+def _record_code(record):
+    return record.get('code') or record.get('kod')
+
+
+def _firma_name(record):
+    firma = record.get('firma')
+    if isinstance(firma, dict):
+        firma_raw = firma.get('showAs', '')
+    else:
+        firma_raw = record.get('firma@showAs') or str(firma or '')
+    return clean_company_name(firma_raw)
+
+
+def _apply_amount(t, amount, counterparty, income):
+    """Set signed amount, type and counterparty"""
+    t['amount'] = amount if income else -amount
+    if income:
+        t['type'] = 'Příjem'
+        t['customer'] = counterparty
+        t['supplier'] = ''  # My company
+    else:
+        t['type'] = 'Výdaj'
+        t['customer'] = ''
+        t['supplier'] = counterparty
+
+
+def map_invoice(inv, resource, t):
+    """
+    Map FlexiBee document with due date (invoice, pohledávka, závazek) onto
+    transaction dict t (in place)
+
+    Args:
+        inv: Record (API or export format)
+        resource: SyncResource (or resource name) - resource.sign gives income (+1) / expense (-1)
+        t: Transaction dict to update
+
+    Returns:
+        Updated transaction dict
+    """
+    if isinstance(resource, str):
+        resource = RESOURCES[resource]
+    code = _record_code(inv)
+    amount = abs(float(inv.get('sumCelkem', 0) or 0))
+
+    t['date'] = parse_flexibee_date(inv.get(resource.date_field, ''))  # Due date
+    _apply_amount(t, amount, _firma_name(inv), resource.sign > 0)
+    t['var_symbol'] = inv.get('varSym', '')
+    t['description'] = inv.get('popis', f"{resource.label} {code}")
+    t['payment_status'] = 'zaplaceno' if _is_paid(inv) else 'nezaplaceno'
+    t['source_file'] = resource.source_id(code)
+    return t
+
+
+def map_movement(rec, resource, t):
+    """
+    Map bank / cash movement onto transaction dict t (in place)
+    Direction comes from typPohybuK, movements are always realized (paid)
+    """
+    if isinstance(resource, str):
+        resource = RESOURCES[resource]
+    code = _record_code(rec)
+    amount = abs(float(rec.get('sumCelkem', 0) or 0))
+    incoming = str(rec.get('typPohybuK', '')).endswith('prijem')
+
+    t['date'] = parse_flexibee_date(rec.get(resource.date_field, ''))
+    _apply_amount(t, amount, _firma_name(rec), incoming)
+    t['var_symbol'] = rec.get('varSym', '')
+    t['description'] = rec.get('popis', f"{resource.label} {code}")
+    t['payment_status'] = 'zaplaceno'
+    t['source_file'] = resource.source_id(code)
+    return t
+
+
+class SyncResource:
+    """Declarative description of one synchronized FlexiBee resource"""
+
+    def __init__(self, name, label, detail, mapper, sign=None, date_field='datSplat',
+                 cursor_field='lastUpdate', source_prefix=None, enabled=False, interval_minutes=60):
+        """
+        Args:
+            name: API resource (e.g. 'faktura-vydana')
+            label: Human readable name used in default descriptions
+            detail: Field projection ('detail' query parameter)
+            mapper: Function(record, resource, t) mapping a record onto a transaction
+            sign: +1 income, -1 expense, None = direction given by the record (movements)
+            date_field: Field used as transaction date and for import_from_date filter
+            cursor_field: Field driving the incremental cursor (lastUpdate)
+            source_prefix: Prefix of transactions.source_file (default 'flexibee:<name>:')
+            enabled: Synced by default (can be overridden in config['resources'])
+            interval_minutes: Default schedule interval
+        """
+        self.name = name
+        self.label = label
+        self.detail = detail
+        self.mapper = mapper
+        self.sign = sign
+        self.date_field = date_field
+        self.cursor_field = cursor_field
+        self.source_prefix = source_prefix or f"flexibee:{name}:"
+        self.enabled = enabled
+        self.interval_minutes = interval_minutes
+
+    def source_id(self, code):
+        return f"{self.source_prefix}{code}"
+
+    def owns(self, source_file, row_type):
+        """
+        True if an existing transaction was created by this resource.
+        Invoices share the legacy 'flexibee:' namespace, told apart by income/expense type.
+        """
+        if not source_file.startswith(self.source_prefix):
+            return False
+        if self.source_prefix != LEGACY_PREFIX:
+            return True
+        if any(source_file.startswith(r.source_prefix) for r in RESOURCES.values()
+               if r.source_prefix != LEGACY_PREFIX):
+            return False
+        return row_type == ('Příjem' if self.sign > 0 else 'Výdaj')
+
+
+LEGACY_PREFIX = 'flexibee:'
+_DOCUMENT_DETAIL = 'custom:id,code,datSplat,sumCelkem,firma,varSym,popis,lastUpdate,uhrazeno'
+_MOVEMENT_DETAIL = 'custom:id,code,datVyst,sumCelkem,typPohybuK,firma,varSym,popis,lastUpdate'
+
+# Resource registry - add new FlexiBee evidences here
+RESOURCES = {r.name: r for r in (
+    SyncResource('faktura-vydana', 'Faktura', _DOCUMENT_DETAIL, map_invoice, sign=+1,
+                 source_prefix=LEGACY_PREFIX, enabled=True),
+    SyncResource('faktura-prijata', 'Faktura', _DOCUMENT_DETAIL, map_invoice, sign=-1,
+                 source_prefix=LEGACY_PREFIX, enabled=True),
+    SyncResource('pohledavka', 'Pohledávka',
+                 'custom:id,code,datSplat,sumCelkem,firma,varSym,popis,lastUpdate,stavUhrK',
+                 map_invoice, sign=+1),
+    SyncResource('zavazek', 'Závazek',
+                 'custom:id,code,datSplat,sumCelkem,firma,varSym,popis,lastUpdate,stavUhrK',
+                 map_invoice, sign=-1),
+    SyncResource('banka', 'Bankovní pohyb', _MOVEMENT_DETAIL, map_movement, date_field='datVyst'),
+    SyncResource('pokladni-pohyb', 'Pokladní pohyb', _MOVEMENT_DETAIL, map_movement, date_field='datVyst'),
+)}
+
+
+def _batched(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _before_min_date(date_str, min_date):
+    """True if date_str (YYYY-MM-DD) is before import_from_date gate"""
+    if not min_date or not date_str:
+        return False
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date() < min_date
+    except Exception:
+        return False
+
 class PasswordEncryption:
     """Handle password encryption/decryption using Fernet (symmetric encryption)"""
     
@@ -65,13 +325,28 @@ class PasswordEncryption:
             print(f"Decryption error: {e}")
             return ""
 
+# Errors while reading a page body after the response headers arrived
+# (connection reset, incomplete chunked body, truncated JSON)
+_PAGE_READ_ERRORS = (urllib3.exceptions.HTTPError, http.client.HTTPException, OSError, ValueError)
+
+
 class RetryHandler:
     """Handle retry logic for API requests"""
     
+    # Longer Retry-After than this isn't waited for - the error is raised instead
+    MAX_RETRY_AFTER = 300
+    
+    @staticmethod
+    def backoff(attempt, backoff_factor=2):
+        """Exponential backoff with jitter, so parallel workers don't retry in lockstep"""
+        wait_time = backoff_factor ** attempt
+        return wait_time / 2 + random.uniform(0, wait_time / 2)
+    
     @staticmethod
     def retry_request(func, max_retries=3, backoff_factor=2, timeout=30):
         """
         Retry a function with exponential backoff
+        HTTP 429/503 with Retry-After are retried exactly after the time the server asked for
         
         Args:
             func: Function to retry
@@ -79,40 +354,110 @@ class RetryHandler:
             backoff_factor: Multiplier for wait time between retries
             timeout: Request timeout in seconds
         """
-        last_exception = None
-        
         for attempt in range(max_retries):
+            last_attempt = attempt == max_retries - 1
             try:
                 return func(timeout=timeout)
             except requests.exceptions.Timeout as e:
-                last_exception = e
-                wait_time = backoff_factor ** attempt
-                print(f"Timeout on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
+                if last_attempt:
+                    raise e
+                wait_time = RetryHandler.backoff(attempt, backoff_factor)
+                print(f"Timeout on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time:.1f}s...")
                 time.sleep(wait_time)
             except requests.exceptions.ConnectionError as e:
-                last_exception = e
-                wait_time = backoff_factor ** attempt
-                print(f"Connection error on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
+                if last_attempt:
+                    raise e
+                wait_time = RetryHandler.backoff(attempt, backoff_factor)
+                print(f"Connection error on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time:.1f}s...")
                 time.sleep(wait_time)
             except requests.exceptions.HTTPError as e:
-                # Don't retry on 4xx errors (client errors)
-                if 400 <= e.response.status_code < 500:
+                status_code = e.response.status_code if e.response is not None else 0
+                # Don't retry on 4xx errors (client errors) except 429 Too Many Requests
+                if 400 <= status_code < 500 and status_code != 429:
+                    raise e
+                retry_after = parse_retry_after(e.response.headers.get('Retry-After')) if e.response is not None else None
+                if last_attempt or (retry_after is not None and retry_after > RetryHandler.MAX_RETRY_AFTER):
                     raise e
-                last_exception = e
-                wait_time = backoff_factor ** attempt
-                print(f"HTTP error {e.response.status_code} on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time}s...")
+                if retry_after is not None:
+                    wait_time = retry_after
+                    print(f"HTTP error {status_code} on attempt {attempt + 1}/{max_retries}. Server asks to retry in {wait_time:.1f}s...")
+                else:
+                    wait_time = RetryHandler.backoff(attempt, backoff_factor)
+                    print(f"HTTP error {status_code} on attempt {attempt + 1}/{max_retries}. Retrying in {wait_time:.1f}s...")
                 time.sleep(wait_time)
             except Exception as e:
                 # Unknown error, don't retry
                 raise e
-        
-        # All retries failed
-        raise last_exception
+
+class PageSizeTuner:
+    """
+    Adaptive page size per resource
+    Grows while responses stay fast and small, shrinks on slow/huge pages,
+    timeouts and 5xx errors. Chosen sizes are kept in config['page_sizes'].
+    """
+
+    def __init__(self, config, default_size=100):
+        """
+        Initialize tuner from FlexiBee config
+
+        Config keys (all optional):
+            page_size_min / page_size_max: Bounds for the page size
+            page_target_latency: Target response time in seconds
+            page_target_bytes: Target response size in bytes
+        """
+        self.min_size = int(config.get('page_size_min', 50))
+        self.max_size = max(self.min_size, int(config.get('page_size_max', 1000)))
+        self.target_latency = float(config.get('page_target_latency', 5.0))
+        self.target_bytes = int(config.get('page_target_bytes', 2 * 1024 * 1024))
+        self.default_size = default_size
+        self.sizes = dict(config.get('page_sizes') or {})
+        self.grow_factor = 1.5
+        self.shrink_factor = 0.7
+
+    def _clamp(self, size):
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    def get(self, resource):
+        """Current page size for resource"""
+        return self._clamp(self.sizes.get(resource, self.default_size))
+
+    def on_success(self, resource, latency, nbytes, full_page):
+        """
+        Adjust after a successful page
+
+        Args:
+            resource: API resource
+            latency: Response time in seconds
+            nbytes: Response body size
+            full_page: True if the page was full (more data probably follows)
+        """
+        size = self.get(resource)
+        if latency > self.target_latency or nbytes > self.target_bytes:
+            size = size * self.shrink_factor
+        elif full_page and latency < self.target_latency / 2 and nbytes < self.target_bytes / 2:
+            size = size * self.grow_factor
+        self.sizes[resource] = self._clamp(size)
+        return self.sizes[resource]
+
+    def on_failure(self, resource):
+        """Halve page size after timeout or server error"""
+        self.sizes[resource] = self._clamp(self.get(resource) // 2)
+        return self.sizes[resource]
+
 
 class FlexiBeeConnector:
-    def __init__(self):
+    def __init__(self, company=None):
+        """
+        Args:
+            company: Company code to work with (None = main company from config)
+        """
         self.config = self.load_config()
-        self.page_size = 100  # Default page size for pagination
+        self.company = company or self.config.get('company', '')
+        self._resolve_company()
+        self.page_size = 100  # Default (initial) page size for pagination
+        self.page_tuner = PageSizeTuner(self.config, default_size=self.page_size)
+        # Connection pool shared by all resources synced through this connector
+        self.session = requests.Session()
     
     def load_config(self):
         if os.path.exists(CONFIG_FILE):
@@ -122,37 +467,93 @@ class FlexiBeeConnector:
                      # Decrypt password if encrypted
                      if config.get('password_encrypted'):
                          config['password'] = PasswordEncryption.decrypt(config.get('password', ''))
+                     for entry in config.get('companies') or []:
+                         if entry.pop('password_encrypted', False):
+                             entry['password'] = PasswordEncryption.decrypt(entry.get('password', ''))
                      return config
              except:
                  return {}
         return {}
     
     def save_config(self, config):
-        # Preserve last_sync if not provided in new config
-        old_config = self.load_config()
-        if 'last_sync' in old_config and 'last_sync' not in config:
-            config['last_sync'] = old_config['last_sync']
-        
-        # Encrypt password before saving
-        config_to_save = config.copy()
-        if config_to_save.get('password'):
-            config_to_save['password'] = PasswordEncryption.encrypt(config_to_save['password'])
-            config_to_save['password_encrypted'] = True
+        with _config_lock:
+            # Preserve sync state (last_sync, tuned page sizes, resource settings, companies) if not provided in new config
+            old_config = self.load_config()
+            for key in ('last_sync', 'page_sizes', 'resources', 'companies'):
+                if key in old_config and key not in config:
+                    config[key] = old_config[key]
+            
+            # Encrypt password before saving
+            config_to_save = config.copy()
+            if config_to_save.get('password'):
+                config_to_save['password'] = PasswordEncryption.encrypt(config_to_save['password'])
+                config_to_save['password_encrypted'] = True
+            if config_to_save.get('companies'):
+                config_to_save['companies'] = [
+                    dict(entry, password=PasswordEncryption.encrypt(entry['password']), password_encrypted=True)
+                    if entry.get('password') else entry
+                    for entry in config_to_save['companies']
+                ]
+            
+            with open(CONFIG_FILE, 'w') as f:
+                json.dump(config_to_save, f, indent=4)
+            self.config = config
+            self._resolve_company()
+
+    def company_configs(self):
+        """
+        Effective connection settings of all configured companies
+        The main company is defined by the top-level keys (host, company, user, password);
+        config['companies'] lists further companies, missing keys are inherited from the main one.
         
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config_to_save, f, indent=4)
-        self.config = config
+        Returns:
+            list: Dicts with company, label, host, user, password, primary
+        """
+        main = {
+            "company": self.config.get('company', ''),
+            "label": self.config.get('label') or self.config.get('company', ''),
+            "host": self.config.get('host', ''),
+            "user": self.config.get('user', ''),
+            "password": self.config.get('password', ''),
+            "primary": True
+        }
+        companies = [main] if main['company'] else []
+        for entry in self.config.get('companies') or []:
+            code = entry.get('company')
+            if not code or code == main['company'] or entry.get('enabled') is False:
+                continue
+            companies.append({
+                "company": code,
+                "label": entry.get('label') or code,
+                "host": entry.get('host') or main['host'],
+                "user": entry.get('user') or main['user'],
+                "password": entry.get('password') or main['password'],
+                "primary": False
+            })
+        return companies
+
+    def _resolve_company(self):
+        """Pick connection settings and the server's rate limit budget for self.company"""
+        self.settings = next((c for c in self.company_configs() if c['company'] == self.company), {
+            "company": self.company,
+            "host": self.config.get('host', ''),
+            "user": self.config.get('user', ''),
+            "password": self.config.get('password', ''),
+            "primary": self.company == self.config.get('company', '')
+        })
+        self.rate_limiter = get_host_limiter(self.settings['host'])[0]
+        self.concurrency = get_host_concurrency(self.settings['host'])
 
     def get_url(self, path):
-        host = self.config.get('host', '').rstrip('/')
-        company = self.config.get('company', '')
+        host = self.settings.get('host', '').rstrip('/')
+        company = self.company
         # FlexiBee API format: https://server:port/c/company/resource.json
         if not host.startswith('http'):
             host = 'https://' + host
         return f"{host}/c/{company}/{path}"
 
     def get_auth(self):
-        return (self.config.get('user', ''), self.config.get('password', ''))
+        return (self.settings.get('user', ''), self.settings.get('password', ''))
 
     def test_connection(self, host, company, user, password):
         """Test connection and return server info with detailed logging"""
@@ -175,20 +576,22 @@ class FlexiBeeConnector:
         print(f"🏢 Company:  {company}")
         print("-"*70)
         
+        rate_limiter, adaptive_delay = get_host_limiter(test_url)
+        
         def make_request(timeout=10):
             print(f"Sending request (timeout: {timeout}s)...")
             # Rate limiting
-            flexibee_rate_limiter.acquire()
-            flexibee_adaptive_delay.wait()
+            rate_limiter.acquire()
+            adaptive_delay.wait()
             
             try:
                 response = requests.get(url, auth=(user, password), verify=False, timeout=timeout)
                 print(f"Response status: {response.status_code}")
                 response.raise_for_status()
-                flexibee_adaptive_delay.on_success()
+                adaptive_delay.on_success()
                 return response
             except Exception as e:
-                flexibee_adaptive_delay.on_error()
+                adaptive_delay.on_error()
                 raise e
         
         try:
@@ -262,9 +665,25 @@ class FlexiBeeConnector:
             print("="*70 + "\n")
             return {"status": "error", "message": str(e)}
 
-    def _fetch_paginated_data(self, resource, filter_str, params, max_retries=3):
+    def _iter_paginated_data(self, resource, filter_str, params, max_retries=3):
         """
-        Fetch data with pagination support
+        Stream records page by page (see _iter_pages)
+        Tuned page sizes are saved once when the resource run ends - not per
+        page, since every save rewrites the config file and re-encrypts the password
+        """
+        try:
+            yield from self._iter_pages(resource, filter_str, params, max_retries)
+        finally:
+            self._save_page_sizes()
+
+    def _iter_pages(self, resource, filter_str, params, max_retries=3):
+        """
+        Stream records page by page
+        Each response body is decoded incrementally, records are yielded as they
+        arrive - neither a whole page nor the whole resource is held in memory.
+        Page size is tuned per resource by PageSizeTuner, from the time spent in
+        the request and reading the body only (not in the consumer between records).
+        A connection lost mid-page is retried from the first record not yet yielded.
         
         Args:
             resource: API resource (e.g., 'faktura-vydana')
@@ -272,161 +691,326 @@ class FlexiBeeConnector:
             params: Query parameters
             max_retries: Maximum retry attempts per request
         
-        Returns:
-            List of all records
+        Yields:
+            Record dicts
         """
-        all_data = []
+        from flexibee_stream import iter_winstrom_records, CountingReader
+        
         start = 0
+        total = 0
+        read_failures = 0
+        tuner = self.page_tuner
+        
+        if filter_str:
+            url = self.get_url(f'{resource}/{filter_str}.json')
+        else:
+            url = self.get_url(f'{resource}.json')
         
         while True:
-            # Update params with pagination
-            paginated_params = params.copy()
-            paginated_params['start'] = start
-            paginated_params['limit'] = self.page_size
-            
-            if filter_str:
-                url = self.get_url(f'{resource}/{filter_str}.json')
-            else:
-                url = self.get_url(f'{resource}.json')
-            
-            print(f"  Fetching: {url} (start={start})")
+            page = {'attempts': 0}
             
             def make_request(timeout=30):
-                # Rate limiting
-                flexibee_rate_limiter.acquire()
-                flexibee_adaptive_delay.wait()
+                # Page size is read per attempt, so a retry after timeout uses the smaller page
+                page['limit'] = tuner.get(resource)
+                paginated_params = params.copy()
+                paginated_params['start'] = start
+                paginated_params['limit'] = page['limit']
+                print(f"  Fetching: {url} (start={start}, limit={page['limit']})")
+                
+                # Rate limiting (budget shared by all companies on this server) and
+                # adaptive limit of concurrent requests driven by the server's responses
+                self.rate_limiter.acquire()
+                self.concurrency.acquire()
+                page['attempts'] += 1
+                outcome = 'error'
+                latency = None
+                resp = None
                 
                 try:
-                    resp = requests.get(
+                    started = time.monotonic()
+                    resp = self.session.get(
                         url, 
                         params=paginated_params, 
                         auth=self.get_auth(), 
                         verify=False,
-                        timeout=timeout
+                        timeout=timeout,
+                        stream=True
                     )
-                    print(f"  HTTP {resp.status_code} - {len(resp.content)} bytes")
+                    # Time to response headers = server work (the body is streamed afterwards)
+                    latency = page['latency'] = time.monotonic() - started
+                    telemetry.observe('request_latency', resource, latency)
+                    telemetry.increment('responses', f"{resource} {resp.status_code}")
+                    print(f"  HTTP {resp.status_code}")
+                    if resp.status_code in (429, 503):
+                        outcome = 'overload'
+                        retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                        if retry_after is not None:
+                            self.concurrency.defer(retry_after)
                     resp.raise_for_status()
-                    flexibee_adaptive_delay.on_success()
+                    # The slot stays taken while the body streams - the page loop releases it
                     return resp
                 except Exception as e:
-                    flexibee_adaptive_delay.on_error()
+                    if resp is not None:
+                        resp.close()
+                    if isinstance(e, requests.exceptions.Timeout):
+                        outcome = 'overload'
+                        telemetry.increment('responses', f"{resource} timeout")
+                    if isinstance(e, requests.exceptions.Timeout) or (
+                            isinstance(e, requests.exceptions.HTTPError) and e.response is not None
+                            and e.response.status_code >= 500):
+                        print(f"  Shrinking page size for {resource} to {tuner.on_failure(resource)}")
+                    self.concurrency.release(latency, outcome)
                     raise e
             
             try:
-                resp = RetryHandler.retry_request(make_request, max_retries=max_retries, timeout=30)
-                data = resp.json().get('winstrom', {}).get(resource, [])
-                print(f"  Got {len(data)} records from {resource}")
-                
-                if not data:
-                    # No more data
-                    break
+                try:
+                    resp = RetryHandler.retry_request(make_request, max_retries=max_retries, timeout=30)
+                finally:
+                    telemetry.observe('retries', resource, max(0, page['attempts'] - 1))
+                resp.raw.decode_content = True
+                body = CountingReader(resp.raw)
+                count = 0
+                # Request + body reading time; the consumer's work after each yield is excluded
+                latency = page['latency']
+                outcome = 'error'
+                records = iter_winstrom_records(body, [resource])
+                try:
+                    while True:
+                        read_started = time.monotonic()
+                        try:
+                            _, record = next(records)
+                        except StopIteration:
+                            break
+                        finally:
+                            latency += time.monotonic() - read_started
+                        count += 1
+                        yield record
+                    outcome = 'success'
+                except _PAGE_READ_ERRORS as e:
+                    # Connection lost / body cut off mid-page - continue after the records we have
+                    read_failures += 1
+                    if read_failures >= max_retries:
+                        raise
+                    start += count
+                    total += count
+                    wait_time = RetryHandler.backoff(read_failures - 1)
+                    print(f"  Read error on {resource} after {count} records ({e}), "
+                          f"shrinking page size to {tuner.on_failure(resource)}, retrying in {wait_time:.1f}s...")
+                    telemetry.increment('responses', f"{resource} read_error")
+                    time.sleep(wait_time)
+                    continue
+                finally:
+                    resp.close()
+                    self.concurrency.release(page['latency'], outcome)
+                read_failures = 0
                 
-                all_data.extend(data)
+                telemetry.observe('page_duration', resource, latency)
+                telemetry.observe('response_bytes', resource, body.bytes_read)
+                print(f"  Got {count} records from {resource} ({body.bytes_read} bytes in {latency:.2f}s)")
+                tuner.on_success(resource, latency, body.bytes_read, count >= page['limit'])
                 
-                # Check if we got less than page_size, meaning we're done
-                if len(data) < self.page_size:
+                # Check if we got less than page size, meaning we're done
+                if count < page['limit']:
                     break
                 
-                start += self.page_size
-                print(f"Fetched {len(all_data)} records from {resource}...")
+                start += count
+                total += count
+                print(f"Fetched {total} records from {resource}...")
                 
             except Exception as e:
-                print(f"Error fetching page {start // self.page_size} from {resource}: {e}")
+                print(f"Error fetching page at offset {start} from {resource}: {e}")
                 raise e
+
+    def _fetch_paginated_data(self, resource, filter_str, params, max_retries=3):
+        """
+        Fetch data with pagination support
         
-        return all_data
+        Returns:
+            List of all records (prefer _iter_paginated_data for large resources)
+        """
+        return list(self._iter_paginated_data(resource, filter_str, params, max_retries))
 
+    def _save_page_sizes(self):
+        """Persist tuned page sizes for the next run (only when changed)"""
+        if self.page_tuner.sizes != (self.config.get('page_sizes') or {}):
+            with _config_lock:
+                # Re-read so sizes tuned meanwhile by other company workers aren't lost
+                config = self.load_config() or self.config
+                config['page_sizes'] = dict(config.get('page_sizes') or {}, **self.page_tuner.sizes)
+                self.save_config(config)
+
+    def resource_settings(self, name):
+        """
+        Effective settings of a registered resource
+        config['resources'] = {name: {"enabled": bool, "interval_minutes": int}} overrides registry defaults
+        """
+        resource = RESOURCES[name]
+        override = (self.config.get('resources') or {}).get(name, {})
+        return {
+            "enabled": bool(override.get('enabled', resource.enabled)),
+            "interval_minutes": int(override.get('interval_minutes', resource.interval_minutes))
+        }
+
+    def enabled_resources(self):
+        return [name for name in RESOURCES if self.resource_settings(name)['enabled']]
+
+    def get_sync_cursors(self):
+        """
+        Per-resource sync state of this company from SQLite
+        For the main company, migrates the legacy global last_sync (shared by both
+        invoice types) and rows synced before multi-company support on first use
+        """
+        from db_wrapper import get_sync_cursors, save_sync_cursor, claim_legacy_company
+
+        if not self.settings.get('primary'):
+            return get_sync_cursors(self.company)
+
+        with _config_lock:
+            claimed = claim_legacy_company(self.company, LEGACY_PREFIX)
+            if claimed:
+                print(f"Assigned {claimed} FlexiBee transactions to company {self.company}")
+            cursors = get_sync_cursors(self.company)
+            # Fresh config - self.config may predate settings saved meanwhile (config endpoint)
+            config = self.load_config()
+            legacy = config.get('last_sync', '')
+            if legacy:
+                for name in INVOICE_RESOURCES:
+                    if name not in cursors:
+                        save_sync_cursor(name, legacy, 'migrated', company=self.company)
+                config['last_sync'] = ''
+                self.save_config(config)
+                self.config['last_sync'] = ''
+                cursors = get_sync_cursors(self.company)
+        return cursors
+
+    def reset_sync_state(self, resources=None, all_companies=False):
+        """Forget cursors (all or given resources) - next sync re-imports everything"""
+        from db_wrapper import reset_sync_cursors
+        self.get_sync_cursors()  # migrate legacy last_sync first so it can't come back
+        reset_sync_cursors(resources, None if all_companies else self.company)
+
+    def due_resources(self, now=None):
+        """Enabled resources whose schedule interval elapsed since their last run"""
+        now = now or datetime.now()
+        cursors = self.get_sync_cursors()
+        due = []
+        for name in self.enabled_resources():
+            last_run = cursors.get(name, {}).get('last_run')
+            interval = timedelta(minutes=self.resource_settings(name)['interval_minutes'])
+            try:
+                if last_run and datetime.fromisoformat(last_run) + interval > now:
+                    continue
+            except ValueError:
+                pass
+            due.append(name)
+        return due
+
+    def sync_due_resources(self):
+        """Scheduler entry point - sync only resources that are due"""
+        due = self.due_resources()
+        if not due:
+            return {"status": "success", "resources": {}, "total_synced": 0}
+        return self.sync_resources(due)
 
     def sync_invoices(self, import_from_date_override=None):
+        """Synchronize issued and received invoices (see sync_resources)"""
+        return self.sync_resources(INVOICE_RESOURCES, import_from_date_override)
+
+    def sync_resources(self, names=None, import_from_date_override=None):
         """
-        Synchronize issued and received invoices.
-        Smart Sync: Only fetches records changed since last_sync.
+        Synchronize registered resources.
+        Smart Sync: every resource has its own lastUpdate cursor, so a failure
+        of one resource doesn't hold back the others.
         Features:
         - Pagination for large datasets
         - Retry mechanism with exponential backoff
         - Encrypted password storage
-        """
-        def parse_flexibee_date(date_str):
-            """
-            Ultra-robust date parsing for FlexiBee.
-            Handles: '2024-05-11+02:00', '11+02:00.05.2024', '2024-11-08T00:00:00'
-            """
-            if not date_str:
-                return ''
-            import re
-            try:
-                # 1. Remove timezone offset like +02:00 or +01:00 wherever it is
-                cleaned = re.sub(r'\+\d{2}:\d{2}', '', str(date_str))
-                
-                # 2. Handle T separator (ISO)
-                if 'T' in cleaned:
-                    cleaned = cleaned.split('T')[0]
-                
-                # 3. Handle DD.MM.YYYY (after timezone removal it might look like 11.05.2024)
-                if '.' in cleaned and '-' not in cleaned:
-                    parts = [p for p in cleaned.split('.') if p.strip().isdigit()]
-                    if len(parts) >= 3:
-                        # Extract day, month, year (taking only digits to be safe)
-                        d = parts[0].strip()[-2:]
-                        m = parts[1].strip()[-2:]
-                        y = parts[2].strip()[:4]
-                        return f"{y}-{m.zfill(2)}-{d.zfill(2)}"
-                
-                # 4. Final attempt: Extract YYYY-MM-DD using regex
-                match = re.search(r'(\d{4}-\d{2}-\d{2})', cleaned)
-                if match:
-                    return match.group(1)
-                
-                return cleaned.strip()[:10]
-            except:
-                return str(date_str)[:10] if date_str else ''
         
-        def clean_company_name(company_str):
-            """
-            Remove 'code:' prefix from FlexiBee company name.
-            FlexiBee returns: 'code:Company Name' -> we want: 'Company Name'
-            """
-            if not company_str:
-                return ''
-            company_str = str(company_str).strip()
-            # Remove 'code:' prefix if present
-            if company_str.startswith('code:'):
-                return company_str[5:].strip()
-            return company_str
+        Args:
+            names: Resource names (None = all enabled resources)
+            import_from_date_override: import_from_date from request (fallback: config)
         
-        if not self.config.get('enabled') and not self.config.get('manual_run'):
-            # If not explicitly enabled, do nothing (unless forced manually)
-            pass
+        Returns:
+            dict: Per-resource results plus invoice totals for the UI
+        """
+        from db_wrapper import get_source_index, save_sync_cursor
+
+        names = list(names) if names is not None else self.enabled_resources()
 
-        last_sync = self.config.get('last_sync', '')
         # import_from_date: use override from request, fallback to config
         import_from_date = import_from_date_override or self.config.get('import_from_date', '')
         if import_from_date_override:
             print(f"Using import_from_date from request: {import_from_date}")
         elif import_from_date:
             print(f"Using import_from_date from config: {import_from_date}")
-        now = datetime.now()
 
-        from db_wrapper import save_transactions, load_transactions
-        import uuid
+        # Python-side date gate: skip any record before import_from_date regardless of URL filter
+        # This is a guaranteed safety net even if the cursor makes the incremental filter bypass datSplat
+        min_date = None
+        if import_from_date:
+            try:
+                min_date = datetime.strptime(import_from_date, '%Y-%m-%d').date()
+                print(f"Python-side date gate: skip records dated before {min_date}")
+            except Exception:
+                pass
 
-        existing_transactions = load_transactions()
+        cursors = self.get_sync_cursors()
+        # remote id -> {id, created_at, type}; each resource gets its own part of the index
+        index = get_source_index(LEGACY_PREFIX, self.company)
 
-        # Check how many FlexiBee records we already have
-        flexibee_count = sum(1 for t in existing_transactions if t.get('source_file', '').startswith('flexibee:'))
-        print(f"Existing FlexiBee records in DB: {flexibee_count}")
+        def run(name):
+            resource = RESOURCES[name]
+            existing = {remote_id: row for remote_id, row in index.items() if resource.owns(remote_id, row.get('type'))}
+            try:
+                result = self._sync_resource(resource, cursors.get(name, {}).get('cursor', ''),
+                                             import_from_date, min_date, existing)
+                save_sync_cursor(name, result.pop('cursor') or None, 'success', company=self.company)
+                return result
+            except Exception as e:
+                print(f"Error syncing {name}: {e}")
+                save_sync_cursor(name, None, 'error', str(e), company=self.company)
+                return {"status": "error", "error": str(e), "exception": e, "new": 0, "synced": 0}
+
+        # Resources are independent - fetch them in parallel
+        with ThreadPoolExecutor(max_workers=max(1, min(len(names), RESOURCE_WORKERS)),
+                                thread_name_prefix=f'flexibee-{self.company}') as pool:
+            results = dict(zip(names, pool.map(run, names)))
+        errors = [r.pop('exception') for r in results.values() if 'exception' in r]
 
-        # Force full sync if no FlexiBee records exist in DB (regardless of last_sync)
-        is_initial_sync = (not last_sync) or (flexibee_count == 0)
-        if flexibee_count == 0 and last_sync:
-            print("DB has no FlexiBee records despite last_sync being set — forcing full sync")
+        if errors and len(errors) == len(names):
+            raise errors[0]
 
-        params = {
-            'detail': 'custom:id,code,datSplat,sumCelkem,firma,varSym,popis,lastUpdate,uhrazeno',
+        return {
+            "status": "partial" if errors else "success",
+            "resources": results,
+            "invoices_issued": results.get('faktura-vydana', {}).get('new', 0),
+            "invoices_received": results.get('faktura-prijata', {}).get('new', 0),
+            "total_synced": sum(r['synced'] for r in results.values())
         }
 
+    def _sync_resource(self, resource, cursor, import_from_date, min_date, existing):
+        """
+        Sync one resource: fetch -> map -> upsert pipeline
+        
+        Returns:
+            dict: status, new, synced and the new cursor ('' = unchanged)
+        """
+        from db_wrapper import upsert_transactions, delete_transactions, ChangeBatch
+
+        now = datetime.now()
+        batch_log = ChangeBatch('flexibee_sync', {'company': self.company, 'resource': resource.name})
+        owned = {remote_id for remote_id, row in existing.items() if resource.owns(remote_id, row.get('type'))}
+        print(f"Syncing {self.company}/{resource.name}: {len(owned)} records in DB, cursor={cursor or '-'}")
+
+        # Force full sync if no records of this resource exist in DB (regardless of cursor)
+        is_initial_sync = (not cursor) or (not owned)
+        if not owned and cursor:
+            print(f"DB has no {resource.name} records despite cursor being set — forcing full sync")
+
+        params = {'detail': resource.detail}
+
         # NOTE: FlexiBee WQL only supports 'gt' and 'lt' (NOT 'ge'/'gte'/'le'/'lte')
-        # For import_from_date filtering we use datSplat (invoice due date) NOT lastUpdate,
+        # For import_from_date filtering we use the document date (datSplat) NOT lastUpdate,
         # because an old 2024 invoice can have a recent lastUpdate (e.g. payment status changed).
         # datSplat gt '2025-12-31' correctly returns only invoices due from 2026-01-01 onwards.
         if is_initial_sync:
@@ -435,159 +1019,227 @@ class FlexiBeeConnector:
                     # Subtract 1 day so 'gt' behaves like '>=' for the given date
                     from_dt = datetime.strptime(import_from_date, '%Y-%m-%d') - timedelta(days=1)
                     filter_date = from_dt.strftime('%Y-%m-%d')
-                    filter_str = f"(datSplat gt '{filter_date}')"
-                    print(f"Initial sync filter by datSplat: {filter_str}")
+                    filter_str = f"({resource.date_field} gt '{filter_date}')"
+                    print(f"Initial sync filter: {filter_str}")
                 except Exception:
                     filter_str = ""
                     print("Initial sync: no filter (import all)")
             else:
-                # No date restriction — import ALL invoices from FlexiBee
+                # No date restriction — import ALL records from FlexiBee
                 filter_str = ""
-                print("Initial sync: no filter (import all invoices)")
+                print("Initial sync: no filter (import all records)")
         else:
-            filter_str = f"(lastUpdate gt '{last_sync}')"
+            filter_str = f"({resource.cursor_field} gt '{cursor}')"
             print(f"Incremental sync filter: {filter_str}")
 
-        new_invoices_issued = 0
-        new_invoices_received = 0
+        state = {'new': 0, 'cursor': ''}
+        seen = set()
+
+        def mapped_records():
+            """fetch -> map stage of the pipeline"""
+            for record in self._iter_paginated_data(resource.name, filter_str, params):
+                record_cursor = parse_flexibee_timestamp(record.get(resource.cursor_field))
+                if record_cursor > state['cursor']:
+                    state['cursor'] = record_cursor
+
+                remote_id, t, known = self._map_record(resource, record, existing, now)
+
+                # Python-side date gate: skip records before import_from_date
+                if _before_min_date(t['date'], min_date):
+                    continue
+
+                seen.add(remote_id)
+                if not known:
+                    existing[remote_id] = {'id': t['id'], 'created_at': t['created_at'], 'type': t['type']}
+                    state['new'] += 1
+                yield t
+
+        # map -> upsert stage: at most UPSERT_BATCH_SIZE transactions are buffered
+        synced = 0
+        for batch in _batched(mapped_records(), UPSERT_BATCH_SIZE):
+            upsert_transactions(batch, MAPPED_COLUMNS, batch_log)
+            synced += len(batch)
 
-        # Create a map of existing FlexiBee transactions by remote code
-        existing_map = {}
-        for t in existing_transactions:
-            src = t.get('source_file', '')
-            if src.startswith('flexibee:'):
-                code = src.split(':', 1)[1]
-                existing_map[code] = t
+        if synced and is_initial_sync:
+            # Initial sync: keep other records (manual entries, Excel imports, other resources)
+            # and replace ALL records of this resource with the fresh data
+            stale = owned - seen
+            if stale:
+                delete_transactions([existing.pop(remote_id)['id'] for remote_id in stale], batch_log)
+            print(f"Initial sync of {resource.name}: {synced} records stored, {len(stale)} stale removed")
 
-        updated_transactions = []
+        return {"status": "success", "new": state['new'], "synced": synced, "cursor": state['cursor']}
+
+    def _map_record(self, resource, record, existing, now):
+        """
+        Map one FlexiBee record onto a new or already stored transaction
+        Shared by the sync, the webhook-triggered fetch and the export bootstrap,
+        so all paths store the same data.
+        
+        Args:
+            resource: SyncResource
+            record: Record from the API / export
+            existing: remote id -> {id, created_at, type} of stored rows
+            now: Timestamp for new rows
+        
+        Returns:
+            tuple: (remote id, transaction dict, existing row or None)
+        """
+        remote_id = resource.source_id(_record_code(record))
 
-        # Python-side date gate: skip any invoice before import_from_date regardless of URL filter
-        # This is a guaranteed safety net even if last_sync causes incremental filter to bypass datSplat
+        # Check if exists (legacy invoice ids are shared by both invoice types)
+        known = existing.get(remote_id)
+        if known and not resource.owns(remote_id, known.get('type')):
+            known = None
+        if known:
+            t = {'id': known['id'], 'created_at': known['created_at']}
+        else:
+            t = {'id': str(uuid.uuid4()), 'created_at': now.isoformat()}
+
+        resource.mapper(record, resource, t)
+        t['company'] = self.company
+        return remote_id, t, known
+
+    def sync_codes(self, name, codes, deleted=()):
+        """
+        Targeted sync of individual documents (webhook-triggered)
+        Fetches only the given codes with a (kod in (...)) filter and stores them
+        exactly like the regular sync. Codes reported as deleted are fetched too -
+        only codes FlexiBee no longer returns are removed locally, so a stale delete
+        event can't drop an existing document. The resource cursor is left
+        alone, so the next incremental sync still sees all other changes.
+        
+        Args:
+            name: Resource name (e.g. 'faktura-vydana')
+            codes: Document codes to (re)fetch
+            deleted: Codes deleted in FlexiBee
+        
+        Returns:
+            dict: upserted, deleted, skipped counts
+        """
+        from db_wrapper import get_source_index, upsert_transactions, delete_transactions, ChangeBatch
+
+        resource = RESOURCES[name]
+        batch_log = ChangeBatch('flexibee_webhook', {'company': self.company, 'resource': name})
+        codes = sorted(set(codes) | set(deleted))
+        index = get_source_index(LEGACY_PREFIX, self.company)
+        existing = {remote_id: row for remote_id, row in index.items() if resource.owns(remote_id, row.get('type'))}
+
+        min_date = None
+        if self.config.get('import_from_date'):
+            try:
+                min_date = datetime.strptime(self.config['import_from_date'], '%Y-%m-%d').date()
+            except ValueError:
+                pass
+
+        now = datetime.now()
+        params = {'detail': resource.detail}
+        found = set()
+        upserts = []
+        skipped = 0
+        for chunk in _batched(codes, CODES_PER_REQUEST):
+            # WQL string literals escape a quote by doubling it
+            quoted = ', '.join("'" + str(code).replace("'", "''") + "'" for code in chunk)
+            for record in self._iter_paginated_data(resource.name, f"(kod in ({quoted}))", params):
+                remote_id, t, known = self._map_record(resource, record, existing, now)
+                found.add(remote_id)
+                if _before_min_date(t['date'], min_date):
+                    skipped += 1
+                    continue
+                if not known:
+                    existing[remote_id] = {'id': t['id'], 'created_at': t['created_at'], 'type': t['type']}
+                upserts.append(t)
+
+        if upserts:
+            upsert_transactions(upserts, MAPPED_COLUMNS, batch_log)
+
+        gone = {resource.source_id(code) for code in codes} - found
+        delete_ids = [existing[remote_id]['id'] for remote_id in gone if remote_id in existing]
+        if delete_ids:
+            delete_transactions(delete_ids, batch_log)
+
+        print(f"Targeted sync of {self.company}/{name}: {len(upserts)} upserted, "
+              f"{len(delete_ids)} deleted, {skipped} skipped")
+        return {"upserted": len(upserts), "deleted": len(delete_ids), "skipped": skipped}
+
+    def bootstrap_from_export(self, stream, import_from_date_override=None, batch_size=1000):
+        """
+        Bulk-load records from an offline FlexiBee export (winstrom JSON/XML)
+
+        The file is parsed in streaming fashion and written in batches, so even
+        exports with many years of invoices don't need to fit in memory.
+        Each resource's cursor is set from the newest lastUpdate in the file,
+        so the next API sync only downloads the delta.
+
+        Args:
+            stream: Binary file-like object with the export
+            import_from_date_override: Skip records dated before this date (YYYY-MM-DD)
+            batch_size: Number of transactions written per DB transaction
+
+        Returns:
+            dict: Import statistics
+        """
+        from flexibee_stream import iter_winstrom_records
+        from db_wrapper import upsert_transactions, get_source_index, save_sync_cursor, ChangeBatch
+
+        import_from_date = import_from_date_override or self.config.get('import_from_date', '')
         min_date = None
         if import_from_date:
             try:
                 min_date = datetime.strptime(import_from_date, '%Y-%m-%d').date()
-                print(f"Python-side date gate: skip invoices with datSplat < {min_date}")
             except Exception:
                 pass
 
-        # 1. Issued Invoices (Faktura Vydaná) -> Income
-        try:
-            print("Syncing issued invoices...")
-            data = self._fetch_paginated_data('faktura-vydana', filter_str, params)
-            
-            for inv in data:
-                code = inv.get('code')
-                remote_id = f"flexibee:{code}"
-                
-                # Check if exists
-                t = existing_map.get(remote_id)
-                if not t:
-                    t = {'id': str(uuid.uuid4()), 'created_at': now.isoformat()}
-                    new_invoices_issued += 1
-                
-                # Map fields
-                t['date'] = parse_flexibee_date(inv.get('datSplat', ''))  # Due date
+        now = datetime.now()
+        cursors = self.get_sync_cursors()
+        existing = get_source_index(LEGACY_PREFIX, self.company)
+        print(f"Bootstrap from export into {self.company}: {len(existing)} FlexiBee records already in DB")
 
-                # Python-side date gate: skip invoices before import_from_date
-                if min_date and t['date']:
-                    try:
-                        inv_date = datetime.strptime(t['date'], '%Y-%m-%d').date()
-                        if inv_date < min_date:
-                            # Revert counter if was new
-                            if remote_id not in existing_map:
-                                new_invoices_issued -= 1
-                            continue
-                    except Exception:
-                        pass
+        batch_log = ChangeBatch('flexibee_bootstrap', {'company': self.company})
+        counts = {}
+        max_cursor = {}
+        new_count = 0
+        skipped = 0
+        batch = []
 
-                t['amount'] = float(inv.get('sumCelkem', 0)) # Positive for income
-                t['type'] = 'Příjem'
-                firma_raw = inv.get('firma', {}).get('showAs', '') if isinstance(inv.get('firma'), dict) else str(inv.get('firma', ''))
-                t['customer'] = clean_company_name(firma_raw)
-                t['supplier'] = '' # My company
-                t['var_symbol'] = inv.get('varSym', '')
-                t['description'] = inv.get('popis', f"Faktura {code}")
-                t['payment_status'] = 'zaplaceno' if inv.get('uhrazeno', 0) else 'nezaplaceno'
-                t['source_file'] = remote_id
-
-                updated_transactions.append(t)
-                
-        except Exception as e:
-            print(f"Error syncing issued invoices: {e}")
-            raise e
+        for name, record in iter_winstrom_records(stream, RESOURCES):
+            resource = RESOURCES[name]
+            record_cursor = parse_flexibee_timestamp(record.get(resource.cursor_field))
+            if record_cursor > max_cursor.get(name, ''):
+                max_cursor[name] = record_cursor
 
-        # 2. Received Invoices (Faktura Přijatá) -> Expense
-        try:
-            print("Syncing received invoices...")
-            data = self._fetch_paginated_data('faktura-prijata', filter_str, params)
-            
-            for inv in data:
-                code = inv.get('code')
-                remote_id = f"flexibee:{code}"
-                
-                t = existing_map.get(remote_id)
-                if not t:
-                    t = {'id': str(uuid.uuid4()), 'created_at': now.isoformat()}
-                    new_invoices_received += 1
-                
-                # Map fields
-                t['date'] = parse_flexibee_date(inv.get('datSplat', ''))
+            remote_id, t, known = self._map_record(resource, record, existing, now)
+            if _before_min_date(t['date'], min_date):
+                skipped += 1
+                continue
 
-                # Python-side date gate: skip invoices before import_from_date
-                if min_date and t['date']:
-                    try:
-                        inv_date = datetime.strptime(t['date'], '%Y-%m-%d').date()
-                        if inv_date < min_date:
-                            if remote_id not in existing_map:
-                                new_invoices_received -= 1
-                            continue
-                    except Exception:
-                        pass
+            if not known:
+                existing[remote_id] = {'id': t['id'], 'created_at': t['created_at'], 'type': t['type']}
+                new_count += 1
+            counts[name] = counts.get(name, 0) + 1
+            batch.append(t)
 
-                amount = float(inv.get('sumCelkem', 0))
-                t['amount'] = -abs(amount)
-                t['type'] = 'Výdaj'
-                t['customer'] = ''
-                firma_raw = inv.get('firma', {}).get('showAs', '') if isinstance(inv.get('firma'), dict) else str(inv.get('firma', ''))
-                t['supplier'] = clean_company_name(firma_raw)
-                t['var_symbol'] = inv.get('varSym', '')
-                t['description'] = inv.get('popis', f"Faktura {code}")
-                t['payment_status'] = 'zaplaceno' if inv.get('uhrazeno', 0) else 'nezaplaceno'
-                t['source_file'] = remote_id
-
-                updated_transactions.append(t)
-                
-        except Exception as e:
-            print(f"Error syncing received invoices: {e}")
-            raise e
-
-        # Save changes
-        if updated_transactions:
-            if is_initial_sync:
-                # Initial sync: keep non-FlexiBee records (manual entries, Excel imports)
-                # and replace ALL FlexiBee records with the fresh data
-                non_flexibee = [t for t in existing_transactions
-                                if not t.get('source_file', '').startswith('flexibee:')]
-                final_list = non_flexibee + updated_transactions
-                print(f"Initial sync: kept {len(non_flexibee)} non-FlexiBee records, added {len(updated_transactions)} FlexiBee records")
-            else:
-                # Incremental sync: merge — keep all existing, update/add changed records
-                updated_ids = {t['id'] for t in updated_transactions}
-                final_list = [t for t in existing_transactions if t['id'] not in updated_ids]
-                final_list.extend(updated_transactions)
+            if len(batch) >= batch_size:
+                upsert_transactions(batch, MAPPED_COLUMNS, batch_log)
+                print(f"  Bootstrap: {sum(counts.values())} records loaded...")
+                batch = []
 
-            save_transactions(final_list)
+        if batch:
+            upsert_transactions(batch, MAPPED_COLUMNS, batch_log)
 
-            # Update last_sync only if successful
-            self.config['last_sync'] = now.strftime('%Y-%m-%dT%H:%M:%S')
-            self.save_config(self.config)
+        for name, value in max_cursor.items():
+            if value and value > cursors.get(name, {}).get('cursor', ''):
+                save_sync_cursor(name, value, 'bootstrap', company=self.company)
 
+        print(f"Bootstrap finished: {counts}, new={new_count}, skipped={skipped}, cursors={max_cursor}")
         return {
             "status": "success",
-            "invoices_issued": new_invoices_issued,
-            "invoices_received": new_invoices_received,
-            "total_synced": len(updated_transactions)
+            "invoices_issued": counts.get('faktura-vydana', 0),
+            "invoices_received": counts.get('faktura-prijata', 0),
+            "resources": counts,
+            "new": new_count,
+            "skipped": skipped,
+            "last_sync": max(max_cursor.values(), default='')
         }
 
     def register_webhook(self, webhook_url, events=None):
@@ -621,3 +1273,52 @@ class FlexiBeeConnector:
             "events": events
         }
 
+
+def sync_companies(companies=None, import_from_date_override=None, due_only=False):
+    """
+    Synchronize several FlexiBee companies concurrently, up to COMPANY_WORKERS at once.
+    Workers on the same server share its rate limit budget (see get_host_limiter),
+    a failing company doesn't stop the others.
+    
+    Args:
+        companies: Company codes (None = all configured companies)
+        import_from_date_override: import_from_date from request (fallback: config)
+        due_only: Sync only resources whose schedule interval elapsed (scheduler)
+    
+    Returns:
+        dict: Per-company results plus totals for the UI
+    """
+    configured = [c['company'] for c in FlexiBeeConnector().company_configs()]
+    codes = [c for c in (companies or configured) if c in configured]
+    if not codes:
+        raise ValueError("No FlexiBee company configured")
+
+    def run(code):
+        connector = FlexiBeeConnector(code)
+        if due_only:
+            return connector.sync_due_resources()
+        return connector.sync_resources(import_from_date_override=import_from_date_override)
+
+    results = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(len(codes), COMPANY_WORKERS)),
+                            thread_name_prefix='flexibee-sync') as pool:
+        futures = {code: pool.submit(run, code) for code in codes}
+        for code, future in futures.items():
+            try:
+                results[code] = future.result()
+            except Exception as e:
+                print(f"Error syncing company {code}: {e}")
+                results[code] = {"status": "error", "error": str(e), "total_synced": 0}
+                errors.append(e)
+
+    if errors and len(errors) == len(codes):
+        raise errors[0]
+
+    return {
+        "status": "partial" if errors or any(r['status'] != 'success' for r in results.values()) else "success",
+        "companies": results,
+        "invoices_issued": sum(r.get('invoices_issued', 0) for r in results.values()),
+        "invoices_received": sum(r.get('invoices_received', 0) for r in results.values()),
+        "total_synced": sum(r.get('total_synced', 0) for r in results.values())
+    }
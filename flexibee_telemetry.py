@@ -0,0 +1,154 @@
+"""
+Telemetry for the FlexiBee client and the API
+Rolling histograms of request latency, response size, retries, time spent
+waiting on the rate/concurrency limiters and the adaptive concurrency limit
+- served at /api/flexibee/stats.
+API serialization/compression metrics are served at /api/stats.
+"""
+
+import time
+from bisect import bisect_right
+from collections import deque
+from threading import Lock
+
+# Bucket upper bounds per unit
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FAST_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+COUNT_BUCKETS = (0, 1, 2, 3, 5)
+LIMIT_BUCKETS = (1, 2, 3, 4, 6, 8)
+
+METRIC_BUCKETS = {
+    "request_latency": SECONDS_BUCKETS,   # time to response headers (server work)
+    "page_duration": SECONDS_BUCKETS,     # whole page incl. streaming the body
+    "response_bytes": BYTES_BUCKETS,
+    "retries": COUNT_BUCKETS,
+    "rate_limit_wait": SECONDS_BUCKETS,   # RateLimiter.acquire
+    "concurrency_wait": SECONDS_BUCKETS,  # ConcurrencyLimiter.acquire
+    "concurrency_limit": LIMIT_BUCKETS,   # ConcurrencyLimiter limit after each response
+    "concurrency_deferral": SECONDS_BUCKETS,  # ConcurrencyLimiter.defer (Retry-After)
+    "api_serialize": FAST_SECONDS_BUCKETS,  # JSON serialization per endpoint
+    "api_compress": FAST_SECONDS_BUCKETS,   # gzip/brotli per endpoint
+    "api_response_bytes": BYTES_BUCKETS,    # uncompressed response body
+    "api_sent_bytes": BYTES_BUCKETS,        # body as sent (after compression)
+}
+
+
+class RollingHistogram:
+    """
+    Histogram over the last window_seconds
+    Keeps at most max_samples observations, so memory stays bounded under load
+    """
+
+    def __init__(self, buckets=SECONDS_BUCKETS, window_seconds=3600, max_samples=2048):
+        """
+        Args:
+            buckets: Sorted bucket upper bounds
+            window_seconds: Observations older than this are dropped
+            max_samples: Max. observations kept (oldest are dropped first)
+        """
+        self.buckets = tuple(buckets)
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=max_samples)
+        self.lock = Lock()
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def observe(self, value):
+        with self.lock:
+            now = time.monotonic()
+            self._prune(now)
+            self.samples.append((now, float(value)))
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: count, sum, min, max, avg, p50/p90/p99 and cumulative bucket counts
+        """
+        with self.lock:
+            self._prune(time.monotonic())
+            values = sorted(v for _, v in self.samples)
+
+        count = len(values)
+        if not count:
+            return {"count": 0}
+
+        def percentile(p):
+            return values[min(count - 1, int(p * count))]
+
+        buckets = {}
+        for bound in self.buckets:
+            buckets[f"le_{bound:g}"] = bisect_right(values, bound)
+        buckets["le_inf"] = count
+
+        total = sum(values)
+        return {
+            "count": count,
+            "sum": round(total, 4),
+            "min": values[0],
+            "max": values[-1],
+            "avg": round(total / count, 4),
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "buckets": buckets
+        }
+
+
+# Global registry: (metric, label) -> RollingHistogram, counter name -> {label: n}
+_histograms = {}
+_counters = {}
+_registry_lock = Lock()
+
+
+def observe(metric, label, value):
+    """
+    Record one observation
+
+    Args:
+        metric: Metric name (see METRIC_BUCKETS)
+        label: Resource name or server host
+        value: Observed value (seconds, bytes, count)
+    """
+    key = (metric, label)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _registry_lock:
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = RollingHistogram(METRIC_BUCKETS.get(metric, SECONDS_BUCKETS))
+    histogram.observe(value)
+
+
+def increment(counter, label, amount=1):
+    """Increase a counter (e.g. HTTP status codes per resource)"""
+    with _registry_lock:
+        values = _counters.setdefault(counter, {})
+        values[label] = values.get(label, 0) + amount
+
+
+def snapshot():
+    """
+    All metrics
+
+    Returns:
+        dict: {"histograms": {metric: {label: stats}}, "counters": {counter: {label: n}}}
+    """
+    with _registry_lock:
+        histograms = list(_histograms.items())
+        counters = {name: dict(values) for name, values in _counters.items()}
+
+    result = {}
+    for (metric, label), histogram in sorted(histograms, key=lambda item: item[0]):
+        result.setdefault(metric, {})[label] = histogram.snapshot()
+    return {"histograms": result, "counters": counters}
+
+
+def reset():
+    """Forget all recorded metrics"""
+    with _registry_lock:
+        _histograms.clear()
+        _counters.clear()
@@ -5,30 +5,157 @@ Handles real-time notifications from FlexiBee server
 This module provides:
 1. Webhook endpoint for receiving FlexiBee notifications
 2. Signature verification for security
-3. Event processing and database updates
+3. Durable event queue - the endpoint only stores the event and answers 202
+4. Background consumer: queued events only mark documents dirty, the consumer
+   fetches them from FlexiBee in batches (debounced) and stores them like the sync
 """
 
 from flask import request, jsonify
 import hmac
 import hashlib
 import json
-from datetime import datetime
-import uuid
+import threading
+import time
+from collections import OrderedDict
+import flexibee_telemetry as telemetry
+
+# Max. number of queued events applied in one batch
+WEBHOOK_BATCH_SIZE = 500
+# Failed batches are retried, events are given up ('failed') after this many attempts
+WEBHOOK_MAX_ATTEMPTS = 5
+# How often the consumer looks into the queue when it isn't woken up by a new event
+WEBHOOK_POLL_INTERVAL = 5.0
+# Wait this long after a wake-up so a burst of events is fetched with a few requests
+WEBHOOK_DEBOUNCE_SECONDS = 2.0
+# How long a delivery with an event id / change version is remembered for dedupe
+# (FlexiBee retries within hours, not days)
+WEBHOOK_DEDUPE_TTL = 24 * 3600
+# Deliveries without an id are deduped by payload hash only this long - just
+# retries, so a later real change with the same content (A -> B -> A) isn't dropped
+WEBHOOK_DEDUPE_HASH_TTL = 600
+# Max. keys kept in the in-memory LRU in front of the SQLite dedupe table
+WEBHOOK_DEDUPE_LRU_SIZE = 10000
+# Payload fields that may differ between retries of the same delivery
+# (timestamp is the time of the change - same for retries, part of the hash)
+_VOLATILE_FIELDS = ('signature',)
+# Change version FlexiBee assigns to every change (unique per company)
+_VERSION_FIELDS = ('@globalVersion', 'globalVersion', '@in-version', 'version')
+
+
+class WebhookDedupeStore:
+    """
+    Bounded store of already accepted deliveries
+    In-memory LRU answers hot retries in O(1); the SQLite table (webhook_dedupe)
+    makes dedupe survive restarts and work across processes. Keys expire after ttl.
+    """
+
+    def __init__(self, max_entries=WEBHOOK_DEDUPE_LRU_SIZE, ttl_seconds=WEBHOOK_DEDUPE_TTL,
+                 purge_interval=3600, hash_ttl_seconds=WEBHOOK_DEDUPE_HASH_TTL):
+        """
+        Args:
+            max_entries: Max. keys kept in memory (least recently used are dropped)
+            ttl_seconds: How long an event id / version key is remembered
+            purge_interval: Seconds between deletions of expired keys from SQLite
+            hash_ttl_seconds: How long a payload hash key is remembered
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hash_ttl_seconds = hash_ttl_seconds
+        self.purge_interval = purge_interval
+        self.entries = OrderedDict()  # key -> expires_at (unix time)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_purge = 0.0
+
+    @staticmethod
+    def key_for(payload, headers=None):
+        """
+        Dedupe key of a delivery: event id or change version if FlexiBee sends one,
+        otherwise hash of the payload (including the change timestamp)
+        """
+        event_id = payload.get('id') or payload.get('event_id') or (headers or {}).get('X-FlexiBee-Event-Id')
+        if event_id:
+            return f"id:{event_id}"
+        data = payload.get('data') if isinstance(payload.get('data'), dict) else {}
+        version = next((src[f] for src in (payload, data) for f in _VERSION_FIELDS if src.get(f)), None)
+        if version:
+            return f"version:{payload.get('company') or ''}:{version}"
+        stable = {k: v for k, v in payload.items() if k not in _VOLATILE_FIELDS}
+        digest = hashlib.sha256(json.dumps(stable, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return f"sha256:{digest.hexdigest()}"
+
+    def expires_at(self, key):
+        """Expiry of a key - payload hashes are kept only long enough to catch retries"""
+        ttl = self.hash_ttl_seconds if key.startswith('sha256:') else self.ttl_seconds
+        return time.time() + ttl
+
+    def is_known(self, key):
+        """Check the in-memory LRU (constant time, no database access)"""
+        with self.lock:
+            expires = self.entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self.entries[key]
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def remember(self, key, expires_at):
+        with self.lock:
+            self.entries[key] = expires_at
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def record(self, duplicate):
+        """Count a delivery (dedupe hit = retried delivery)"""
+        with self.lock:
+            if duplicate:
+                self.hits += 1
+            else:
+                self.misses += 1
+        telemetry.increment('webhook_deliveries', 'duplicate' if duplicate else 'accepted')
+
+    def purge_expired(self):
+        """Delete expired keys from SQLite (at most once per purge_interval)"""
+        from db_wrapper import purge_webhook_dedupe
+
+        now = time.time()
+        if now - self.last_purge < self.purge_interval:
+            return 0
+        self.last_purge = now
+        return purge_webhook_dedupe()
+
+    def get_stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "cached_keys": len(self.entries)}
+
+
+# Shared by all handlers of this process
+webhook_dedupe = WebhookDedupeStore()
+
 
 class WebhookHandler:
     """Handle incoming webhooks from FlexiBee"""
     
-    def __init__(self, app, secret_key=None):
+    def __init__(self, app, secret_key=None, start_consumer=True):
         """
         Initialize webhook handler
         
         Args:
             app: Flask application instance
             secret_key: Secret key for webhook signature verification
+            start_consumer: Start the background queue consumer
         """
         self.app = app
         self.secret_key = secret_key or "default_webhook_secret"
+        self.dedupe = webhook_dedupe
+        self.consumer = WebhookQueueConsumer(dedupe=self.dedupe)
         self._register_routes()
+        if start_consumer:
+            self.consumer.start()
     
     def _register_routes(self):
         """Register webhook routes with Flask app"""
@@ -46,23 +173,40 @@ class WebhookHandler:
                     "code": "FV2026001",
                     ...
                 },
+                "company": "firma2",   (optional, default: main company)
                 "timestamp": "2026-01-21T10:00:00",
                 "signature": "sha256_hash"
             }
+
+            The event is only validated and queued; it is applied by the background consumer.
+            Retried deliveries (same event id / payload) are acknowledged with 200 and not queued again.
             """
             try:
                 # Verify signature
                 if not self._verify_signature(request):
                     return jsonify({"status": "error", "message": "Invalid signature"}), 401
                 
-                payload = request.json
-                event = payload.get('event')
-                data = payload.get('data', {})
+                payload = request.get_json(silent=True)
+                if not isinstance(payload, dict):
+                    return jsonify({"status": "error", "message": "Invalid JSON payload"}), 400
                 
-                # Process event
-                result = self._process_event(event, data)
+                key = self.dedupe.key_for(payload, request.headers)
+                if self.dedupe.is_known(key):
+                    self.dedupe.record(True)
+                    return jsonify({"status": "duplicate"}), 200
                 
-                return jsonify({"status": "success", "result": result}), 200
+                if not self._is_valid_event(payload):
+                    return jsonify({"status": "error", "message": "Invalid event"}), 400
+
+                expires_at = self.dedupe.expires_at(key)
+                event_id = self._enqueue_event(payload, key, expires_at)
+                self.dedupe.remember(key, expires_at)
+                self.dedupe.record(event_id is None)
+                if event_id is None:
+                    return jsonify({"status": "duplicate"}), 200
+
+                self.consumer.notify()
+                return jsonify({"status": "accepted", "id": event_id}), 202
                 
             except Exception as e:
                 print(f"Webhook error: {e}")
@@ -93,139 +237,172 @@ class WebhookHandler:
         
         return hmac.compare_digest(signature, expected_signature)
     
-    def _process_event(self, event, data):
+    @staticmethod
+    def _parse_event(payload):
+        """Split payload into (event, resource, action, code, data)"""
+        event = str(payload.get('event') or '')
+        data = payload.get('data') or {}
+        resource, action = event.split('.', 1) if '.' in event else (event, 'unknown')
+        code = (data.get('code') or data.get('kod')) if isinstance(data, dict) else None
+        return event, resource, action, code, data
+
+    def _is_valid_event(self, payload):
+        _, resource, _, code, _ = self._parse_event(payload)
+        return bool(resource and code)
+
+    def _enqueue_event(self, payload, dedupe_key=None, expires_at=None):
         """
-        Process webhook event and update database
+        Append webhook payload to the durable queue
         
         Args:
-            event: Event type (e.g., 'faktura-vydana.create')
-            data: Event data
+            payload: Decoded webhook JSON
+            dedupe_key: Delivery key recorded together with the event
         
         Returns:
-            dict: Processing result
+            int: Queue id, None for a duplicate delivery
         """
-        from db_wrapper import save_transactions, load_transactions
-        
-        event_type, action = event.split('.') if '.' in event else (event, 'unknown')
-        
-        if event_type == 'faktura-vydana':
-            return self._process_issued_invoice(data, action)
-        elif event_type == 'faktura-prijata':
-            return self._process_received_invoice(data, action)
-        else:
-            print(f"Unknown event type: {event_type}")
-            return {"processed": False, "reason": "Unknown event type"}
-    
-    def _process_issued_invoice(self, invoice_data, action):
-        """Process issued invoice webhook"""
-        from db_wrapper import save_transactions, load_transactions
-        
-        code = invoice_data.get('code')
-        remote_id = f"flexibee:{code}"
-        
-        transactions = load_transactions()
-        existing = None
-        
-        # Find existing transaction
-        for t in transactions:
-            if t.get('source_file') == remote_id:
-                existing = t
-                break
-        
-        if action == 'delete':
-            # Remove transaction
-            if existing:
-                transactions = [t for t in transactions if t['id'] != existing['id']]
-                save_transactions(transactions)
-                return {"processed": True, "action": "deleted", "id": existing['id']}
-            return {"processed": False, "reason": "Transaction not found"}
-        
-        # Create or update
-        now = datetime.now()
-        
-        if not existing:
-            existing = {
-                'id': str(uuid.uuid4()),
-                'created_at': now.isoformat()
-            }
-            transactions.append(existing)
+        from db_wrapper import enqueue_webhook_event
         
-        # Map fields
-        existing['date'] = invoice_data.get('datSplat', '').split('T')[0]
-        existing['amount'] = float(invoice_data.get('sumCelkem', 0))
-        existing['type'] = 'Příjem'
-        existing['customer'] = invoice_data.get('firma', {}).get('showAs', '') if isinstance(invoice_data.get('firma'), dict) else str(invoice_data.get('firma', ''))
-        existing['supplier'] = ''
-        existing['var_symbol'] = invoice_data.get('varSym', '')
-        existing['description'] = invoice_data.get('popis', f"Faktura {code}")
-        existing['payment_status'] = 'zaplaceno' if invoice_data.get('uhrazeno', 0) else 'nezaplaceno'
-        existing['source_file'] = remote_id
-        existing['modified_at'] = now.isoformat()
+        event, resource, action, code, data = self._parse_event(payload)
+        return enqueue_webhook_event(event, resource, action, code, payload.get('company') or None, data,
+                                     dedupe_key, expires_at)
         
-        save_transactions(transactions)
-        
-        return {
-            "processed": True,
-            "action": action,
-            "id": existing['id'],
-            "code": code
-        }
+
+class WebhookQueueConsumer:
+    """
+    Background consumer of the webhook queue
+
+    Events only mark documents dirty. After a short debounce the consumer takes
+    pending events in batches, collapses them into dirty codes per resource and
+    fetches those with (kod in (...)) filters through FlexiBeeConnector.sync_codes -
+    a burst of 200 updates costs a few API calls and one upsert, with the same
+    mapping as the regular sync.
+    """
+
+    def __init__(self, batch_size=WEBHOOK_BATCH_SIZE, poll_interval=WEBHOOK_POLL_INTERVAL, dedupe=None,
+                 debounce_seconds=WEBHOOK_DEBOUNCE_SECONDS):
+        self.dedupe = dedupe
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.debounce_seconds = debounce_seconds
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start the consumer thread (events left over from a previous run are processed too)"""
+        from db_wrapper import requeue_stale_webhook_events
+
+        if self.thread and self.thread.is_alive():
+            return
+        requeued = requeue_stale_webhook_events()
+        if requeued:
+            print(f"Webhook queue: {requeued} unfinished events returned to the queue")
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='flexibee-webhook-consumer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def notify(self):
+        """Wake the consumer up - a new event was queued"""
+        self.wakeup.set()
+
+    def _run(self):
+        failures = 0
+        while not self.stopped.is_set():
+            # Debounce: let the rest of a burst arrive before fetching
+            if self.debounce_seconds:
+                self.stopped.wait(self.debounce_seconds)
+            try:
+                processed = self.process_pending()
+                failures = 0
+            except Exception as e:
+                print(f"Webhook consumer error: {e}")
+                processed = 0
+                failures += 1
+                # Back off while the database is unavailable
+                time.sleep(min(60, 2 ** failures))
+            if not processed:
+                if self.dedupe is not None:
+                    try:
+                        self.dedupe.purge_expired()
+                    except Exception as e:
+                        print(f"Webhook dedupe purge failed: {e}")
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def process_pending(self):
+        """
+        Apply one batch of queued events
+
+        Returns:
+            int: Number of queue events consumed
+        """
+        from db_wrapper import claim_webhook_events, complete_webhook_events, fail_webhook_events
+
+        events = claim_webhook_events(self.batch_size)
+        if not events:
+            return 0
+
+        ids = [e['id'] for e in events]
+        try:
+            result = self._apply(events)
+        except Exception as e:
+            print(f"Webhook batch of {len(events)} events failed: {e}")
+            fail_webhook_events(ids, e, WEBHOOK_MAX_ATTEMPTS)
+            raise
+
+        complete_webhook_events(ids)
+        print(f"Webhook queue: {len(events)} events -> {result['upserted']} fetched, "
+              f"{result['deleted']} deleted, {result['ignored']} ignored")
+        return len(events)
+
+    @staticmethod
+    def coalesce(events):
+        """
+        Collapse events into dirty document codes
+
+        Returns:
+            dict: (company, resource) -> {"dirty": set of codes, "deleted": set of codes}
+        """
+        documents = {}
+        for event in events:
+            group = documents.setdefault((event['company'], event['resource']), {"dirty": set(), "deleted": set()})
+            if event['action'] == 'delete':
+                group['deleted'].add(event['code'])
+                group['dirty'].discard(event['code'])
+            else:
+                group['dirty'].add(event['code'])
+                group['deleted'].discard(event['code'])
+        return documents
     
-    def _process_received_invoice(self, invoice_data, action):
-        """Process received invoice webhook"""
-        from db_wrapper import save_transactions, load_transactions
-        
-        code = invoice_data.get('code')
-        remote_id = f"flexibee:{code}"
-        
-        transactions = load_transactions()
-        existing = None
-        
-        # Find existing transaction
-        for t in transactions:
-            if t.get('source_file') == remote_id:
-                existing = t
-                break
-        
-        if action == 'delete':
-            # Remove transaction
-            if existing:
-                transactions = [t for t in transactions if t['id'] != existing['id']]
-                save_transactions(transactions)
-                return {"processed": True, "action": "deleted", "id": existing['id']}
-            return {"processed": False, "reason": "Transaction not found"}
-        
-        # Create or update
-        now = datetime.now()
-        
-        if not existing:
-            existing = {
-                'id': str(uuid.uuid4()),
-                'created_at': now.isoformat()
-            }
-            transactions.append(existing)
-        
-        # Map fields
-        existing['date'] = invoice_data.get('datSplat', '').split('T')[0]
-        amount = float(invoice_data.get('sumCelkem', 0))
-        existing['amount'] = -abs(amount)
-        existing['type'] = 'Výdaj'
-        existing['customer'] = ''
-        existing['supplier'] = invoice_data.get('firma', {}).get('showAs', '') if isinstance(invoice_data.get('firma'), dict) else str(invoice_data.get('firma', ''))
-        existing['var_symbol'] = invoice_data.get('varSym', '')
-        existing['description'] = invoice_data.get('popis', f"Faktura {code}")
-        existing['payment_status'] = 'zaplaceno' if invoice_data.get('uhrazeno', 0) else 'nezaplaceno'
-        existing['source_file'] = remote_id
-        existing['modified_at'] = now.isoformat()
-        
-        save_transactions(transactions)
+    def _apply(self, events):
+        """
+        Fetch dirty documents from FlexiBee (kod in (...) batches) and store them with
+        the regular sync mapping - the webhook payload itself is not trusted
+        """
+        from flexibee_sync import FlexiBeeConnector, RESOURCES
         
-        return {
-            "processed": True,
-            "action": action,
-            "id": existing['id'],
-            "code": code
-        }
+        result = {"upserted": 0, "deleted": 0, "ignored": 0}
+        connectors = {}
+        # Same filter as sync_companies - the payload company is not trusted either
+        # (events without company belong to the main company)
+        main = FlexiBeeConnector()
+        configured = {c['company'] for c in main.company_configs()}
+        for (company, name), group in self.coalesce(events).items():
+            if name not in RESOURCES or (company or main.company) not in configured:
+                result['ignored'] += len(group['dirty']) + len(group['deleted'])
+                continue
+            if company not in connectors:
+                connectors[company] = FlexiBeeConnector(company)
+            counts = connectors[company].sync_codes(name, group['dirty'], group['deleted'])
+            result['upserted'] += counts['upserted']
+            result['deleted'] += counts['deleted']
+            result['ignored'] += counts['skipped']
+        return result
 
 
 def init_webhooks(app, secret_key=None):
@@ -0,0 +1,177 @@
+"""
+Columnar in-memory snapshot of the transactions table
+Built once per data version and shared by the calendar, search and debug
+endpoints - NumPy arrays instead of one dict per row for the number crunching
+"""
+
+import threading
+
+import numpy as np
+
+from database import minor_to_amount
+
+# Day ordinal for dates that can't be parsed (sorted before everything else)
+INVALID_DAY = np.iinfo(np.int32).min
+
+
+def _intern(values):
+    """
+    Returns:
+        tuple: (int32 code per value, list of distinct values - index = code)
+    """
+    table = {}
+    codes = np.fromiter((table.setdefault(v, len(table)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(table)
+
+
+def _day_ordinals(dates):
+    """ISO dates -> days since 1970-01-01 (int32)"""
+    try:
+        return np.array(dates, dtype='datetime64[D]').astype(np.int32)
+    except ValueError:
+        days = np.empty(len(dates), dtype=np.int32)
+        for i, d in enumerate(dates):
+            try:
+                days[i] = np.datetime64(d, 'D').astype(np.int32)
+            except ValueError:
+                days[i] = INVALID_DAY
+        return days
+
+
+class LedgerSnapshot:
+    """
+    Read-only columnar view of all transactions, rows sorted by date
+
+    Numeric columns are NumPy arrays: day (ordinal), amount (int64 haléře)
+    and interned codes for type, payment status, company and counterparty.
+    Text columns stay plain lists and are only turned into API dicts for
+    the rows a response actually returns.
+    """
+
+    def __init__(self, version, columns, rows):
+        """
+        Args:
+            version: Data version the rows belong to
+            columns: Column names (db_wrapper.TRANSACTION_COLUMNS)
+            rows: Row tuples sorted by date
+        """
+        self.version = version
+        self.count = len(rows)
+        data = {col: list(values) for col, values in zip(columns, zip(*rows))} if rows else {col: [] for col in columns}
+        self.columns = data
+
+        self.date = data['date']
+        self.day = _day_ordinals(self.date)
+        self.amount = np.array(data['amount_minor'], dtype=np.int64)
+
+        self.type_code, self.types = _intern(data['type'])
+        self.status_code, self.statuses = _intern([(s or '').lower().strip() for s in data['payment_status']])
+        self.company_code, self.companies = _intern([c or '' for c in data['company']])
+        self.party_code, self.parties = _intern(
+            [(s or c or '') for s, c in zip(data['supplier'], data['customer'])])
+
+        # Archived transactions are listed but not counted in balances
+        self.archived = self.status_code == (self.statuses.index('archiv') if 'archiv' in self.statuses else -1)
+        self.flexibee = np.fromiter(((f or '').startswith('flexibee:') for f in data['source_file']),
+                                    dtype=bool, count=self.count)
+
+        # Lowercase text searched by /api/search
+        self._haystack = None
+
+    def company_mask(self, company):
+        """
+        Rows of one FlexiBee company ('' = all); rows without a company are in every view
+        """
+        if not company:
+            return np.ones(self.count, dtype=bool)
+        mask = self.company_code == (self.companies.index('') if '' in self.companies else -1)
+        if company in self.companies:
+            mask |= self.company_code == self.companies.index(company)
+        return mask
+
+    def daily_totals(self, mask):
+        """
+        Group the selected rows by day
+
+        Returns:
+            tuple: (row indices, start offset of each day in them,
+                    income and expense per day as int64 haléře arrays)
+        """
+        idx = np.flatnonzero(mask)
+        if not len(idx):
+            empty = np.zeros(0, dtype=np.int64)
+            return idx, empty, empty, empty
+
+        days = self.day[idx]
+        starts = np.concatenate(([0], np.flatnonzero(days[1:] != days[:-1]) + 1))
+
+        counted = np.where(self.archived[idx], 0, self.amount[idx])
+        income = np.add.reduceat(np.where(counted > 0, counted, 0), starts)
+        expense = np.add.reduceat(np.where(counted <= 0, -counted, 0), starts)
+        return idx, starts, income, expense
+
+    def transaction(self, i):
+        """Row i as the dict load_transactions() returns"""
+        c = self.columns
+        return {
+            "id": c['id'][i],
+            "date": c['date'][i],
+            "type": c['type'][i],
+            "amount": minor_to_amount(int(self.amount[i])),
+            "text": c['text'][i] or "",
+            "supplier": c['supplier'][i] or "",
+            "customer": c['customer'][i] or "",
+            "var_symbol": c['var_symbol'][i] or "",
+            "description": c['description'][i] or "",
+            "payment_status": c['payment_status'][i] or "",
+            "created_by": c['created_by'][i],
+            "created_at": c['created_at'][i],
+            "modified_at": c['modified_at'][i],
+            "original_due_date": c['original_due_date'][i] or c['date'][i],
+            "source_file": c['source_file'][i] or "",
+            "company": c['company'][i] or ""
+        }
+
+    def transactions(self, indices):
+        return [self.transaction(int(i)) for i in indices]
+
+    def search(self, query, mask):
+        """
+        Indices of rows whose var. symbol, counterparty or description contains query,
+        newest first
+        """
+        if self._haystack is None:
+            c = self.columns
+            self._haystack = [
+                f"{vs or ''}\x00{party}\x00{desc or ''}".lower()
+                for vs, party, desc in zip(c['var_symbol'], (self.parties[p] for p in self.party_code), c['description'])
+            ]
+        haystack = self._haystack
+        hits = [i for i in np.flatnonzero(mask) if query in haystack[i]]
+        return hits[::-1]
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_ledger_snapshot():
+    """
+    Snapshot for the current data version (rebuilt only after a write)
+
+    Returns:
+        LedgerSnapshot
+    """
+    global _snapshot
+    from db_wrapper import get_data_version, load_ledger_rows, TRANSACTION_COLUMNS
+
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == get_data_version():
+        return snapshot
+
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot.version != get_data_version():
+            version, rows = load_ledger_rows()
+            snapshot = _snapshot = LedgerSnapshot(version, TRANSACTION_COLUMNS, rows)
+    return snapshot
@@ -0,0 +1,117 @@
+"""
+Read-through cache of serialized API responses
+Entries are keyed by query and the ledger data version, so a write makes
+them stale exactly when it commits. LRU eviction under an entry and byte cap.
+"""
+
+import threading
+from collections import OrderedDict
+
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_MAX_ENTRIES = 512
+
+
+class ResultCache:
+    """LRU of (key, data version) -> response bytes"""
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            max_bytes: Max. total size of cached payloads
+            max_entries: Max. number of cached payloads
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.version = None
+        self.lock = threading.Lock()
+        # key -> Event of a computation in progress (concurrent misses wait for it)
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _set_version(self, version):
+        """Drop everything cached for older data versions"""
+        if version != self.version:
+            self.entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def _store(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self.entries[key] = payload
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def get_or_compute(self, key, version, compute):
+        """
+        Cached payload for key at version, computed (once) on a miss
+
+        Args:
+            key: Hashable query key (e.g. ('calendar', company, today))
+            version: Current data version
+            compute: Callable returning the payload bytes
+
+        Returns:
+            bytes: Payload
+        """
+        while True:
+            with self.lock:
+                if self.version is not None and version < self.version:
+                    # Reader with an older version than the cache - don't evict newer entries
+                    break
+                self._set_version(version)
+                payload = self.entries.get(key)
+                if payload is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                pending = self.inflight.get((key, version))
+                if pending is None:
+                    pending = self.inflight[(key, version)] = threading.Event()
+                    self.misses += 1
+                    break
+            # Same query already being computed - wait and read its result
+            pending.wait()
+
+        try:
+            payload = compute()
+        finally:
+            with self.lock:
+                event = self.inflight.pop((key, version), None)
+            if event is not None:
+                event.set()
+
+        with self.lock:
+            if version == self.version:
+                self._store(key, payload)
+        return payload
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "data_version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+result_cache = ResultCache()
@@ -158,6 +158,50 @@ async function runFlexiBeeSync() {
     }
 }
 
+// Bulk bootstrap from an offline FlexiBee export file
+async function uploadFlexiBeeExport(input) {
+    const file = input.files && input.files[0];
+    const btn = document.getElementById('fb-bootstrap-btn');
+    const log = document.getElementById('fb-sync-log');
+    if (!file || !btn || !log) return;
+
+    const originalText = btn.textContent;
+    btn.textContent = '⏳ Import...';
+    btn.disabled = true;
+    log.textContent = `Načítám export ${file.name}...\n`;
+
+    try {
+        const formData = new FormData();
+        formData.append('file', file);
+        formData.append('import_from_date', document.getElementById('fb-import-from-date')?.value || '');
+
+        const res = await fetch('/api/flexibee/bootstrap', { method: 'POST', body: formData });
+        const data = await res.json();
+
+        if (data.status === 'success') {
+            const details = data.details || {};
+            log.textContent += `✅ Import dokončen!\n`;
+            log.textContent += `Vydané faktury: ${details.invoices_issued || 0}\n`;
+            log.textContent += `Přijaté faktury: ${details.invoices_received || 0}\n`;
+            log.textContent += `Poslední změna v exportu: ${details.last_sync || '-'}\n`;
+
+            if (typeof fetchData === 'function') {
+                fetchData(true);
+            }
+        } else {
+            log.textContent += `❌ Chyba: ${data.message || 'Neznámá chyba'}\n`;
+            alert('❌ Import selhal: ' + (data.message || 'Neznámá chyba'));
+        }
+    } catch (e) {
+        console.error('Error uploading FlexiBee export:', e);
+        log.textContent += `❌ Chyba: ${e}\n`;
+    } finally {
+        input.value = '';
+        btn.textContent = originalText;
+        btn.disabled = false;
+    }
+}
+
 // Update FlexiBee status badge
 function updateFlexiBeeStatus(enabled) {
     const statusEl = document.getElementById('flexibee-status');
@@ -179,6 +223,7 @@ window.loadFlexiBeeConfig = loadFlexiBeeConfig;
 window.saveFlexiBeeConfig = saveFlexiBeeConfig;
 window.testFlexiBeeConnection = testFlexiBeeConnection;
 window.runFlexiBeeSync = runFlexiBeeSync;
+window.uploadFlexiBeeExport = uploadFlexiBeeExport;
 window.updateFlexiBeeStatus = updateFlexiBeeStatus;
 
 console.log('FlexiBee functions loaded');
@@ -7,6 +7,11 @@ let editingTransactionId = null;
 let addingDate = null;
 let expandedTransactionId = null;
 let addingTemplate = {};
+let currentCompany = localStorage.getItem('cashflow-company') || '';
+let calendarVisible = false;
+let changeStream = null;
+let changePollTimer = null;
+const CHANGE_POLL_MS = 5000;
 
 document.addEventListener('DOMContentLoaded', () => {
     const style = document.createElement('style');
@@ -58,6 +63,8 @@ document.addEventListener('DOMContentLoaded', () => {
         tr.tx-row.type-expense:hover { background: rgba(255, 82, 82, 0.1) !important; }
 
         .text-muted { color: #777; font-size: 11px; }
+        /* One-line cell (virtualized tables need a fixed row height); max-width: 0 keeps the column widths */
+        td.cell-clip { white-space: nowrap; overflow: hidden; text-overflow: ellipsis; max-width: 0; }
         .badge-status { padding: 4px 8px; border-radius: 4px; font-size: 11px; text-transform: uppercase; font-weight: bold; }
         .badge-status.zaplaceno { background: #1b5e20; color: #a5d6a7; }
         .badge-status.nezaplaceno { background: #b71c1c; color: #ffcdd2; }
@@ -69,6 +76,7 @@ document.addEventListener('DOMContentLoaded', () => {
         .search-btn { padding: 8px 16px; background: #69f0ae; color: #000; font-weight: bold; border: none; border-radius: 4px; cursor: pointer; }
     `;
     document.head.appendChild(style);
+    loadCompanies();
     fetchData();
     document.getElementById('prev-month').addEventListener('click', () => changeMonth(-1));
     document.getElementById('next-month').addEventListener('click', () => changeMonth(1));
@@ -81,116 +89,312 @@ function changeMonth(delta) {
     fetchData(true);
 }
 
+async function loadCompanies() {
+    const select = document.getElementById('company-filter');
+    if (!select) return;
+    try {
+        const res = await fetch('/api/flexibee/companies');
+        const data = await res.json();
+        const companies = data.companies || [];
+        // Selector is only useful with more than one FlexiBee company
+        if (companies.length < 2) {
+            if (currentCompany) { currentCompany = ''; localStorage.removeItem('cashflow-company'); fetchData(true); }
+            return;
+        }
+        // Option() sets text and value as plain strings - company codes/labels come from config
+        select.replaceChildren(new Option('Všechny firmy', ''),
+            ...companies.map(c => new Option(c.label || c.company, c.company)));
+        select.value = companies.some(c => c.company === currentCompany) ? currentCompany : '';
+        select.style.display = '';
+    } catch (e) { console.error('Error loading companies:', e); }
+}
+
+function changeCompany(company) {
+    currentCompany = company;
+    if (company) localStorage.setItem('cashflow-company', company);
+    else localStorage.removeItem('cashflow-company');
+    fetchData(true);
+}
+
 async function fetchData(skipCheck = false) {
     skipPromptCheck = skipCheck;
     try {
-        const response = await fetch('/api/calendar_data');
+        const response = await fetch(`/api/calendar_data?company=${encodeURIComponent(currentCompany)}`);
         const data = await response.json();
         lastData = data;
-        const balEl = document.getElementById('display-initial-balance');
-        if (balEl) balEl.textContent = formatMoney(data.initial_balance);
-        const currBalEl = document.getElementById('display-current-balance');
-        if (currBalEl && data.current_total_balance !== undefined) {
-            const bal = data.current_total_balance;
-            currBalEl.textContent = formatMoney(bal);
-            currBalEl.style.color = bal >= 0 ? '#69f0ae' : '#ff5252';
-        }
+        updateBalanceDisplay(data);
         renderExcelView();
+        startChangeFeed();
         if (!skipPromptCheck) checkStartupPrompt();
         const monthNames = ['Leden', 'Únor', 'Březen', 'Duben', 'Květen', 'Červen', 'Červenec', 'Srpen', 'Září', 'Říjen', 'Listopad', 'Prosinec'];
         document.getElementById('current-month-label').textContent = `${monthNames[currentMonth]} ${currentYear}`;
     } catch (error) { console.error('Error fetching data:', error); }
 }
 
+function updateBalanceDisplay(data) {
+    const balEl = document.getElementById('display-initial-balance');
+    if (balEl) balEl.textContent = formatMoney(data.initial_balance);
+    const currBalEl = document.getElementById('display-current-balance');
+    if (currBalEl && data.current_total_balance !== undefined) {
+        const bal = data.current_total_balance;
+        currBalEl.textContent = formatMoney(bal);
+        currBalEl.style.color = bal >= 0 ? '#69f0ae' : '#ff5252';
+    }
+}
+
+/* Live updates - deltas from /api/changes instead of reloading the whole calendar */
+function changesUrl() {
+    return `/api/changes?since=${lastData.data_version}&company=${encodeURIComponent(currentCompany)}`;
+}
+
+function startChangeFeed() {
+    if (changeStream) { changeStream.close(); changeStream = null; }
+    if (changePollTimer) { clearInterval(changePollTimer); changePollTimer = null; }
+    if (!lastData || lastData.data_version === undefined) return;
+    if (!window.EventSource) { startChangePolling(); return; }
+    changeStream = new EventSource(changesUrl());
+    changeStream.addEventListener('delta', e => applyDelta(JSON.parse(e.data)));
+    // Closed for good (e.g. 503 - all stream slots taken) - poll instead
+    changeStream.onerror = () => {
+        if (changeStream && changeStream.readyState === EventSource.CLOSED) { changeStream = null; startChangePolling(); }
+    };
+}
+
+function startChangePolling() {
+    if (!changePollTimer) changePollTimer = setInterval(syncChanges, CHANGE_POLL_MS);
+}
+
+// One delta request - after our own writes, so the change shows up without a full reload
+async function syncChanges() {
+    if (!lastData || lastData.data_version === undefined) { fetchData(true); return; }
+    try {
+        const res = await fetch(changesUrl());
+        if (res.ok) applyDelta(await res.json());
+    } catch (e) { console.error('Error fetching changes:', e); }
+}
+
+function applyDelta(delta) {
+    if (!lastData || delta.version <= lastData.data_version) return;
+    // Delta starts after what we have (or the server can't build one) - reload everything
+    if (delta.reset || delta.since > lastData.data_version) { fetchData(true); return; }
+
+    const dailyStatus = lastData.daily_status;
+    Object.entries(delta.days || {}).forEach(([date, day]) => {
+        if (day) dailyStatus[date] = day;
+        else delete dailyStatus[date];
+    });
+    // Replace (don't mutate) day objects - the table repaints rows whose object changed
+    Object.entries(delta.balances || {}).forEach(([date, balance]) => {
+        if (dailyStatus[date]) dailyStatus[date] = { ...dailyStatus[date], balance };
+    });
+    lastData.initial_balance = delta.initial_balance;
+    lastData.current_total_balance = delta.current_total_balance;
+    lastData.data_version = delta.version;
+    updateBalanceDisplay(lastData);
+    if (calendarVisible) renderExcelView();
+}
+
+/* Virtualized table body - only rows in (or near) the viewport exist in the DOM.
+   Row elements are recycled while scrolling, and setItems() with mostly the same
+   item objects (e.g. after a live delta) only rewrites the rows whose item changed. */
+class VirtualTable {
+    constructor(tbody, { columns, renderRow, scrollEl = window, rowHeight = 36, overscan = 10, isSame = (a, b) => a === b, emptyText = '' }) {
+        this.tbody = tbody;
+        this.columns = columns;
+        this.renderRow = renderRow;
+        this.scrollEl = scrollEl;
+        this.rowHeight = rowHeight;
+        this.overscan = overscan;
+        this.isSame = isSame;
+        this.emptyText = emptyText;
+        this.items = [];
+        this.rows = [];
+        this.measured = false;
+        this.frame = null;
+        this.topSpacer = this.createSpacer();
+        this.bottomSpacer = this.createSpacer();
+        tbody.innerHTML = '';
+        tbody.append(this.topSpacer, this.bottomSpacer);
+        this.onScroll = () => {
+            if (!this.frame) this.frame = requestAnimationFrame(() => { this.frame = null; this.render(); });
+        };
+        scrollEl.addEventListener('scroll', this.onScroll, { passive: true });
+        window.addEventListener('resize', this.onScroll);
+    }
+
+    createSpacer() {
+        const tr = document.createElement('tr');
+        tr.innerHTML = `<td colspan="${this.columns}" style="padding: 0; border: 0; height: 0;"></td>`;
+        return tr;
+    }
+
+    setItems(items) {
+        this.items = items;
+        this.render();
+    }
+
+    destroy() {
+        this.scrollEl.removeEventListener('scroll', this.onScroll);
+        window.removeEventListener('resize', this.onScroll);
+        if (this.frame) cancelAnimationFrame(this.frame);
+    }
+
+    visibleRange() {
+        const count = this.items.length;
+        const view = this.scrollEl === window ? { top: 0, height: window.innerHeight } : this.scrollEl.getBoundingClientRect();
+        // Hidden container (e.g. closed modal) - assume a window-sized viewport
+        const height = view.height || window.innerHeight;
+        const first = Math.max(0, Math.floor((view.top - this.tbody.getBoundingClientRect().top) / this.rowHeight));
+        const start = Math.max(0, Math.min(count, first) - this.overscan);
+        const end = Math.min(count, first + Math.ceil(height / this.rowHeight) + this.overscan);
+        return [start, Math.max(start, end)];
+    }
+
+    render() {
+        // Table replaced (e.g. search results -> calendar) - stop listening
+        if (!this.tbody.isConnected) { this.destroy(); return; }
+        const [start, end] = this.visibleRange();
+
+        // Rows still showing an index in range stay, the others are recycled
+        const kept = new Map();
+        const free = [];
+        this.rows.forEach(tr => (tr._index >= start && tr._index < end ? kept.set(tr._index, tr) : free.push(tr)));
+        const rows = [];
+        for (let i = start; i < end; i++) {
+            const tr = kept.get(i) || free.pop() || document.createElement('tr');
+            const item = this.items[i];
+            if (tr._index !== i || tr._item === undefined || !this.isSame(tr._item, item)) {
+                tr._index = i;
+                tr._item = item;
+                this.renderRow(tr, item, i);
+            }
+            rows.push(tr);
+        }
+        free.forEach(tr => tr.remove());
+
+        // Move only the rows that are out of order
+        let prev = this.topSpacer;
+        rows.forEach(tr => { if (prev.nextSibling !== tr) prev.after(tr); prev = tr; });
+        this.rows = rows;
+
+        this.topSpacer.firstChild.style.height = `${start * this.rowHeight}px`;
+        const bottom = this.bottomSpacer.firstChild;
+        bottom.style.height = `${(this.items.length - end) * this.rowHeight}px`;
+        bottom.textContent = this.items.length ? '' : this.emptyText;
+        bottom.style.padding = this.items.length || !this.emptyText ? '0' : '20px';
+
+        // Spacer heights assume the real row height - measure it once
+        if (!this.measured && rows.length) {
+            const height = rows[0].getBoundingClientRect().height;
+            if (height > 0) {
+                this.measured = true;
+                if (Math.abs(height - this.rowHeight) > 1) { this.rowHeight = height; this.render(); }
+            }
+        }
+    }
+}
+
+let calendarTable = null;
+
 function renderExcelView() {
+    calendarVisible = true;
     const grid = document.getElementById('calendar-grid');
-    grid.innerHTML = '';
-    const container = document.createElement('div');
-    container.style.cssText = 'overflow-x: auto; padding: 20px;';
-
-    const table = document.createElement('table');
-    table.className = 'excel-table';
-    table.style.cssText = 'width: 100%; border-collapse: collapse;';
-
-    const thead = document.createElement('thead');
-    thead.innerHTML = `
-        <tr style="background: #2d2d30; border-bottom: 2px solid #555;">
-            <th style="padding: 12px; text-align: left; color: #fff; font-weight: bold;">Datum</th>
-            <th style="padding: 12px; text-align: right; color: #69f0ae; font-weight: bold;">Příjmy (dané)</th>
-            <th style="padding: 12px; text-align: right; color: #ff5252; font-weight: bold;">Výdaje (dané)</th>
-            <th style="padding: 12px; text-align: right; color: #ccc; font-weight: bold;">Denní změna</th>
-            <th style="padding: 12px; text-align: right; color: #fff; font-weight: bold;">Kumulovaný stav</th>
-        </tr>
-    `;
-    table.appendChild(thead);
 
-    const tbody = document.createElement('tbody');
+    // The table is built once and reused, rows are patched in place
+    if (!calendarTable || !grid.contains(calendarTable.tbody)) {
+        grid.innerHTML = '';
+        const container = document.createElement('div');
+        container.style.cssText = 'overflow-x: auto; padding: 20px;';
+
+        const table = document.createElement('table');
+        table.className = 'excel-table';
+        table.style.cssText = 'width: 100%; border-collapse: collapse;';
+
+        const thead = document.createElement('thead');
+        thead.innerHTML = `
+            <tr style="background: #2d2d30; border-bottom: 2px solid #555;">
+                <th style="padding: 12px; text-align: left; color: #fff; font-weight: bold;">Datum</th>
+                <th style="padding: 12px; text-align: right; color: #69f0ae; font-weight: bold;">Příjmy (dané)</th>
+                <th style="padding: 12px; text-align: right; color: #ff5252; font-weight: bold;">Výdaje (dané)</th>
+                <th style="padding: 12px; text-align: right; color: #ccc; font-weight: bold;">Denní změna</th>
+                <th style="padding: 12px; text-align: right; color: #fff; font-weight: bold;">Kumulovaný stav</th>
+            </tr>
+        `;
+        table.appendChild(thead);
 
-    // Get all dates from daily_status
-    if (!lastData || !lastData.daily_status) {
-        tbody.innerHTML = '<tr><td colspan="5" style="padding: 20px; text-align: center; color: #777;">Žádná data</td></tr>';
+        const tbody = document.createElement('tbody');
         table.appendChild(tbody);
         container.appendChild(table);
         grid.appendChild(container);
+        calendarTable = new VirtualTable(tbody, {
+            columns: 5, rowHeight: 43, renderRow: renderDayRow,
+            isSame: (a, b) => a.date === b.date && a.day === b.day
+        });
+    }
+
+    // Get all dates from daily_status
+    if (!lastData || !lastData.daily_status) {
+        calendarTable.emptyText = 'Žádná data';
+        calendarTable.setItems([]);
         return;
     }
+    calendarTable.emptyText = '';
 
     const dailyStatus = lastData.daily_status;
     const sortedDates = Object.keys(dailyStatus).sort();
 
-    // Filter to show only selected month/year
-    const filteredDates = sortedDates.filter(dateStr => {
+    // Filter to show only selected month/year; show days with any transactions (income OR expense)
+    const days = sortedDates.filter(dateStr => {
         const [y, m] = dateStr.split('-').map(Number);
-        return y === currentYear && (m - 1) === currentMonth;
-    });
-
-    filteredDates.forEach(dateStr => {
         const dayData = dailyStatus[dateStr];
-        const income = dayData.income || 0;
-        const expense = dayData.expense || 0;
-        const dailyChange = income - expense;
-        const balance = dayData.balance || 0;
-
-        // Show days with any transactions (income OR expense)
-        if (income === 0 && expense === 0) return;
-
-        const tr = document.createElement('tr');
-        tr.style.cssText = 'border-bottom: 1px solid #333; transition: background 0.2s; cursor: pointer;';
-        tr.onmouseenter = () => tr.style.background = '#2a2a2a';
-        tr.onmouseleave = () => tr.style.background = 'transparent';
-        tr.onclick = () => {
-            // Build invoice list
-            let invoiceList = '';
-            if (dayData.transactions && dayData.transactions.length > 0) {
-                invoiceList = '\n\n📋 Faktúry splatné v tento deň:\n';
-                dayData.transactions.forEach(t => {
-                    const party = t.customer || t.supplier || 'Neznámy';
-                    const vs = t.var_symbol || '-';
-                    const type = t.amount >= 0 ? '📈 Príjem' : '📉 Výdaj';
-                    invoiceList += `\n${type}: ${party}\nVS: ${vs}\nSuma: ${formatMoney(t.amount)}\n`;
-                });
-            }
+        return y === currentYear && (m - 1) === currentMonth && ((dayData.income || 0) !== 0 || (dayData.expense || 0) !== 0);
+    }).map(dateStr => ({ date: dateStr, day: dailyStatus[dateStr] }));
 
-            alert(`📊 Zostatok k ${dateStr.split('-').reverse().join('.')}:\n\nPríjmy: ${formatMoney(income)}\nVýdaje: ${formatMoney(expense)}\nZmena: ${formatMoney(dailyChange)}\n\n💰 Kumulovaný stav: ${formatMoney(balance)}${invoiceList}`);
-        };
-
-        const balanceColor = balance >= 0 ? '#69f0ae' : '#ff5252';
-        const changeColor = dailyChange >= 0 ? '#69f0ae' : '#ff5252';
+    calendarTable.setItems(days);
+}
 
-        tr.innerHTML = `
-            <td style="padding: 10px; color: #ccc;">${dateStr.split('-').reverse().join('.')}</td>
-            <td style="padding: 10px; text-align: right; color: #69f0ae; font-weight: ${income > 0 ? 'bold' : 'normal'};">${income > 0 ? formatMoney(income) : '0 Kč'}</td>
-            <td style="padding: 10px; text-align: right; color: #ff5252; font-weight: ${expense > 0 ? 'bold' : 'normal'};">${expense > 0 ? formatMoney(expense) : '0 Kč'}</td>
-            <td style="padding: 10px; text-align: right; color: ${changeColor};">${formatMoney(dailyChange)}</td>
-            <td style="padding: 10px; text-align: right; color: ${balanceColor}; font-weight: bold; font-size: 15px;">${formatMoney(balance)}</td>
-        `;
+function renderDayRow(tr, { date: dateStr, day: dayData }) {
+    const income = dayData.income || 0;
+    const expense = dayData.expense || 0;
+    const dailyChange = income - expense;
+    const balance = dayData.balance || 0;
+
+    tr.style.cssText = 'border-bottom: 1px solid #333; transition: background 0.2s; cursor: pointer;';
+    tr.onmouseenter = () => tr.style.background = '#2a2a2a';
+    tr.onmouseleave = () => tr.style.background = 'transparent';
+    tr.onclick = () => showDaySummary(dateStr, dayData);
+
+    const balanceColor = balance >= 0 ? '#69f0ae' : '#ff5252';
+    const changeColor = dailyChange >= 0 ? '#69f0ae' : '#ff5252';
+
+    tr.innerHTML = `
+        <td style="padding: 10px; color: #ccc;">${dateStr.split('-').reverse().join('.')}</td>
+        <td style="padding: 10px; text-align: right; color: #69f0ae; font-weight: ${income > 0 ? 'bold' : 'normal'};">${income > 0 ? formatMoney(income) : '0 Kč'}</td>
+        <td style="padding: 10px; text-align: right; color: #ff5252; font-weight: ${expense > 0 ? 'bold' : 'normal'};">${expense > 0 ? formatMoney(expense) : '0 Kč'}</td>
+        <td style="padding: 10px; text-align: right; color: ${changeColor};">${formatMoney(dailyChange)}</td>
+        <td style="padding: 10px; text-align: right; color: ${balanceColor}; font-weight: bold; font-size: 15px;">${formatMoney(balance)}</td>
+    `;
+}
 
-        tbody.appendChild(tr);
-    });
+function showDaySummary(dateStr, dayData) {
+    const income = dayData.income || 0;
+    const expense = dayData.expense || 0;
+    const dailyChange = income - expense;
+    const balance = dayData.balance || 0;
+
+    // Build invoice list
+    let invoiceList = '';
+    if (dayData.transactions && dayData.transactions.length > 0) {
+        invoiceList = '\n\n📋 Faktúry splatné v tento deň:\n';
+        dayData.transactions.forEach(t => {
+            const party = t.customer || t.supplier || 'Neznámy';
+            const vs = t.var_symbol || '-';
+            const type = t.amount >= 0 ? '📈 Príjem' : '📉 Výdaj';
+            invoiceList += `\n${type}: ${party}\nVS: ${vs}\nSuma: ${formatMoney(t.amount)}\n`;
+        });
+    }
 
-    table.appendChild(tbody);
-    container.appendChild(table);
-    grid.appendChild(container);
+    alert(`📊 Zostatok k ${dateStr.split('-').reverse().join('.')}:\n\nPríjmy: ${formatMoney(income)}\nVýdaje: ${formatMoney(expense)}\nZmena: ${formatMoney(dailyChange)}\n\n💰 Kumulovaný stav: ${formatMoney(balance)}${invoiceList}`);
 }
 
 // Enhanced Add Row with Templates
@@ -264,7 +468,7 @@ window.saveNewTransaction = async (dateStr) => {
     const payload = { date: finalDate, amount: finalAmt, description: desc, supplier: party, var_symbol: vs, payment_status: status, type: type };
     try {
         const res = await fetch('/api/add_transaction', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) });
-        if ((await res.json()).status === 'success') { addingDate = null; fetchData(true); }
+        if ((await res.json()).status === 'success') { addingDate = null; syncChanges(); }
     } catch (e) { alert('Chyba: ' + e); }
 }
 window.startEdit = (id) => { editingTransactionId = id; renderExcelView(); }
@@ -279,14 +483,14 @@ window.saveTransaction = async (id) => {
     const payload = { id: id, date, amount: amt, description: desc, supplier: party, var_symbol: vs, payment_status: status };
     try {
         const res = await fetch('/api/update_transaction', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) });
-        if ((await res.json()).status === 'success') { editingTransactionId = null; fetchData(true); }
+        if ((await res.json()).status === 'success') { editingTransactionId = null; syncChanges(); }
     } catch (e) { alert('Chyba: ' + e); }
 }
 window.deleteTransaction = async (id) => {
     if (!confirm('Smazat?')) return;
     try {
         const res = await fetch('/api/delete_transaction', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ id }) });
-        if ((await res.json()).status === 'success') fetchData(true);
+        if ((await res.json()).status === 'success') syncChanges();
     } catch (e) { alert('Chyba: ' + e); }
 }
 window.toggleDetails = (id) => { expandedTransactionId = (expandedTransactionId === id) ? null : id; renderExcelView(); }
@@ -339,12 +543,13 @@ async function performSearch() {
     if (!q) return;
     document.getElementById('search-modal').style.display = 'none';
     try {
-        const res = await fetch(`/api/search?q=${encodeURIComponent(q)}`);
+        const res = await fetch(`/api/search?q=${encodeURIComponent(q)}&company=${encodeURIComponent(currentCompany)}`);
         const results = await res.json();
         renderSearchResults(results, q);
     } catch (e) { alert('Chyba vyhledávání: ' + e); }
 }
 function renderSearchResults(results, query) {
+    calendarVisible = false;
     const grid = document.getElementById('calendar-grid');
     grid.innerHTML = '';
     const container = document.createElement('div');
@@ -365,16 +570,22 @@ function renderSearchResults(results, query) {
                     <th>Popis</th>
                 </tr>
             </thead>
-            <tbody>
-                ${results.map(t => {
-        const amtClass = t.amount >= 0 ? 'text-income' : 'text-expense';
-        const party = t.customer || t.supplier || '';
-        return `<tr class="tx-row"><td>${t.date}</td><td style="font-family:monospace; color:#ccc">${t.var_symbol || ''}</td><td style="font-weight:600">${party}</td><td class="${amtClass}" style="text-align:right">${formatMoney(t.amount)}</td><td><span class="badge-status ${t.payment_status?.toLowerCase()}">${t.payment_status || '-'}</span></td><td>${t.description || t.text || ''}</td></tr>`;
-    }).join('')}
-            </tbody>
+            <tbody></tbody>
         </table>
     `;
     grid.appendChild(container);
+    const table = new VirtualTable(container.querySelector('tbody'), { columns: 6, rowHeight: 34, renderRow: renderSearchRow });
+    table.setItems(results);
+}
+function renderSearchRow(tr, t) {
+    const amtClass = t.amount >= 0 ? 'text-income' : 'text-expense';
+    const party = t.customer || t.supplier || '';
+    const desc = t.description || t.text || '';
+    tr.className = 'tx-row';
+    // Every cell on one line (full text in the tooltip) - rows keep the height VirtualTable measured
+    tr.innerHTML = `<td class="cell-clip">${t.date}</td><td class="cell-clip" style="font-family:monospace; color:#ccc">${t.var_symbol || ''}</td><td class="cell-clip" style="font-weight:600"></td><td class="cell-clip ${amtClass}" style="text-align:right">${formatMoney(t.amount)}</td><td class="cell-clip"><span class="badge-status ${t.payment_status?.toLowerCase()}">${t.payment_status || '-'}</span></td><td class="cell-clip"></td>`;
+    tr.cells[2].textContent = tr.cells[2].title = party;
+    tr.cells[5].textContent = tr.cells[5].title = desc;
 }
 
 /* Settings Logic */
@@ -411,7 +622,7 @@ async function loadBackupList() {
                 list.innerHTML = d.backups.map(b => `
                     <div style="display:flex; justify-content:space-between; padding:10px; border-bottom:1px solid #333; align-items:center; flex-wrap: wrap; gap: 10px;">
                         <span style="color:#ddd; font-family:monospace; margin-right: 10px;">
-                            ${b.filename} <br><span style="color:#777; font-size:11px">(${b.size}, ${b.created})</span>
+                            ${b.filename} <br><span style="color:#777; font-size:11px">(${b.size}${b.stored ? ', nové ' + b.stored : ''}, ${b.created})</span>
                         </span>
                         <div style="display: flex; gap: 8px; flex-shrink: 0;">
                             <button onclick="restoreBackupFromList('${b.filename}')" style="background:#444; color:#fff; border:none; padding:6px 12px; cursor:pointer; border-radius:4px; font-size: 13px; white-space: nowrap;">↻ Obnovit</button>
@@ -619,23 +830,44 @@ async function handleFileUpload(input, type) {
 }
 
 /* Audit Log */
-async function loadAuditLog() {
+let auditLogCursor = null;
+let auditLogEntries = [];
+let auditLogTable = null;
+async function loadAuditLog(more = false) {
     try {
-        const res = await fetch('/api/audit_log');
-        const logs = await res.json();
+        const url = more && auditLogCursor ? `/api/audit_log?cursor=${encodeURIComponent(auditLogCursor)}` : '/api/audit_log';
+        const res = await fetch(url);
+        const d = await res.json();
         const list = document.getElementById('audit-log-list');
         if (!list) return;
-        list.innerHTML = logs.map(l => `
-            <tr style="border-bottom:1px solid #333;">
-                <td style="padding:8px; color:#aaa;">${l.timestamp}</td>
-                <td style="padding:8px; color:#fff;">${l.user}</td>
-                <td style="padding:8px; color:#69f0ae;">${l.action}</td>
-                <td style="padding:8px; color:#aaa; font-family:monospace; font-size:11px;">${JSON.stringify(l.details || {})}</td>
-            </tr>
-        `).join('');
+        if (!auditLogTable || auditLogTable.tbody !== list) {
+            auditLogTable = new VirtualTable(list, {
+                columns: 4, rowHeight: 34, renderRow: renderAuditRow,
+                scrollEl: list.closest('.table-container') || window
+            });
+        }
+        auditLogEntries = more ? auditLogEntries.concat(d.logs || []) : (d.logs || []);
+        auditLogTable.setItems(auditLogEntries);
+        auditLogCursor = d.next_cursor || null;
+        const moreBtn = document.getElementById('audit-log-more');
+        if (moreBtn) moreBtn.style.display = auditLogCursor ? 'block' : 'none';
     } catch (e) { }
 }
 
+function renderAuditRow(tr, l) {
+    // One line per entry (full details in the tooltip) keeps the row height fixed
+    const details = JSON.stringify(l.details || {});
+    tr.style.cssText = 'border-bottom:1px solid #333;';
+    tr.innerHTML = `
+        <td style="padding:8px; color:#aaa; white-space:nowrap;">${l.timestamp}</td>
+        <td style="padding:8px; color:#fff; white-space:nowrap;">${l.username || ''}</td>
+        <td style="padding:8px; color:#69f0ae; white-space:nowrap;">${l.action}</td>
+        <td style="padding:8px; color:#aaa; font-family:monospace; font-size:11px; max-width:360px; white-space:nowrap; overflow:hidden; text-overflow:ellipsis;"></td>
+    `;
+    tr.lastElementChild.textContent = details;
+    tr.lastElementChild.title = details;
+}
+
 /* Aliases and Helpers */
 window.loadBackups = loadBackupList;
 window.uploadBackup = restoreBackup;
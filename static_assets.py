@@ -0,0 +1,124 @@
+"""
+Fingerprinted static assets
+Content hashes are computed at startup and added to url_for('static', ...)
+links as ?v=<hash>. Such URLs never change content, so they are served with
+year-long immutable caching and precompressed gzip/brotli variants.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import request, Response, g
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Not worth compressing below this size (or for already compressed formats)
+COMPRESS_MIN_SIZE = 512
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class StaticAsset:
+    """One static file: content hash and precompressed variants"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.mtime = os.path.getmtime(path)
+        self.version = hashlib.sha256(self.data).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.encodings = {}
+        if len(self.data) >= COMPRESS_MIN_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            self.encodings['gzip'] = gzip.compress(self.data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encodings['br'] = brotli.compress(self.data)
+
+
+class AssetManifest:
+    """filename (relative to the static folder) -> StaticAsset"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.assets = {}
+        self.scan()
+
+    def scan(self):
+        assets = {}
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                try:
+                    assets[filename] = StaticAsset(path)
+                except OSError as e:
+                    print(f"Static asset {filename} skipped: {e}")
+        self.assets = assets
+        print(f"Static assets fingerprinted: {len(assets)} files")
+
+    def get(self, filename):
+        asset = self.assets.get(filename)
+        # Edited since startup (development) - rehash this file
+        if asset is not None:
+            path = os.path.join(self.static_folder, filename)
+            try:
+                if os.path.getmtime(path) != asset.mtime:
+                    asset = self.assets[filename] = StaticAsset(path)
+            except OSError:
+                pass
+        return asset
+
+
+def _negotiate(asset):
+    """Best precompressed variant accepted by the client: (encoding or None, bytes)"""
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in asset.encodings and accepted[encoding]:
+            return encoding, asset.encodings[encoding]
+    return None, asset.data
+
+
+def init_static_assets(app):
+    """
+    Fingerprint app.static_folder and take over the 'static' endpoint
+
+    Returns:
+        AssetManifest
+    """
+    manifest = AssetManifest(app.static_folder)
+    send_static_file = app.view_functions['static']
+
+    @app.url_defaults
+    def add_asset_version(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            asset = manifest.get(values['filename'])
+            if asset is not None:
+                values['v'] = asset.version
+
+    def static(filename):
+        asset = manifest.get(filename)
+        if asset is None or request.args.get('v') != asset.version:
+            # Plain or outdated URL - regular revalidated file response
+            return send_static_file(filename=filename)
+
+        encoding, data = _negotiate(asset)
+        etag = asset.version + (f"-{encoding}" if encoding else "")
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(data, mimetype=asset.mimetype)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        # Keep this policy (app.add_header makes everything else no-store)
+        g.keep_cache_control = True
+        return response
+
+    app.view_functions['static'] = static
+    return manifest